@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare INSERT-heavy migration throughput across database backends.
+
+Generates a migration of many multi-row INSERT statements into a scratch
+table and applies it once with each installed backend, against a real
+server. Backends whose driver is not installed are skipped.
+
+Usage: python benchmarks/bench_backends.py HOST USER PASSWORD DATABASE
+                                           [statements] [rows_per_statement]
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from migration_runner.backends import BACKENDS, BackendUnavailableError
+from migration_runner.database_tools import DatabaseTools
+
+TABLE = "bench_backends"
+
+
+def write_migration(filename, statements, rows_per_statement):
+    with io.open(filename, 'w') as migration:
+        migration.write(u"DROP TABLE IF EXISTS {table};\n"
+                        u"CREATE TABLE {table} (id INT PRIMARY KEY, "
+                        u"name VARCHAR(64), amount DECIMAL(10, 2));\n"
+                        .format(table=TABLE))
+        row_id = 0
+        for _ in range(statements):
+            values = []
+            for _ in range(rows_per_statement):
+                row_id += 1
+                values.append(u"({id}, 'name-{id}', {amount:.2f})".format(
+                    id=row_id, amount=row_id / 100.0))
+            migration.write(u"INSERT INTO {} VALUES {};\n".format(
+                TABLE, u", ".join(values)))
+        migration.write(u"DROP TABLE {};\n".format(TABLE))
+    return row_id
+
+
+def main(host, user, password, database, statements=2000,
+         rows_per_statement=50):
+    db_params = (host, user, password, database)
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "001.bench.sql")
+    try:
+        rows = write_migration(filename, int(statements),
+                               int(rows_per_statement))
+        print("{} INSERT statements, {} rows, {:.1f} MiB".format(
+            statements, rows, os.path.getsize(filename) / 1048576.0))
+
+        for name in sorted(BACKENDS):
+            database_tools = DatabaseTools(backend=name)
+            try:
+                database_tools.backend.load()
+            except BackendUnavailableError as error:
+                print("{:>18}: skipped ({})".format(name, error))
+                continue
+
+            start = time.time()
+            result = database_tools.apply_migration(db_params, filename)
+            elapsed = time.time() - start
+            print("{:>18}: {:.2f}s, {:.0f} statements/s, {:.0f} rows/s".format(
+                name, elapsed, result.statements / elapsed, rows / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
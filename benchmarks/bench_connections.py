@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare handshakes and wall time per migration with and without a shared
+session, using a stubbed driver which sleeps to simulate handshake latency.
+
+Usage: python benchmarks/bench_connections.py [migrations] [latency_ms]
+"""
+import sys
+import time
+
+import mock
+import mysql.connector
+
+from migration_runner import Controller
+
+DB_PARAMS = ("db_host", "db_user", "db_password", "db_name")
+
+
+def run(controller, migrations, shared_session):
+    if shared_session:
+        with controller.open_session(DB_PARAMS) as session:
+            controller.database.fetch_current_version(DB_PARAMS,
+                                                      session=session)
+            controller.process_migrations(DB_PARAMS, 0, migrations,
+                                          session=session)
+    else:
+        controller.database.fetch_current_version(DB_PARAMS)
+        controller.process_migrations(DB_PARAMS, 0, migrations)
+
+
+def main(count=100, latency_ms=20.0):
+    migrations = [(version, '/dev/null') for version in range(1, count + 1)]
+    controller = Controller()
+
+    def slow_connect(**kwargs):
+        time.sleep(latency_ms / 1000.0)
+        connection = mock.MagicMock()
+        connection.cursor.return_value.fetchone.return_value = (0,)
+        return connection
+
+    with mock.patch.object(mysql.connector, 'connect',
+                           side_effect=slow_connect) as connect:
+        for label, shared_session in (("per-call", False),
+                                      ("session", True)):
+            connect.reset_mock()
+            start = time.time()
+            run(controller, migrations, shared_session)
+            elapsed = time.time() - start
+            print("{label:>10}: {handshakes:>5} handshakes, "
+                  "{per:.2f} ms per migration".format(
+                      label=label, handshakes=connect.call_count,
+                      per=elapsed * 1000.0 / count))
+
+
+if __name__ == "__main__":
+    main(*[float(arg) if i else int(arg)
+           for i, arg in enumerate(sys.argv[1:])])
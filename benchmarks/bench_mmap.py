@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare peak memory and throughput of reading a large migration as text
+with reading it through a memory map as bytes (`--mmap`), and with
+validating it (`--validate`).
+
+Generates a dump-style migration of multi-row INSERT statements with
+non-ASCII strings, then applies it once per path, each in a fresh process
+so that its peak RSS can be measured. No server is needed: statements go
+to a stand-in cursor which, like the drivers, encodes text statements to
+UTF-8 and sends bytes as they are, so only reading, splitting and encoding
+are measured.
+
+Usage: python benchmarks/bench_mmap.py [megabytes] [rows_per_statement]
+"""
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from migration_runner.database_tools import DatabaseTools
+from migration_runner.validation import validate_file
+
+TABLE = "bench_mmap"
+
+PATHS = ('text', 'mmap', 'validate')
+
+
+class Cursor(object):
+    with_rows = False
+    rowcount = 0
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def execute(self, operation, params=None):
+        if not isinstance(operation, bytes):
+            operation = operation.encode('utf-8')
+        self.bytes_sent += len(operation)
+
+    def fetchwarnings(self):
+        return None
+
+
+class Connection(object):
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self):
+        self.cursors.append(Cursor())
+        return self.cursors[-1]
+
+    def close(self):
+        pass
+
+
+def write_migration(filename, megabytes, rows_per_statement):
+    target = megabytes * 1024 * 1024
+    row_id = 0
+    with io.open(filename, 'w', encoding='utf-8') as migration:
+        migration.write(u"CREATE TABLE {} (id INT PRIMARY KEY, "
+                        u"name VARCHAR(64), note TEXT);\n".format(TABLE))
+        while migration.tell() < target:
+            values = []
+            for _ in range(rows_per_statement):
+                row_id += 1
+                values.append(u"({id}, 'naïve-{id}', 'café; crème "
+                              u"brûlée \\'{id}\\'')".format(id=row_id))
+            migration.write(u"INSERT INTO {} VALUES {};\n".format(
+                TABLE, u", ".join(values)))
+    return row_id
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def apply(path, filename):
+    """Apply `filename` along `path` in this process, printing the result
+    as JSON."""
+    if path == 'validate':
+        baseline = peak_rss()
+        start = time.time()
+        validation = validate_file((1, filename, None, True))
+        elapsed = time.time() - start
+        print(json.dumps({
+            'elapsed': elapsed,
+            'statements': validation.statements,
+            'bytes_sent': 0,
+            'peak_rss': peak_rss(),
+            'rss_growth': peak_rss() - baseline,
+        }))
+        return
+
+    database_tools = DatabaseTools(mmap_statements=path == 'mmap')
+    connection = Connection()
+    database_tools.connect_database = lambda db_params: connection
+    baseline = peak_rss()
+
+    start = time.time()
+    result = database_tools.apply_migration(('', '', '', ''), filename)
+    elapsed = time.time() - start
+
+    print(json.dumps({
+        'elapsed': elapsed,
+        'statements': result.statements,
+        'bytes_sent': sum(cursor.bytes_sent for cursor in connection.cursors),
+        'peak_rss': peak_rss(),
+        'rss_growth': peak_rss() - baseline,
+    }))
+
+
+def main(megabytes=256, rows_per_statement=500):
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "001.bench.sql")
+    try:
+        rows = write_migration(filename, int(megabytes),
+                               int(rows_per_statement))
+        size = os.path.getsize(filename)
+        print("{} rows, {:.1f} MiB".format(rows, size / 1048576.0))
+
+        results = {}
+        for path in PATHS:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--apply', path, filename],
+                universal_newlines=True)
+            results[path] = json.loads(output)
+
+        for path in PATHS:
+            result = results[path]
+            print("{:>8}: {:.2f}s, {:.1f} MiB/s, {} statements, peak RSS "
+                  "{:.1f} MiB (+{:.1f} MiB while applying)".format(
+                      path, result['elapsed'],
+                      size / 1048576.0 / result['elapsed'],
+                      result['statements'], result['peak_rss'] / 1048576.0,
+                      result['rss_growth'] / 1048576.0))
+        if results['text']['bytes_sent'] != results['mmap']['bytes_sent']:
+            print("Paths sent different statements!")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--apply']:
+        apply(*sys.argv[2:])
+    else:
+        main(*sys.argv[1:])
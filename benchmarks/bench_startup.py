@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Report the import cost of the CLI entry point using `python -X importtime`.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+import subprocess
+import sys
+
+
+def cumulative_import_times(module):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(runs=10):
+    totals = []
+    for _ in range(runs):
+        times = cumulative_import_times('migration_runner.cli')
+        totals.append(times['migration_runner.cli'])
+
+    totals.sort()
+    print("migration_runner.cli import: median {:.1f} ms, best {:.1f} ms "
+          "over {} runs".format(totals[len(totals) // 2] / 1000.0,
+                                totals[0] / 1000.0, runs))
+
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)
+    print("Largest cumulative imports in last run:")
+    for name, cumulative in slowest[1:11]:
+        print("  {:>8.1f} ms  {}".format(cumulative / 1000.0, name))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -6,8 +6,43 @@ __author__ = """Andrew Beveridge"""
 __email__ = 'andrew@beveridge.uk'
 __version__ = '0.3.4'
 
-# flake8: noqa
-from .cli import main
-from .controller import Controller
-from .database_tools import DatabaseTools
-from .helpers import Helpers
+import importlib
+import sys
+
+# Public names and the submodules providing them. These are imported on
+# first use so that, for example, `migration_runner --help` never has to
+# load the database driver.
+_LAZY_ATTRIBUTES = {
+    'main': 'cli',
+    'Controller': 'controller',
+    'DatabaseTools': 'database_tools',
+    'Helpers': 'helpers',
+    'MigrationRunner': 'api',
+    'MigrationRunnerError': 'errors',
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    module = importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover
+    # Module-level __getattr__ (PEP 562) is unavailable, so import eagerly
+    from .cli import main  # noqa: F401
+    from .controller import Controller  # noqa: F401
+    from .database_tools import DatabaseTools  # noqa: F401
+    from .helpers import Helpers  # noqa: F401
+    from .api import MigrationRunner  # noqa: F401
+    from .errors import MigrationRunnerError  # noqa: F401
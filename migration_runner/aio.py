@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""asyncio engine for driving many database sessions from one event loop.
+
+Requires Python 3.5+ and, unless another `connect` coroutine is supplied,
+the optional `aiomysql` package.
+"""
+import asyncio
+import io
+import itertools
+import logging
+from timeit import default_timer
+
+from migration_runner.data import (DEFAULT_BATCH_SIZE, DataMigrationError,
+                                   data_batches, insert_statement,
+                                   is_data_migration, read_data_spec)
+from migration_runner.database_tools import UPDATE_VERSION_SQL
+from migration_runner.fanout import (TargetLoggerAdapter, TargetResult,
+                                     target_name)
+from migration_runner.helpers import Helpers
+from migration_runner.results import (MigrationResult, StatementResult,
+                                      statement_checksum)
+from migration_runner.statements import (IncompleteStatementError,
+                                         split_statements)
+
+# Statements read from a migration file per trip to the executor
+READ_AHEAD = 100
+
+# asyncio.get_running_loop() is only available from Python 3.7
+running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def open_migration(sql_filename, data_migration=False):
+    """Open a migration file as DatabaseTools would: with `newline=''` for
+    data migrations."""
+    if data_migration:
+        return io.open(sql_filename, encoding='utf-8', newline='')
+    return io.open(sql_filename)
+
+
+def read_ahead(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+class AsyncDatabaseTools:
+    """Async counterpart of DatabaseTools. CSV data migrations are always
+    loaded with batched INSERTs."""
+
+    def __init__(self, logger=None, connect=None, error_class=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        if connect is None:
+            import aiomysql
+
+            connect = aiomysql.connect
+            error_class = aiomysql.Error
+        self._connect = connect
+        self.Error = error_class or Exception
+        self.batch_size = batch_size
+
+    async def connect_database(self, db_params):
+        host, user, password, name = db_params
+        self.logger.debug(
+            "Connecting to database with details: "
+            "user={user}, host={host}, db={db}".format(
+                user=user, host=host, db=name)
+        )
+        return await self._connect(host=host, user=user, password=password,
+                                   db=name, autocommit=True)
+
+    async def fetch_current_version(self, db_connection):
+        current_db_version = 0
+        try:
+            cursor = await db_connection.cursor()
+            await cursor.execute("SELECT version FROM versionTable LIMIT 1")
+            current_db_version = int((await cursor.fetchone())[0])
+        except self.Error as error:
+            self.logger.error(
+                "{} while attempting to fetch database version, assuming"
+                " version 0: {}".format(type(error).__name__, error)
+            )
+        return current_db_version
+
+    async def execute_statement(self, cursor, index, statement):
+        start = default_timer()
+        await cursor.execute(statement)
+        if cursor.description is not None:
+            await cursor.fetchall()
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=cursor.rowcount,
+            warnings=getattr(cursor, 'warning_count', 0),
+            elapsed=elapsed
+        )
+
+    async def execute_batch(self, cursor, index, statement, rows):
+        start = default_timer()
+        await cursor.executemany(statement, rows)
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=cursor.rowcount,
+            warnings=getattr(cursor, 'warning_count', 0),
+            elapsed=elapsed
+        )
+
+    @property
+    def migration_errors(self):
+        """Exceptions which fail the migration being applied, as for
+        DatabaseTools."""
+        return (self.Error, DataMigrationError, IncompleteStatementError,
+                UnicodeDecodeError)
+
+    async def apply_migration(self, db_connection, sql_filename,
+                              version=None):
+        result = MigrationResult(sql_filename)
+        data_migration = is_data_migration(sql_filename)
+        loop = running_loop()
+        # The file is opened and read in the default executor, a batch of
+        # statements or rows at a time, so that other sessions are not
+        # stalled on disk I/O and memory does not grow with the file size
+        migration_file = await loop.run_in_executor(
+            None, open_migration, sql_filename, data_migration)
+
+        with migration_file:
+            cursor = await db_connection.cursor()
+            if version is not None:
+                await db_connection.begin()
+            try:
+                if data_migration:
+                    spec = await loop.run_in_executor(
+                        None, read_data_spec, migration_file, sql_filename)
+                    statement = insert_statement(spec)
+                    batches = data_batches(spec, migration_file,
+                                           spec.batch_size or self.batch_size)
+                    for index in itertools.count():
+                        rows = await loop.run_in_executor(
+                            None, next, batches, None)
+                        if rows is None:
+                            break
+                        result.record(await self.execute_batch(
+                            cursor, index, statement, rows))
+                else:
+                    statements = split_statements(migration_file)
+                    index = 0
+                    while True:
+                        batch = await loop.run_in_executor(
+                            None, read_ahead, statements, READ_AHEAD)
+                        if not batch:
+                            break
+                        for statement in batch:
+                            result.record(await self.execute_statement(
+                                cursor, index, statement))
+                            index += 1
+                if version is not None:
+                    await cursor.execute(UPDATE_VERSION_SQL, (version,))
+                    await db_connection.commit()
+            except self.migration_errors:
+                if version is not None:
+                    await db_connection.rollback()
+                raise
+        return result
+
+
+class AsyncController:
+    """Async counterpart of Controller with the same planning semantics.
+
+    Each target gets one connection for the whole run, and the version bump
+    is committed together with each migration's statements.
+    """
+
+    def __init__(self, logger=None, database=None, manifest_path=None):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.helpers = Helpers(logger, manifest_path=manifest_path)
+        if database is None:
+            self.database = AsyncDatabaseTools(logger)
+        else:
+            self.database = database
+
+    async def process_migrations(self, db_connection, db_version,
+                                 unprocessed_migrations, logger=None):
+        logger = logger or self.logger
+        total_processed = 0
+        for version_code, sql_filename in unprocessed_migrations:
+            try:
+                result = await self.database.apply_migration(
+                    db_connection, sql_filename, version=version_code)
+            except self.database.migration_errors as error:
+                logger.error(
+                    "{type} while processing migration in file: '{file}': "
+                    "{error}".format(type=type(error).__name__,
+                                     file=sql_filename,
+                                     error=error))
+                break
+            logger.info(
+                "Upgraded DB version from {old} to {new} by executing file: "
+                "'{file}' ({summary})".format(
+                    old=db_version, new=version_code, file=sql_filename,
+                    summary=result.summary())
+            )
+            db_version = version_code
+            total_processed += 1
+        return db_version, total_processed
+
+    async def process_planned_migrations(self, db_params, migrations,
+                                         logger=None):
+        logger = logger or self.logger
+        db_connection = await self.database.connect_database(db_params)
+        try:
+            db_version = await self.database.fetch_current_version(
+                db_connection)
+            unprocessed = self.helpers.get_unprocessed_migrations(
+                db_version, migrations)
+            logger.info(
+                "Starting with database version: {version}, migrations yet "
+                "to be processed: {unprocessed}".format(
+                    version=db_version, unprocessed=len(unprocessed))
+            )
+            db_version, total_processed = await self.process_migrations(
+                db_connection, db_version, unprocessed, logger=logger)
+        finally:
+            db_connection.close()
+
+        return db_version, total_processed, len(unprocessed) - total_processed
+
+    async def process_migrations_in_directory(self, db_params, sql_directory):
+        migrations = self.helpers.populate_migrations(sql_directory)
+        return await self.process_planned_migrations(db_params, migrations)
+
+    async def process_target(self, db_params, migrations, semaphore):
+        name = target_name(db_params)
+        logger = TargetLoggerAdapter(self.logger, {'target': name})
+        async with semaphore:
+            start = default_timer()
+            try:
+                db_version, processed, remaining = \
+                    await self.process_planned_migrations(
+                        db_params, migrations, logger=logger)
+                error = "migration failed" if remaining else None
+            except Exception as exception:
+                self.logger.error("[{}] {}: {}".format(
+                    name, type(exception).__name__, exception))
+                db_version, processed, remaining = None, 0, None
+                error = type(exception).__name__
+        return TargetResult(name, db_version, processed, remaining,
+                            default_timer() - start, error)
+
+    async def process_targets(self, targets, sql_directory, concurrency=100):
+        migrations = self.helpers.populate_migrations(sql_directory)
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[
+            self.process_target(db_params, migrations, semaphore)
+            for db_params in targets
+        ])
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Python API for running migrations from a long-lived program.
+
+Unlike the CLI, nothing here exits the process: a database which cannot be
+connected to, or a migrations directory which cannot be read, raises a
+`MigrationRunnerError`, and the outcome of every pending migration is
+returned in a `RunResult`. Many runs can share one `MigrationRunner`,
+including from several threads at once::
+
+    runner = MigrationRunner(ledger=True)
+    result = runner.run(('db_host', 'db_user', 'db_password', 'db_name'),
+                        './sql-migrations')
+    if not result.succeeded:
+        raise result.failed[0].error
+"""
+import logging
+import os
+import threading
+from collections import namedtuple
+from timeit import default_timer
+
+from migration_runner.controller import Controller
+from migration_runner.data import DEFAULT_BATCH_SIZE, DEFAULT_DATA_METHOD
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.results import APPLIED, FAILED, SKIPPED
+from migration_runner.status import DEFAULT_STATUS_TTL, status_target
+
+
+class RunResult(namedtuple('RunResult', [
+    'target', 'db_version', 'migrations', 'elapsed'
+])):
+    """The result of one run against one database: its version afterwards
+    and a `MigrationOutcome` for each migration which was pending."""
+
+    __slots__ = ()
+
+    def _with_status(self, status):
+        return [outcome for outcome in self.migrations
+                if outcome.status == status]
+
+    @property
+    def applied(self):
+        return self._with_status(APPLIED)
+
+    @property
+    def failed(self):
+        return self._with_status(FAILED)
+
+    @property
+    def skipped(self):
+        return self._with_status(SKIPPED)
+
+    @property
+    def succeeded(self):
+        return not self.failed and not self.skipped
+
+
+class MigrationRunner:
+    """Apply migrations to databases, configured once with the options of
+    the CLI's `run` command.
+
+    Each call uses a fresh `Controller`, so calls may run concurrently. The
+    migrations found in a directory are kept and reused for as long as the
+    directory's inode and modification time are unchanged, that is until a
+    file is added, removed or renamed, or the directory replaced.
+    """
+
+    def __init__(self, logger=None, backend=None, inline_version_update=False,
+                 manifest_path=None, data_method=DEFAULT_DATA_METHOD,
+                 batch_size=DEFAULT_BATCH_SIZE, coalesce_inserts=False,
+                 parallel=1, online_schema_change=None, checkpoint=False,
+                 ledger=False, baseline=True, status_cache_path=None,
+                 validate=False, validate_workers=None,
+                 mmap_statements=False):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.options = dict(
+            backend=backend, inline_version_update=inline_version_update,
+            manifest_path=manifest_path, data_method=data_method,
+            batch_size=batch_size, coalesce_inserts=coalesce_inserts,
+            parallel=parallel, online_schema_change=online_schema_change,
+            checkpoint=checkpoint, ledger=ledger, baseline=baseline,
+            status_cache_path=status_cache_path, validate=validate,
+            validate_workers=validate_workers,
+            mmap_statements=mmap_statements)
+        self._migrations = {}
+        self._lock = threading.Lock()
+
+    def controller(self):
+        controller = Controller(self.logger, **self.options)
+        # Any error applying a migration becomes its FAILED outcome, rather
+        # than losing the outcomes of the whole run
+        controller.migration_errors += (MigrationRunnerError,)
+        return controller
+
+    def migrations(self, controller, sql_directory):
+        if self.options['manifest_path'] is not None:
+            # The manifest already caches the directory, and the controller
+            # needs it loaded for checksums
+            return controller.helpers.populate_migrations(sql_directory)
+
+        directory = os.path.abspath(sql_directory)
+        stat = os.stat(directory)
+        # Float mtimes cannot tell apart changes a few nanoseconds apart, and
+        # a directory replaced by another may have the same mtime
+        key = (stat.st_ino, getattr(stat, 'st_mtime_ns', stat.st_mtime))
+        with self._lock:
+            cached = self._migrations.get(directory)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        migrations = controller.helpers.populate_migrations(sql_directory)
+        with self._lock:
+            self._migrations[directory] = (key, migrations)
+        return migrations
+
+    def run(self, db_params, sql_directory):
+        """Apply the pending migrations in `sql_directory`, returning a
+        `RunResult`. Raises `DatabaseConnectionError` if the database cannot
+        be connected to."""
+        start = default_timer()
+        controller = self.controller()
+        db_version, _, _ = controller.process_planned_migrations(
+            db_params, self.migrations(controller, sql_directory),
+            baselines=controller.find_baselines(sql_directory))
+        return RunResult(status_target(db_params), db_version,
+                         list(controller.outcomes), default_timer() - start)
+
+    def plan(self, db_params, sql_directory):
+        """Return the `MigrationPlan` of pending migrations, applying
+        nothing."""
+        return self.controller().plan_migrations(db_params, sql_directory)
+
+    def verify(self, db_params, sql_directory):
+        """Return the `Verification` of the appliedMigrations ledger against
+        `sql_directory`."""
+        return self.controller().verify_migrations(db_params, sql_directory)
+
+    def status(self, db_params, ttl=DEFAULT_STATUS_TTL):
+        """Return the cached `SchemaStatus` of the database."""
+        return self.controller().status(db_params, ttl=ttl)
+
+
+def run_migrations(db_params, sql_directory, **options):
+    """Apply the pending migrations in `sql_directory` with a one-off
+    `MigrationRunner` configured with `options`."""
+    return MigrationRunner(**options).run(db_params, sql_directory)
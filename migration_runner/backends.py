@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import importlib
+
+from migration_runner.errors import MigrationRunnerError
+
+DEFAULT_BACKEND = 'mysql-connector'
+
+
+class BackendUnavailableError(MigrationRunnerError, ImportError):
+    """Raised when the driver behind a backend cannot be imported."""
+
+
+class MySQLConnectorBackend:
+    """mysql-connector-python, as vendored in `deps/` (the default).
+
+    Each backend wraps one DB-API driver behind the handful of calls
+    `DatabaseTools` and `DatabaseSession` make beyond PEP 249, and exposes
+    the driver's base `Error` class and MySQL client error codes, so callers
+    handle failures identically whichever driver is in use.
+    The driver itself is only imported on first use.
+    """
+
+    name = 'mysql-connector'
+    module_name = 'mysql.connector'
+    connect_options = {}
+
+    def __init__(self):
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self.module_name)
+            except ImportError as error:
+                raise BackendUnavailableError(
+                    "Driver '{}' for backend '{}' is not installed: "
+                    "{}".format(self.module_name, self.name, error))
+        return self._module
+
+    @property
+    def Error(self):
+        return self.load().Error
+
+    def connect(self, host, user, password, database, local_infile=False):
+        options = dict(self.connect_options)
+        if local_infile:
+            options['allow_local_infile'] = True
+        connection = self.load().connect(user=user, password=password,
+                                         host=host, database=database,
+                                         **options)
+        connection.autocommit = True
+        connection.get_warnings = True
+        return connection
+
+    @staticmethod
+    def start_transaction(connection):
+        connection.start_transaction()
+
+    @staticmethod
+    def ping(connection):
+        connection.ping()
+
+    @staticmethod
+    def has_rows(cursor):
+        return cursor.with_rows
+
+    @staticmethod
+    def warning_count(cursor):
+        return len(cursor.fetchwarnings() or ())
+
+    @staticmethod
+    def error_code(error):
+        return getattr(error, 'errno', None)
+
+
+class MySQLConnectorCBackend(MySQLConnectorBackend):
+    """mysql-connector-python using its C extension for protocol parsing."""
+
+    name = 'mysql-connector-c'
+    connect_options = {'use_pure': False}
+
+    def load(self):
+        module = super(MySQLConnectorCBackend, self).load()
+        if not getattr(module, 'HAVE_CEXT', False):
+            raise BackendUnavailableError(
+                "Backend '{}' requires the mysql-connector C extension, "
+                "which is not available".format(self.name))
+        return module
+
+
+class DBAPIBackend(MySQLConnectorBackend):
+    """Common behaviour for drivers following PEP 249 more strictly, which
+    report MySQL error codes as the first exception argument."""
+
+    charset = 'utf8mb4'
+
+    @staticmethod
+    def start_transaction(connection):
+        cursor = connection.cursor()
+        cursor.execute("START TRANSACTION")
+        cursor.close()
+
+    @staticmethod
+    def has_rows(cursor):
+        return cursor.description is not None
+
+    @staticmethod
+    def error_code(error):
+        if error.args and isinstance(error.args[0], int):
+            return error.args[0]
+        return None
+
+
+class MySQLdbBackend(DBAPIBackend):
+    """mysqlclient (`MySQLdb`), a C wrapper around libmysqlclient."""
+
+    name = 'mysqlclient'
+    module_name = 'MySQLdb'
+
+    def connect(self, host, user, password, database, local_infile=False):
+        connection = self.load().connect(user=user, passwd=password,
+                                         host=host, db=database,
+                                         charset=self.charset,
+                                         local_infile=int(local_infile))
+        connection.autocommit(True)
+        return connection
+
+    @staticmethod
+    def warning_count(cursor):
+        return cursor.connection.warning_count()
+
+
+class PyMySQLBackend(DBAPIBackend):
+    """PyMySQL, a pure-Python driver."""
+
+    name = 'pymysql'
+    module_name = 'pymysql'
+
+    def connect(self, host, user, password, database, local_infile=False):
+        return self.load().connect(user=user, password=password, host=host,
+                                   database=database, charset=self.charset,
+                                   autocommit=True, local_infile=local_infile)
+
+    @staticmethod
+    def ping(connection):
+        # PyMySQL reconnects silently by default; leave that to the session
+        connection.ping(reconnect=False)
+
+    @staticmethod
+    def warning_count(cursor):
+        result = getattr(cursor, '_result', None)
+        return getattr(result, 'warning_count', 0) or 0
+
+
+BACKENDS = dict((backend.name, backend) for backend in (
+    MySQLConnectorBackend,
+    MySQLConnectorCBackend,
+    MySQLdbBackend,
+    PyMySQLBackend,
+))
+
+
+def get_backend(backend=None):
+    """Return a backend instance given its name, or an instance as-is."""
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if not isinstance(backend, str):
+        return backend
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError("Unknown database backend '{}', expected one of: "
+                         "{}".format(backend, ", ".join(sorted(BACKENDS))))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import io
+import logging
+import os
+import re
+from collections import namedtuple
+
+from migration_runner.chunked import sql_literal
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.online import quote
+
+BASELINE_DIRECTORY = 'baselines'
+
+BASELINE_FILENAME = re.compile(r'^(\d+)\.baseline\.sql$')
+
+HEADER = re.compile(r'^--\s*(baseline|fingerprint):\s*(\S*)\s*$',
+                    re.IGNORECASE)
+
+DEFINER = re.compile(r'\s+DEFINER\s*=\s*(?:`[^`]*`|\'[^\']*\'|[^\s@]+)'
+                     r'@(?:`[^`]*`|\'[^\']*\'|\S+)', re.IGNORECASE)
+
+# Progress tables kept by the runner itself, which never belong in a
+# baseline; versionTable is dumped, so a loaded baseline carries its version
+BOOKKEEPING_TABLES = ('appliedMigrations', 'migrationCheckpoint',
+                      'migrationProgress')
+
+# Tables which may exist in a database that has had no migrations applied
+EMPTY_DATABASE_TABLES = BOOKKEEPING_TABLES + ('versionTable',)
+
+# Largest INSERT written, well under the default max_allowed_packet
+DEFAULT_INSERT_BYTES = 1024 * 1024
+
+Baseline = namedtuple('Baseline', ['version', 'path', 'fingerprint'])
+
+
+class BaselineError(MigrationRunnerError, ValueError):
+    """Raised when a baseline cannot be written or read."""
+
+
+def baseline_path(sql_directory, version):
+    return os.path.join(sql_directory, BASELINE_DIRECTORY,
+                        "{:03d}.baseline.sql".format(version))
+
+
+def migrations_fingerprint(migrations, version, checksum):
+    """Checksum over the versions and file checksums of every migration up
+    to `version`, so a baseline is only used with the migrations it was
+    taken from."""
+    digest = hashlib.sha256()
+    for migration_version, path in migrations:
+        if migration_version <= version:
+            digest.update("{} {}\n".format(
+                migration_version, checksum(path)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def read_baseline(path):
+    headers = {}
+    with io.open(path, encoding='utf-8') as baseline_file:
+        for line in baseline_file:
+            if not line.startswith('--'):
+                break
+            match = HEADER.match(line.strip())
+            if match:
+                headers[match.group(1).lower()] = match.group(2)
+
+    try:
+        return Baseline(int(headers['baseline']), path,
+                        headers['fingerprint'])
+    except (KeyError, ValueError):
+        raise BaselineError(
+            "Baseline file '{}' does not start with '-- baseline:' and "
+            "'-- fingerprint:' headers".format(path))
+
+
+def find_baselines(sql_directory):
+    """Return the baselines in the `baselines` subdirectory of
+    `sql_directory`, newest first."""
+    directory = os.path.join(sql_directory, BASELINE_DIRECTORY)
+    if not os.path.isdir(directory):
+        return []
+    baselines = [read_baseline(os.path.join(directory, filename))
+                 for filename in os.listdir(directory)
+                 if BASELINE_FILENAME.match(filename)]
+    return sorted(baselines, key=lambda baseline: baseline.version,
+                  reverse=True)
+
+
+def select_baseline(baselines, migrations, checksum, logger):
+    """Return the newest of `baselines` taken from the same migrations as
+    those in `migrations`, or None."""
+    for baseline in baselines:
+        if migrations_fingerprint(migrations, baseline.version,
+                                  checksum) == baseline.fingerprint:
+            return baseline
+        logger.warning(
+            "Ignoring baseline file: '{file}', as migrations up to version "
+            "{version} have changed since it was written".format(
+                file=baseline.path, version=baseline.version))
+    return None
+
+
+def list_tables(cursor):
+    """Return (name, type) pairs for the tables and views of the current
+    database."""
+    cursor.execute("SHOW FULL TABLES")
+    return [(name, table_type) for name, table_type in cursor.fetchall()]
+
+
+def dump_literal(value):
+    if isinstance(value, datetime.timedelta):
+        # TIME columns, which str() would render as "1 day, 2:00:00"
+        seconds = int(value.total_seconds())
+        sign = '-' if seconds < 0 else ''
+        hours, remainder = divmod(abs(seconds), 3600)
+        return "'{}{:02d}:{:02d}:{:02d}.{:06d}'".format(
+            sign, hours, remainder // 60, remainder % 60,
+            value.microseconds)
+    if isinstance(value, (set, frozenset)):
+        return sql_literal(','.join(sorted(value)))
+    return sql_literal(value)
+
+
+def order_views(views):
+    """Order (name, create statement) pairs so that each view is created
+    after any other view it selects from."""
+    ordered = []
+    remaining = list(views)
+    while remaining:
+        for view in remaining:
+            if not any(quote(name) in view[1] for name, _ in remaining
+                       if name != view[0]):
+                break
+        else:
+            # A cycle cannot be created in MySQL, so only reached on
+            # unexpected input; keep the remaining views in name order
+            view = remaining[0]
+        remaining.remove(view)
+        ordered.append(view)
+    return ordered
+
+
+class BaselineDumper:
+    """Write the schema and rows of a database to a baseline file.
+
+    The file holds plain SQL, applied like any other migration: every table
+    is dropped and recreated, its rows inserted with multi-row INSERTs of up
+    to `insert_bytes` bytes, then views, triggers, stored procedures and
+    functions are created. Definers are left out, so objects are created
+    as the user loading the baseline.
+    """
+
+    def __init__(self, database, logger=None,
+                 insert_bytes=DEFAULT_INSERT_BYTES):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.database = database
+        self.insert_bytes = insert_bytes
+
+    def dump(self, db_params, output, version, fingerprint):
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        db_connection = self.database.open_connection(db_params)
+        cursor = db_connection.cursor()
+        temp_path = output + '.tmp'
+        try:
+            with io.open(temp_path, 'w', encoding='utf-8') as baseline_file:
+                self.write(cursor, baseline_file, version, fingerprint)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        finally:
+            self.database.release_connection(db_connection)
+        if os.path.exists(output):
+            os.remove(output)
+        os.rename(temp_path, output)
+        return Baseline(version, output, fingerprint)
+
+    def write(self, cursor, baseline_file, version, fingerprint):
+        baseline_file.write(
+            u"-- baseline: {version}\n"
+            u"-- fingerprint: {fingerprint}\n"
+            u"-- Schema and data at version {version}, written by "
+            u"migration_runner squash\n"
+            u"SET FOREIGN_KEY_CHECKS = 0;\n"
+            u"SET UNIQUE_CHECKS = 0;\n".format(version=version,
+                                               fingerprint=fingerprint))
+
+        tables = 0
+        views = []
+        rows = 0
+        for name, table_type in sorted(list_tables(cursor)):
+            if table_type == 'VIEW':
+                cursor.execute("SHOW CREATE VIEW {}".format(quote(name)))
+                views.append((name, cursor.fetchall()[0][1]))
+            elif name not in BOOKKEEPING_TABLES:
+                rows += self.write_table(cursor, baseline_file, name)
+                tables += 1
+
+        for name, _ in views:
+            # Views may select from each other, so first drop them all
+            baseline_file.write(u"\nDROP VIEW IF EXISTS {};\n".format(
+                quote(name)))
+        for name, create_statement in order_views(views):
+            baseline_file.write(u"{};\n".format(
+                DEFINER.sub('', create_statement)))
+
+        programs = self.write_programs(cursor, baseline_file)
+        baseline_file.write(u"\nSET UNIQUE_CHECKS = 1;\n"
+                            u"SET FOREIGN_KEY_CHECKS = 1;\n")
+
+        self.logger.info(
+            "Wrote {tables} tables with {rows} rows, {views} views and "
+            "{programs} triggers and stored programs".format(
+                tables=tables, rows=rows, views=len(views),
+                programs=programs))
+
+    def write_table(self, cursor, baseline_file, name):
+        cursor.execute("SHOW CREATE TABLE {}".format(quote(name)))
+        baseline_file.write(u"\nDROP TABLE IF EXISTS {table};\n{create};\n"
+                            .format(table=quote(name),
+                                    create=cursor.fetchall()[0][1]))
+
+        # Generated columns are computed again when rows are inserted
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "AND INSTR(EXTRA, 'GENERATED') = 0 "
+            "ORDER BY ORDINAL_POSITION", (name,))
+        columns = [quote(row[0]) for row in cursor.fetchall()]
+        head = u"INSERT INTO {table} ({columns}) VALUES\n".format(
+            table=quote(name), columns=', '.join(columns))
+
+        cursor.execute("SELECT {columns} FROM {table}".format(
+            columns=', '.join(columns), table=quote(name)))
+        rows = 0
+        size = 0
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            for row in batch:
+                values = u"({})".format(', '.join(
+                    dump_literal(value) for value in row))
+                if size and size + len(values) > self.insert_bytes:
+                    baseline_file.write(u";\n")
+                    size = 0
+                if size:
+                    baseline_file.write(u",\n")
+                else:
+                    baseline_file.write(head)
+                baseline_file.write(values)
+                size += len(values) + 2
+                rows += 1
+        if size:
+            baseline_file.write(u";\n")
+        return rows
+
+    def write_programs(self, cursor, baseline_file):
+        programs = []
+        cursor.execute("SHOW TRIGGERS")
+        programs.extend(('TRIGGER', row[0]) for row in cursor.fetchall())
+        for kind in ('PROCEDURE', 'FUNCTION'):
+            cursor.execute("SHOW {} STATUS WHERE Db = DATABASE()".format(kind))
+            programs.extend((kind, row[1]) for row in cursor.fetchall())
+        if not programs:
+            return 0
+
+        baseline_file.write(u"\nDELIMITER ;;\n")
+        for kind, name in programs:
+            cursor.execute("SHOW CREATE {kind} {name}".format(
+                kind=kind, name=quote(name)))
+            baseline_file.write(u"DROP {kind} IF EXISTS {name};;\n{create};;\n"
+                                .format(kind=kind, name=quote(name),
+                                        create=DEFINER.sub(
+                                            '', cursor.fetchall()[0][2])))
+        baseline_file.write(u"DELIMITER ;\n")
+        return len(programs)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.results import statement_checksum
+
+CREATE_CHECKPOINT_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS migrationCheckpoint ("
+    "version INT NOT NULL PRIMARY KEY, "
+    "statement_index INT NOT NULL, "
+    "checksum CHAR(64) NOT NULL)"
+)
+
+
+class CheckpointError(MigrationRunnerError, ValueError):
+    """Raised when a migration no longer matches the statements recorded as
+    completed by an earlier, interrupted run."""
+
+
+class StatementCheckpoint:
+    """Statement-level progress through one migration, kept in
+    `migrationCheckpoint`.
+
+    After each statement the number of statements completed and a checksum
+    over all of them is saved, on the migration's own connection, so it is
+    committed exactly when the statements are. A later run of the same
+    version skips the completed statements, provided the file still starts
+    with the same statements, and the row is deleted once the migration
+    completes.
+    """
+
+    def __init__(self, cursor, version, sql_filename, logger):
+        self.cursor = cursor
+        self.version = version
+        self.sql_filename = sql_filename
+        self.logger = logger
+        self.completed = 0
+        self.checksum = None
+        self._digest = hashlib.sha256()
+
+        cursor.execute(CREATE_CHECKPOINT_TABLE_SQL)
+        cursor.execute(
+            "SELECT statement_index, checksum FROM migrationCheckpoint "
+            "WHERE version = %s", (version,))
+        rows = cursor.fetchall()
+        if rows:
+            self.completed, self.checksum = int(rows[0][0]), rows[0][1]
+
+    def _verify(self, skipped):
+        if skipped < self.completed or \
+                self._digest.hexdigest() != self.checksum:
+            raise CheckpointError(
+                "Migration {version} in file: '{file}' no longer matches the "
+                "{completed} statements completed by an earlier run; delete "
+                "its row from migrationCheckpoint to run it from the "
+                "start".format(version=self.version, file=self.sql_filename,
+                               completed=self.completed))
+
+    def pending(self, statements):
+        """Yield the `(index, statement)` pairs not yet completed."""
+        if self.completed:
+            self.logger.info(
+                "Resuming migration {version} in file: '{file}' after "
+                "{completed} completed statements".format(
+                    version=self.version, file=self.sql_filename,
+                    completed=self.completed))
+
+        skipped = 0
+        verified = not self.completed
+        for index, statement in statements:
+            if index < self.completed:
+                self._digest.update(
+                    statement_checksum(statement).encode('ascii'))
+                skipped += 1
+                continue
+            if not verified:
+                self._verify(skipped)
+                verified = True
+            yield index, statement
+        if not verified:
+            self._verify(skipped)
+
+    def save(self, index, statement):
+        self._digest.update(statement_checksum(statement).encode('ascii'))
+        self.cursor.execute(
+            "REPLACE INTO migrationCheckpoint (version, statement_index, "
+            "checksum) VALUES (%s, %s, %s)",
+            (self.version, index + 1, self._digest.hexdigest()))
+
+    def clear(self):
+        self.cursor.execute(
+            "DELETE FROM migrationCheckpoint WHERE version = %s",
+            (self.version,))
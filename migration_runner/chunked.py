@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""Chunked migrations: UPDATE and DELETE backfills run in primary key
+ranges, so no single statement holds locks on, or writes undo and binlog
+for, a whole large table.
+
+A migration opts in with header comments before its first statement:
+
+    -- chunked: orders
+    -- chunk_size: 5000
+    -- chunk_sleep: 0.2
+    -- max_threads_running: 30
+    UPDATE orders SET total = price * quantity WHERE total IS NULL;
+
+`chunked` names the table and is required. Each single-table UPDATE or
+DELETE of that table in the file is run once per range of `chunk_size`
+primary keys (default 1000), sleeping `chunk_sleep` seconds between ranges
+and waiting while the server has more than `max_threads_running` threads
+running. The last completed range is recorded in `migrationProgress`, so a
+statement interrupted part way resumes from there on the next run.
+"""
+import binascii
+import io
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from timeit import default_timer
+
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.online import (IDENTIFIER, Throttle, estimate_rows,
+                                     primary_key_columns, quote, unquote)
+from migration_runner.results import statement_checksum
+
+DIRECTIVES = ('chunked', 'chunk_size', 'chunk_sleep', 'max_threads_running')
+
+DIRECTIVE = re.compile(r'^\s*--\s*(\w+)\s*:(.*)$')
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Session variables holding each column of the bounds of the current chunk
+LOWER_VARIABLE = '@chunk_lower_{}'
+UPPER_VARIABLE = '@chunk_upper_{}'
+
+CREATE_PROGRESS_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS migrationProgress ("
+    "migration VARCHAR(255) NOT NULL, "
+    "statement_checksum CHAR(64) NOT NULL, "
+    "last_key TEXT NOT NULL, "
+    "rows_affected BIGINT NOT NULL, "
+    "PRIMARY KEY (migration, statement_checksum))"
+)
+
+TABLE_NAME = IDENTIFIER + r'(?:\s*\.\s*' + IDENTIFIER + r')?'
+
+KEYWORDS = (r'(?:SET|WHERE|ORDER|LIMIT|USING|PARTITION|JOIN|INNER|LEFT|'
+            r'RIGHT|CROSS|NATURAL|STRAIGHT_JOIN)\b')
+
+ALIAS = r'(?:\s+(?:AS\s+)?(?!' + KEYWORDS + r')(' + IDENTIFIER + r'))?'
+
+UPDATE = re.compile(
+    r'^\s*UPDATE\s+(?:(?:LOW_PRIORITY|IGNORE)\s+)*(' + TABLE_NAME + r')' +
+    ALIAS + r'\s+SET\b',
+    re.IGNORECASE
+)
+
+DELETE = re.compile(
+    r'^\s*DELETE\s+(?:(?:LOW_PRIORITY|QUICK|IGNORE)\s+)*FROM\s+(' +
+    TABLE_NAME + r')' + ALIAS + r'(?=\s|$)',
+    re.IGNORECASE
+)
+
+WRITE = re.compile(r'^\s*(?:UPDATE|DELETE)\b', re.IGNORECASE)
+
+WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+
+UNSUPPORTED = re.compile(r'\bORDER\s+BY\b|\bLIMIT\b', re.IGNORECASE)
+
+TABLE_LIST_END = re.compile(r'\bSET\b|\bWHERE\b', re.IGNORECASE)
+
+QUOTED_OR_COMMENT = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`|"
+    r"/\*.*?\*/|(?:--\s|#)[^\n]*",
+    re.DOTALL
+)
+
+COMMENT = re.compile(r'^(?:/\*|--\s|#)')
+
+ChunkSpec = namedtuple('ChunkSpec', [
+    'table', 'chunk_size', 'chunk_sleep', 'max_threads_running'
+])
+
+ChunkedStatement = namedtuple('ChunkedStatement', [
+    'schema', 'table', 'reference', 'qualifier', 'head', 'condition'
+])
+
+
+class ChunkedMigrationError(MigrationRunnerError, ValueError):
+    """Raised when a chunked migration's directives or statements cannot
+    be run in primary key ranges."""
+
+
+def read_chunk_spec(path):
+    """Return the `ChunkSpec` from the header comments of the migration at
+    `path`, or None if it has no `-- chunked:` directive."""
+    directives = {}
+    with io.open(path) as migration_file:
+        for line in migration_file:
+            if not line.strip():
+                continue
+            if not line.lstrip().startswith(('--', '#')):
+                break
+            match = DIRECTIVE.match(line)
+            if match and match.group(1).lower() in DIRECTIVES:
+                directives[match.group(1).lower()] = match.group(2).strip()
+
+    if 'chunked' not in directives:
+        return None
+    if not directives['chunked']:
+        raise ChunkedMigrationError(
+            "Migration '{}' has an empty '-- chunked:' directive".format(path))
+
+    def number(key, convert, default, minimum):
+        if key not in directives:
+            return default
+        try:
+            value = convert(directives[key])
+        except ValueError:
+            value = None
+        if value is None or value < minimum:
+            raise ChunkedMigrationError(
+                "Invalid {} '{}' in migration '{}'".format(
+                    key, directives[key], path))
+        return value
+
+    return ChunkSpec(
+        table=directives['chunked'],
+        chunk_size=number('chunk_size', int, DEFAULT_CHUNK_SIZE, 1),
+        chunk_sleep=number('chunk_sleep', float, 0.0, 0),
+        max_threads_running=number('max_threads_running', int, None, 1),
+    )
+
+
+def strip_comments(statement):
+    return QUOTED_OR_COMMENT.sub(
+        lambda match: ' ' if COMMENT.match(match.group()) else match.group(),
+        statement).strip()
+
+
+def mask(statement):
+    """Blank out quoted text, comments and everything inside parentheses,
+    keeping offsets, so keyword searches only see the top level of a
+    statement."""
+    masked = QUOTED_OR_COMMENT.sub(lambda match: ' ' * len(match.group()),
+                                   statement)
+    characters = []
+    depth = 0
+    for char in masked:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        characters.append(char if depth == 0 and char not in '()' else ' ')
+    return ''.join(characters)
+
+
+def parse_chunked(statement, table):
+    """Return a `ChunkedStatement` if `statement` is an UPDATE or DELETE of
+    `table` alone, or None if it does not write to `table`."""
+    statement = strip_comments(statement)
+    target = unquote(table.split('.')[-1]).lower()
+    masked = mask(statement)
+    match = UPDATE.match(statement) or DELETE.match(statement)
+    if match is not None:
+        parts = [unquote(part) for part in
+                 re.findall(IDENTIFIER, match.group(1))]
+        if parts[-1].lower() != target:
+            match = None
+
+    if match is None:
+        # Only the table list, before SET or WHERE, names tables written to
+        written = statement[:len(TABLE_LIST_END.split(masked, 1)[0])]
+        if WRITE.match(statement) and re.search(
+                r'(?<![\w$])' + re.escape(target) + r'(?![\w$])',
+                written, re.IGNORECASE):
+            raise ChunkedMigrationError(
+                "Only single-table UPDATE or DELETE statements can be "
+                "chunked: {}".format(statement[:80]))
+        return None
+
+    where = WHERE.search(masked, match.end())
+    end = where.start() if where else len(statement)
+    if UNSUPPORTED.search(masked, match.end()) or (
+            DELETE.match(statement) and masked[match.end():end].strip()):
+        raise ChunkedMigrationError(
+            "Statements with ORDER BY, LIMIT, USING or PARTITION cannot be "
+            "chunked: {}".format(statement[:80]))
+
+    reference = '.'.join(quote(part) for part in parts)
+    return ChunkedStatement(
+        schema=parts[0] if len(parts) == 2 else None,
+        table=parts[-1],
+        reference=reference,
+        qualifier=quote(unquote(match.group(2))) if match.group(2)
+        else reference,
+        head=statement[:end].rstrip(),
+        condition=statement[where.end():].strip() if where else None,
+    )
+
+
+def sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (bytes, bytearray)):
+        return "X'{}'".format(
+            binascii.hexlify(bytes(value)).decode('ascii'))
+    return "'{}'".format(str(value).replace('\\', '\\\\').replace("'", "''"))
+
+
+def key_to_json(key):
+    return json.dumps([
+        value.decode('utf-8') if isinstance(value, (bytes, bytearray))
+        else value for value in key], default=str)
+
+
+class ChunkedExecutor:
+    """Run the UPDATE and DELETE statements of a chunked migration one
+    primary key range at a time, recording progress in
+    `migrationProgress`."""
+
+    def __init__(self, logger=None, progress_interval=30.0,
+                 sleep=time.sleep):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.progress_interval = progress_interval
+        self.sleep = sleep
+
+    @staticmethod
+    def _range(columns, lower, upper, bounds=('%s', '%s')):
+        """Return the condition selecting keys after `lower` up to and
+        including `upper`, with each value of a bound written as the
+        `bounds` placeholder formatted with its position."""
+        key = ", ".join(columns)
+        conditions = []
+        for values, operator, placeholder in ((lower, '>', bounds[0]),
+                                              (upper, '<=', bounds[1])):
+            if values is not None:
+                conditions.append("({}) {} ({})".format(
+                    key, operator, ", ".join(
+                        placeholder.format(position)
+                        for position in range(len(values)))))
+        return " AND ".join(conditions)
+
+    @staticmethod
+    def _bind_range(cursor, lower, upper):
+        """Set the session variables the write of a chunk compares its keys
+        with. The write includes the migration's own SQL, which may contain
+        '%' and so cannot itself be given parameters portably."""
+        assignments = []
+        params = []
+        for values, name in ((lower, LOWER_VARIABLE), (upper, UPPER_VARIABLE)):
+            for position, value in enumerate(values or ()):
+                assignments.append("{} = %s".format(name.format(position)))
+                params.append(value)
+        if assignments:
+            cursor.execute("SET " + ", ".join(assignments), tuple(params))
+
+    def _load_progress(self, cursor, migration, checksum):
+        cursor.execute(CREATE_PROGRESS_TABLE_SQL)
+        cursor.execute(
+            "SELECT last_key, rows_affected FROM migrationProgress "
+            "WHERE migration = %s AND statement_checksum = %s",
+            (migration, checksum))
+        rows = cursor.fetchall()
+        if not rows:
+            return None, 0
+        return tuple(json.loads(rows[0][0])), int(rows[0][1])
+
+    def run(self, cursor, sql_filename, index, statement, spec):
+        """Execute `statement` in chunks if it writes to the chunked table,
+        returning the rows affected, or None to have it run as written."""
+        chunked = parse_chunked(statement, spec.table)
+        if chunked is None:
+            return None
+
+        primary_key = primary_key_columns(cursor, chunked.schema,
+                                          chunked.table)
+        if not primary_key:
+            raise ChunkedMigrationError(
+                "Table '{}' has no primary key, so cannot be updated in "
+                "chunks".format(chunked.table))
+
+        key = ", ".join(quote(column) for column in primary_key)
+        qualified_key = ["{}.{}".format(chunked.qualifier, quote(column))
+                         for column in primary_key]
+
+        migration = os.path.basename(sql_filename)
+        checksum = statement_checksum(statement)
+        lower, rows_affected = self._load_progress(cursor, migration,
+                                                   checksum)
+        if lower is not None:
+            self.logger.info(
+                "Resuming chunked statement #{index} in file: '{file}' after "
+                "key {key} ({rows} rows already affected)".format(
+                    index=index, file=sql_filename, key=list(lower),
+                    rows=rows_affected))
+
+        estimated_rows = estimate_rows(cursor, chunked.schema, chunked.table)
+        throttle = Throttle(max_threads_running=spec.max_threads_running,
+                            chunk_sleep=spec.chunk_sleep, sleep=self.sleep)
+        chunks = 0
+        start = default_timer()
+        last_report = start
+        while True:
+            throttle.wait(cursor, self.logger)
+
+            where = self._range([quote(c) for c in primary_key], lower, None)
+            cursor.execute(
+                "SELECT {key} FROM {table} FORCE INDEX (PRIMARY) {where}"
+                "ORDER BY {key} LIMIT 1 OFFSET %s".format(
+                    key=key, table=chunked.reference,
+                    where="WHERE " + where + " " if where else ""),
+                tuple(lower or ()) + (spec.chunk_size - 1,))
+            bound = cursor.fetchall()
+            upper = tuple(bound[0]) if bound else None
+
+            self._bind_range(cursor, lower, upper)
+            condition = self._range(qualified_key, lower, upper,
+                                    (LOWER_VARIABLE, UPPER_VARIABLE))
+            if chunked.condition and condition:
+                condition = "({}) AND {}".format(chunked.condition, condition)
+            elif chunked.condition:
+                condition = chunked.condition
+
+            # The chunk and the progress recorded after it commit together,
+            # so a resumed statement neither repeats nor skips a range
+            cursor.execute("START TRANSACTION")
+            try:
+                if condition:
+                    cursor.execute("{} WHERE {}".format(chunked.head,
+                                                        condition))
+                else:
+                    cursor.execute(chunked.head)
+                rows_affected += max(cursor.rowcount, 0)
+                if upper is None:
+                    cursor.execute(
+                        "DELETE FROM migrationProgress "
+                        "WHERE migration = %s AND statement_checksum = %s",
+                        (migration, checksum))
+                else:
+                    cursor.execute(
+                        "REPLACE INTO migrationProgress (migration, "
+                        "statement_checksum, last_key, rows_affected) "
+                        "VALUES (%s, %s, %s, %s)",
+                        (migration, checksum, key_to_json(upper),
+                         rows_affected))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            chunks += 1
+
+            if upper is None:
+                break
+            lower = upper
+
+            now = default_timer()
+            if now - last_report >= self.progress_interval:
+                last_report = now
+                self._log_progress(index, sql_filename, chunks,
+                                   spec.chunk_size, estimated_rows,
+                                   rows_affected, now - start)
+
+        self.logger.info(
+            "Chunked statement #{index} in file: '{file}' affected {rows} "
+            "rows in {chunks} chunks in {elapsed:.1f}s ({throttled:.1f}s "
+            "throttled)".format(index=index, file=sql_filename,
+                                rows=rows_affected, chunks=chunks,
+                                elapsed=default_timer() - start,
+                                throttled=throttle.throttled))
+        return rows_affected
+
+    def _log_progress(self, index, sql_filename, chunks, chunk_size,
+                      estimated_rows, rows_affected, elapsed):
+        scanned = chunks * chunk_size
+        if estimated_rows and scanned < estimated_rows:
+            self.logger.info(
+                "Chunked statement #{index} in file: '{file}': {chunks} "
+                "chunks, ~{percent:.0f}% of ~{total} rows, {rows} rows "
+                "affected, about {eta:.0f}s remaining".format(
+                    index=index, file=sql_filename, chunks=chunks,
+                    percent=100.0 * scanned / estimated_rows,
+                    total=estimated_rows, rows=rows_affected,
+                    eta=elapsed * (estimated_rows - scanned) / scanned))
+        else:
+            self.logger.info(
+                "Chunked statement #{index} in file: '{file}': {chunks} "
+                "chunks, {rows} rows affected".format(
+                    index=index, file=sql_filename, chunks=chunks,
+                    rows=rows_affected))
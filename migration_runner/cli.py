@@ -4,15 +4,25 @@
 import logging
 import sys
 import types
+from contextlib import contextmanager
 
 import click
 import click_log
 from click_log import ClickHandler
 
-# Monkey-patch click_log ColorFormatter class format method to add timestamps
-from migration_runner.controller import Controller
+# Heavier modules (the controller and, through it, the database driver) are
+# imported inside the commands which need them, to keep startup fast.
+from migration_runner.backends import (BACKENDS, DEFAULT_BACKEND,
+                                       BackendUnavailableError, get_backend)
+from migration_runner.data import (DATA_METHODS, DEFAULT_BATCH_SIZE,
+                                   DEFAULT_DATA_METHOD)
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.metrics import PHASES
+from migration_runner.status import DEFAULT_STATUS_TTL
+from migration_runner.watch import DEFAULT_DEBOUNCE
 
 
+# Monkey-patch click_log ColorFormatter class format method to add timestamps
 def custom_format(self, record):
     if not record.exc_info:
         level = record.levelname.lower()
@@ -42,7 +52,196 @@ _default_handler.formatter.format = types.MethodType(
 logger.handlers = [_default_handler]
 
 
-@click.command()
+class DefaultCommandGroup(click.Group):
+    """Command group which falls back to a default command when the first
+    argument is not a subcommand name, so `migration_runner DIR USER ...`
+    keeps working alongside the newer subcommands."""
+
+    passthrough_args = ('--help', '-v', '--version')
+
+    def __init__(self, *args, **kwargs):
+        self.default_command = kwargs.pop('default_command')
+        super(DefaultCommandGroup, self).__init__(*args, **kwargs)
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and
+                        args[0] not in self.passthrough_args):
+            args.insert(0, self.default_command)
+        return super(DefaultCommandGroup, self).parse_args(ctx, args)
+
+
+def controller_options(function):
+    options = [
+        click.option('--inline-version', is_flag=True, default=False,
+                     help='Bump versionTable in the same transaction as '
+                          'each migration, rather than in a separate round '
+                          'trip.'),
+        click.option('-m', '--manifest', required=False, type=str,
+                     help='Path of a cached index of the migrations '
+                          'directory, refreshed incrementally when files '
+                          'change.'),
+        click.option('--driver', default=DEFAULT_BACKEND, show_default=True,
+                     type=click.Choice(sorted(BACKENDS)),
+                     help='Database driver used to talk to MySQL.'),
+        click.option('--data-method', default=DEFAULT_DATA_METHOD,
+                     show_default=True, type=click.Choice(DATA_METHODS),
+                     help='How CSV data migrations are loaded: batched '
+                          'INSERTs, or LOAD DATA LOCAL INFILE (which the '
+                          'server must allow).'),
+        click.option('--batch-size', default=DEFAULT_BATCH_SIZE,
+                     show_default=True, type=click.IntRange(1, None),
+                     help='Rows per INSERT batch for CSV data migrations.'),
+        click.option('--coalesce-inserts', is_flag=True, default=False,
+                     help='Merge runs of single-row INSERTs into the same '
+                          'table into multi-row INSERTs, up to the server\'s '
+                          'max_allowed_packet.'),
+        click.option('--parallel', default=1, show_default=True,
+                     type=click.IntRange(1, None),
+                     help='Run up to this many migrations which touch '
+                          'different tables at once, each on its own '
+                          'connection. Requires --ledger.'),
+        click.option('--online-alter', is_flag=True, default=False,
+                     help='Apply ALTER TABLE statements through a shadow '
+                          'table copied in chunks, without locking the '
+                          'table.'),
+        click.option('--osc-chunk-size', default=1000, show_default=True,
+                     type=click.IntRange(1, None),
+                     help='Rows copied per chunk by --online-alter.'),
+        click.option('--osc-max-threads-running', type=click.IntRange(1, None),
+                     help='Pause --online-alter copying while the server has '
+                          'more threads running than this.'),
+        click.option('--osc-max-replica-lag', type=click.IntRange(0, None),
+                     help='Pause --online-alter copying while any '
+                          '--osc-replica lags by more seconds than this.'),
+        click.option('--osc-replica', 'osc_replicas', multiple=True,
+                     metavar='HOST',
+                     help='Replica host to check for lag, with the same '
+                          'credentials; may be given more than once.'),
+        click.option('--checkpoint', is_flag=True, default=False,
+                     help='Record each completed statement, so a failed '
+                          'migration resumes at the failed statement on the '
+                          'next run.'),
+        click.option('--ledger', is_flag=True, default=False,
+                     help='Record every applied migration with its checksum '
+                          'in appliedMigrations, and apply any migration it '
+                          'has no record of, even if numbered below the '
+                          'current version.'),
+        click.option('--no-baseline', 'baseline', flag_value=False,
+                     default=True,
+                     help='Apply every migration to an empty database, '
+                          'rather than loading the newest matching baseline '
+                          'written by `squash`.'),
+        click.option('--mmap', 'mmap_statements', is_flag=True,
+                     default=False,
+                     help='Read migrations of 1 MiB or more through a memory '
+                          'map, sending their statements to the server as '
+                          'UTF-8 bytes without decoding them.'),
+        click.option('--status-cache', required=False, type=str,
+                     help='Status cache file used by the `status` command, '
+                          'from which each database\'s entry is removed '
+                          'when its version changes.'),
+        click_log.simple_verbosity_option(logger, '--loglevel', '-l'),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def metrics_options(function):
+    options = [
+        click.option('--metrics-file', required=False, type=str,
+                     help='Write run metrics to this file in OpenMetrics '
+                          'text format.'),
+        click.option('--report-file', required=False, type=str,
+                     help='Write run metrics to this file as JSON.'),
+        click.option('--profile', multiple=True, type=click.Choice(PHASES),
+                     help='Profile this phase with cProfile; may be given '
+                          'more than once.'),
+        click.option('--profile-dir', default='.', show_default=True,
+                     type=click.Path(file_okay=False),
+                     help='Directory to write PHASE.prof profiles to.'),
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def load_backend(driver):
+    backend = get_backend(driver)
+    try:
+        backend.load()
+    except BackendUnavailableError as error:
+        raise click.BadParameter(str(error), param_hint='--driver')
+    return backend
+
+
+def build_online_schema_change(controller_logger, online_alter, chunk_size,
+                               max_threads_running, max_replica_lag,
+                               replicas):
+    if not online_alter:
+        return None
+
+    from migration_runner.online import OnlineSchemaChange
+
+    return OnlineSchemaChange(controller_logger, chunk_size=chunk_size,
+                              max_threads_running=max_threads_running,
+                              max_replica_lag=max_replica_lag,
+                              replica_hosts=replicas)
+
+
+def build_controller(controller_logger, inline_version, manifest,
+                     metrics=None, backend=None,
+                     data_method=DEFAULT_DATA_METHOD,
+                     batch_size=DEFAULT_BATCH_SIZE, coalesce_inserts=False,
+                     parallel=1, online_schema_change=None,
+                     checkpoint=False, ledger=False, baseline=True,
+                     status_cache=None, validate=False,
+                     validate_workers=None, mmap_statements=False):
+    from migration_runner.controller import Controller
+
+    if parallel > 1 and not ledger:
+        raise click.UsageError("--parallel requires --ledger")
+    return Controller(controller_logger, inline_version_update=inline_version,
+                      manifest_path=manifest, metrics=metrics,
+                      backend=backend, data_method=data_method,
+                      batch_size=batch_size,
+                      coalesce_inserts=coalesce_inserts, parallel=parallel,
+                      online_schema_change=online_schema_change,
+                      checkpoint=checkpoint, ledger=ledger,
+                      baseline=baseline, status_cache_path=status_cache,
+                      validate=validate, validate_workers=validate_workers,
+                      mmap_statements=mmap_statements)
+
+
+@contextmanager
+def exit_on_error():
+    """Log an error raised by the library and exit with status 1."""
+    try:
+        yield
+    except MigrationRunnerError as error:
+        logger.error(str(error))
+        sys.exit(1)
+
+
+def write_metrics(metrics, metrics_file, report_file):
+    if metrics_file:
+        metrics.write_openmetrics(metrics_file)
+    if report_file:
+        metrics.write_json(report_file)
+    for filename in metrics.write_profiles():
+        logger.info("Wrote profile: '{}'".format(filename))
+
+
+@click.group(cls=DefaultCommandGroup, default_command='run')
+@click.version_option(None, '-v', '--version')
+def main():
+    """A CLI tool for executing SQL migrations in sequence.
+
+    Without a command name, arguments are passed to the `run` command.
+    """
+
+
+@main.command()
 @click.argument('sql_directory')
 @click.argument('db_user')
 @click.argument('db_host')
@@ -50,21 +249,307 @@ logger.handlers = [_default_handler]
 @click.argument('db_password')
 @click.option('-s', '--single-file', required=False, type=str,
               help='Filename of single SQL script to process.')
-@click_log.simple_verbosity_option(logger, '--loglevel', '-l')
-@click.version_option(None, '-v', '--version')
-def main(sql_directory, db_user, db_host, db_name, db_password, single_file):
-    """A CLI tool for executing SQL migrations in sequence."""
+@click.option('-p', '--plan', is_flag=True, default=False,
+              help='Print pending migrations without executing anything.')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print the plan as JSON.')
+@click.option('--watch', is_flag=True, default=False,
+              help='Keep running, applying new migrations as they are added '
+                   'to SQL_DIRECTORY.')
+@click.option('--debounce', default=DEFAULT_DEBOUNCE, show_default=True,
+              type=click.FloatRange(0, None),
+              help='Seconds --watch waits for the directory to stop '
+                   'changing before applying new migrations.')
+@click.option('--validate', is_flag=True, default=False,
+              help='Check every pending migration can be read, decoded and '
+                   'split into statements, and with --ledger that applied '
+                   'migrations are unchanged, before applying any.')
+@click.option('--validate-workers', type=click.IntRange(1, None),
+              help='Processes used by --validate; one per CPU by default.')
+@controller_options
+@metrics_options
+def run(sql_directory, db_user, db_host, db_name, db_password, single_file,
+        plan, as_json, watch, debounce, validate, validate_workers,
+        inline_version, manifest, driver, data_method, batch_size,
+        coalesce_inserts, parallel, online_alter, osc_chunk_size,
+        osc_max_threads_running, osc_max_replica_lag, osc_replicas,
+        checkpoint, ledger, baseline, mmap_statements, status_cache,
+        metrics_file, report_file, profile, profile_dir):
+    """Execute SQL migrations in sequence against one database."""
 
     logger.debug("CLI execution start")
     db_params = (db_host, db_user, db_password, db_name)
+    if watch and (plan or single_file is not None or parallel > 1 or
+                  validate):
+        raise click.UsageError(
+            "--watch cannot be combined with --plan, --single-file, "
+            "--parallel or --validate")
+
+    from migration_runner.metrics import Metrics
+
+    backend = load_backend(driver)
+    metrics = Metrics(profile_phases=profile, profile_dir=profile_dir)
+    online_schema_change = build_online_schema_change(
+        logger, online_alter, osc_chunk_size, osc_max_threads_running,
+        osc_max_replica_lag, osc_replicas)
+    controller = build_controller(logger, inline_version, manifest, metrics,
+                                  backend, data_method, batch_size,
+                                  coalesce_inserts, parallel,
+                                  online_schema_change, checkpoint, ledger,
+                                  baseline, status_cache, validate,
+                                  validate_workers, mmap_statements)
+
+    try:
+        with exit_on_error():
+            if plan:
+                echo_plan(controller.plan_migrations(db_params,
+                                                     sql_directory), as_json)
+            elif single_file is not None:
+                controller.process_single_file(db_params, single_file)
+            elif watch:
+                watch_migrations(controller, db_params, sql_directory,
+                                 debounce)
+            else:
+                controller.process_migrations_in_directory(db_params,
+                                                           sql_directory)
+    finally:
+        write_metrics(metrics, metrics_file, report_file)
+
+    return 0
+
+
+def watch_migrations(controller, db_params, sql_directory, debounce):
+    from migration_runner.watch import MigrationWatcher, WatchUnavailableError
+
+    watcher = MigrationWatcher(controller, db_params, sql_directory,
+                               debounce=debounce, logger=logger)
+    try:
+        watcher.run()
+    except WatchUnavailableError as error:
+        raise click.BadParameter(str(error), param_hint='--watch')
+    except KeyboardInterrupt:
+        logger.info("Stopped watching for new migrations")
+
+
+def echo_plan(plan, as_json):
+    if as_json:
+        import json
+
+        from migration_runner.results import plan_as_dict
+
+        click.echo(json.dumps(plan_as_dict(plan), indent=2, sort_keys=True))
+        return
+
+    click.echo("Database version: {version}, pending migrations: {pending} "
+               "(out of {total} in dir)".format(version=plan.db_version,
+                                                pending=len(plan.pending),
+                                                total=plan.total_migrations))
+    for entry in plan.pending:
+        click.echo("{version:>8}  {size:>10} bytes  ~{statements:<6} "
+                   "statements  {checksum}  {file}".format(
+                       version=entry.version, size=entry.size,
+                       statements=entry.statements,
+                       checksum=entry.checksum[:12], file=entry.filename))
+
+
+@main.command()
+@click.argument('sql_directory')
+@click.argument('targets_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('-w', '--workers', default=8, show_default=True,
+              type=click.IntRange(1, None),
+              help='Maximum number of databases migrated concurrently.')
+@controller_options
+def fanout(sql_directory, targets_file, workers, inline_version, manifest,
+           driver, data_method, batch_size, coalesce_inserts, parallel,
+           online_alter, osc_chunk_size, osc_max_threads_running,
+           osc_max_replica_lag, osc_replicas, checkpoint, ledger, baseline,
+           mmap_statements, status_cache):
+    """Execute SQL migrations against every database in TARGETS_FILE.
+
+    TARGETS_FILE has one `db_user db_host db_name db_password` line per
+    database; blank lines and `#` comments are ignored.
+    """
 
-    controller = Controller(logger)
+    from migration_runner.fanout import FanOut
 
-    if single_file is not None:
-        controller.process_single_file(db_params, single_file)
+    logger.debug("CLI execution start")
+    backend = load_backend(driver)
+    fan_out = FanOut(
+        logger,
+        workers=workers,
+        controller_factory=lambda target_logger: build_controller(
+            target_logger, inline_version, manifest, backend=backend,
+            data_method=data_method, batch_size=batch_size,
+            coalesce_inserts=coalesce_inserts, parallel=parallel,
+            online_schema_change=build_online_schema_change(
+                target_logger, online_alter, osc_chunk_size,
+                osc_max_threads_running, osc_max_replica_lag, osc_replicas),
+            checkpoint=checkpoint, ledger=ledger, baseline=baseline,
+            status_cache=status_cache, mmap_statements=mmap_statements)
+    )
+
+    try:
+        targets = fan_out.read_targets(targets_file)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='TARGETS_FILE')
+
+    with exit_on_error():
+        results = fan_out.process_targets(targets, sql_directory)
+
+    if any(result.error for result in results):
+        sys.exit(1)
+    return 0
+
+
+@main.command()
+@click.argument('sql_directory')
+@click.argument('db_user')
+@click.argument('db_host')
+@click.argument('db_name')
+@click.argument('db_password')
+@click.option('-m', '--manifest', required=False, type=str,
+              help='Path of a cached index of the migrations directory.')
+@click.option('--driver', default=DEFAULT_BACKEND, show_default=True,
+              type=click.Choice(sorted(BACKENDS)),
+              help='Database driver used to talk to MySQL.')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print the verification as JSON.')
+@click_log.simple_verbosity_option(logger, '--loglevel', '-l')
+def verify(sql_directory, db_user, db_host, db_name, db_password, manifest,
+           driver, as_json):
+    """Check applied migrations against the appliedMigrations ledger.
+
+    Exits with status 1 if any applied migration file has been edited
+    since it was applied, or deleted.
+    """
+
+    db_params = (db_host, db_user, db_password, db_name)
+    controller = build_controller(logger, False, manifest,
+                                  backend=load_backend(driver), ledger=True)
+    with exit_on_error():
+        verification = controller.verify_migrations(db_params, sql_directory)
+    echo_verification(verification, as_json)
+
+    if verification.edited or verification.missing:
+        sys.exit(1)
+    return 0
+
+
+def echo_verification(verification, as_json):
+    if as_json:
+        import json
+
+        click.echo(json.dumps({
+            'applied': verification.applied,
+            'edited': [{'version': entry.version, 'file': path,
+                        'recorded_checksum': entry.checksum,
+                        'checksum': checksum}
+                       for entry, path, checksum in verification.edited],
+            'missing': [{'version': entry.version, 'file': entry.filename}
+                        for entry in verification.missing],
+            'pending': [{'version': version, 'file': path}
+                        for version, path in verification.pending],
+        }, indent=2, sort_keys=True))
+        return
+
+    if not verification.applied:
+        click.echo("The appliedMigrations ledger is empty; run with --ledger "
+                   "to create it")
     else:
-        controller.process_migrations_in_directory(db_params, sql_directory)
+        click.echo("Applied migrations checked: {applied}, edited: "
+                   "{edited}, missing: {missing}, pending: {pending}".format(
+                       applied=verification.applied,
+                       edited=len(verification.edited),
+                       missing=len(verification.missing),
+                       pending=len(verification.pending)))
+    for entry, path, checksum in verification.edited:
+        click.echo("edited   {version:>8}  {recorded} -> {checksum}  "
+                   "{file}".format(version=entry.version,
+                                   recorded=entry.checksum[:12],
+                                   checksum=checksum[:12], file=path))
+    for entry in verification.missing:
+        click.echo("missing  {version:>8}  {file}".format(
+            version=entry.version, file=entry.filename))
+    for version, path in verification.pending:
+        click.echo("pending  {version:>8}  {file}".format(version=version,
+                                                          file=path))
+
+
+@main.command()
+@click.argument('sql_directory')
+@click.argument('db_user')
+@click.argument('db_host')
+@click.argument('db_name')
+@click.argument('db_password')
+@click.option('-o', '--output', required=False, type=str,
+              help='File to write the baseline to.  [default: '
+                   'SQL_DIRECTORY/baselines/VERSION.baseline.sql]')
+@click.option('-m', '--manifest', required=False, type=str,
+              help='Path of a cached index of the migrations directory.')
+@click.option('--driver', default=DEFAULT_BACKEND, show_default=True,
+              type=click.Choice(sorted(BACKENDS)),
+              help='Database driver used to talk to MySQL.')
+@click_log.simple_verbosity_option(logger, '--loglevel', '-l')
+def squash(sql_directory, db_user, db_host, db_name, db_password, output,
+           manifest, driver):
+    """Write a baseline of a migrated database's schema and data.
+
+    The database must have had the migrations in SQL_DIRECTORY applied. An
+    empty database is then migrated by loading the newest baseline taken
+    from the same migrations, and applying only the migrations after it.
+    """
+
+    db_params = (db_host, db_user, db_password, db_name)
+    controller = build_controller(logger, False, manifest,
+                                  backend=load_backend(driver))
+    with exit_on_error():
+        baseline = controller.squash_migrations(db_params, sql_directory,
+                                                output)
+
+    click.echo("Wrote baseline at version {version} to: {file}".format(
+        version=baseline.version, file=baseline.path))
+    return 0
+
+
+@main.command()
+@click.argument('db_user')
+@click.argument('db_host')
+@click.argument('db_name')
+@click.argument('db_password')
+@click.option('--ttl', default=DEFAULT_STATUS_TTL, show_default=True,
+              type=click.FloatRange(0, None),
+              help='Seconds a cached status is reused for before the '
+                   'database is queried again.')
+@click.option('--status-cache', required=False, type=str,
+              help='File to share cached statuses in between processes.')
+@click.option('--driver', default=DEFAULT_BACKEND, show_default=True,
+              type=click.Choice(sorted(BACKENDS)),
+              help='Database driver used to talk to MySQL.')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print the status as JSON.')
+@click_log.simple_verbosity_option(logger, '--loglevel', '-l')
+def status(db_user, db_host, db_name, db_password, ttl, status_cache, driver,
+           as_json):
+    """Print the version and ledger checksum of a database."""
+
+    db_params = (db_host, db_user, db_password, db_name)
+    controller = build_controller(logger, False, None,
+                                  backend=load_backend(driver),
+                                  status_cache=status_cache)
+    with exit_on_error():
+        schema_status = controller.status(db_params, ttl=ttl)
+
+    if as_json:
+        import json
+
+        click.echo(json.dumps(dict(schema_status._asdict()), indent=2,
+                              sort_keys=True))
+        return 0
 
+    click.echo("{target}: version {version}, ledger {ledger}{cached}".format(
+        target=schema_status.target, version=schema_status.version,
+        ledger=(schema_status.ledger_hash or 'none')[:12],
+        cached=" (cached)" if schema_status.cached else ""))
     return 0
 
 
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import re
+from collections import namedtuple
+
+# MySQL 5.7's default, used when the server's value cannot be read
+DEFAULT_MAX_ALLOWED_PACKET = 4 * 1024 * 1024
+
+# Headroom left below max_allowed_packet for the protocol header
+PACKET_OVERHEAD = 1024
+
+# Whitespace and comments before a statement, other than executable
+# comments and optimizer hints, which the server runs
+LEADING_COMMENTS = re.compile(
+    r'(?:\s+|/\*(?![!+]).*?\*/|(?:--(?=\s|$)|#)[^\n]*)*',
+    re.DOTALL
+)
+
+INSERT_HEAD = re.compile(
+    r'(INSERT\s+(?:(?:LOW_PRIORITY|HIGH_PRIORITY|DELAYED|IGNORE)\s+)*'
+    r'INTO\s.+?)\s*\bVALUES?\s*(?=\()',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Row values which must not be evaluated in a different statement than
+# written: subqueries (which may read the table being inserted into), user
+# variables and functions reporting on the previous statement
+UNSAFE_VALUE = re.compile(
+    r'\b(?:SELECT|LAST_INSERT_ID|ROW_COUNT|FOUND_ROWS)\b|@|--|#|/\*',
+    re.IGNORECASE
+)
+
+# Statements whose result depends on how the preceding INSERT was batched
+DEPENDS_ON_PREVIOUS = re.compile(r'\b(?:LAST_INSERT_ID|ROW_COUNT)\b',
+                                 re.IGNORECASE)
+
+SingleInsert = namedtuple('SingleInsert', ['head', 'rows'])
+
+
+def parse_insert(statement):
+    """Return a `SingleInsert` of the `INSERT ... INTO ... VALUES` head and
+    row tuples of a plain INSERT statement, or None if it has any other
+    shape (INSERT ... SELECT, ON DUPLICATE KEY UPDATE, comments within
+    it, ...). Comments before the statement are left out of the head."""
+    match = INSERT_HEAD.match(statement,
+                              LEADING_COMMENTS.match(statement).end())
+    if match is None:
+        return None
+
+    rows = []
+    unquoted = []
+    position = match.end()
+    length = len(statement)
+    while True:
+        start = position
+        depth = 0
+        quote = None
+        while position < length:
+            char = statement[position]
+            if quote is not None:
+                if char == '\\' and quote != '`':
+                    position += 1
+                elif char == quote:
+                    if statement[position + 1:position + 2] == quote:
+                        position += 1
+                    else:
+                        quote = None
+            elif char in '\'"`':
+                quote = char
+            else:
+                unquoted.append(char)
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                    if depth == 0:
+                        position += 1
+                        break
+            position += 1
+        else:
+            return None
+
+        rows.append(statement[start:position])
+        while position < length and statement[position].isspace():
+            position += 1
+        if position == length:
+            break
+        if statement[position] != ',':
+            return None
+        position += 1
+        while position < length and statement[position].isspace():
+            position += 1
+        if statement[position:position + 1] != '(':
+            return None
+
+    if UNSAFE_VALUE.search(''.join(unquoted)):
+        return None
+    return SingleInsert(match.group(1), rows)
+
+
+class InsertCoalescer:
+    """Merge runs of consecutive INSERTs into the same table and columns
+    into multi-row INSERTs no longer than `max_packet` bytes.
+
+    Any other statement ends the current run, which is then emitted
+    unchanged in order. If that statement reads LAST_INSERT_ID() or
+    ROW_COUNT(), the run's final row is emitted on its own so those
+    functions see the same value as they would have without merging.
+    """
+
+    def __init__(self, max_packet=DEFAULT_MAX_ALLOWED_PACKET):
+        self.limit = max_packet - PACKET_OVERHEAD
+
+    def coalesce(self, statements):
+        head = None
+        run = []
+        for statement in statements:
+            insert = parse_insert(statement)
+            if insert is not None and insert.head == head:
+                run.append((statement, insert))
+                continue
+
+            split_last = (insert is None and
+                          DEPENDS_ON_PREVIOUS.search(statement) is not None)
+            for merged in self._flush(head, run, split_last):
+                yield merged
+
+            if insert is None:
+                head = None
+                run = []
+                yield statement
+            else:
+                head = insert.head
+                run = [(statement, insert)]
+
+        for merged in self._flush(head, run, False):
+            yield merged
+
+    def _flush(self, head, run, split_last):
+        tail = run[-1:] if split_last else []
+        if split_last:
+            run = run[:-1]
+
+        batch = []
+        size = 0
+        prefix = head + " VALUES " if head else ''
+        for statement, insert in run:
+            rows_size = sum(len(row.encode('utf-8')) + 2
+                            for row in insert.rows)
+            if batch and len(prefix.encode('utf-8')) + size + rows_size > \
+                    self.limit:
+                yield self._merge(prefix, batch)
+                batch = []
+                size = 0
+            batch.append((statement, insert))
+            size += rows_size
+        if batch:
+            yield self._merge(prefix, batch)
+
+        for statement, _ in tail:
+            yield statement
+
+    @staticmethod
+    def _merge(prefix, batch):
+        if len(batch) == 1:
+            return batch[0][0]
+        return prefix + ", ".join(row for _, insert in batch
+                                  for row in insert.rows)
@@ -1,108 +1,428 @@
 # -*- coding: utf-8 -*-
 import logging
 
-import mysql.connector
-
-from migration_runner.database_tools import DatabaseTools
+from migration_runner.baseline import (EMPTY_DATABASE_TABLES, BaselineDumper,
+                                       BaselineError, baseline_path,
+                                       find_baselines, list_tables,
+                                       migrations_fingerprint,
+                                       select_baseline)
+from migration_runner.data import DEFAULT_BATCH_SIZE, DEFAULT_DATA_METHOD
+from migration_runner.database_tools import DatabaseTools, UPDATE_VERSION_SQL
 from migration_runner.helpers import Helpers
+from migration_runner.ledger import Ledger, unapplied_migrations
+from migration_runner.metrics import Metrics
+from migration_runner.results import (SKIPPED, MigrationOutcome,
+                                      MigrationPlan, PlanEntry,
+                                      SlowestStatements, applied_outcome,
+                                      failed_outcome)
+from migration_runner.session import DatabaseSession
+from migration_runner.status import (DEFAULT_STATUS_TTL, ledger_hash,
+                                     shared_status_cache, status_target)
+from migration_runner.validation import (MigrationValidationError,
+                                         MigrationValidator)
 
 
 class Controller:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, inline_version_update=False,
+                 manifest_path=None, metrics=None, backend=None,
+                 data_method=DEFAULT_DATA_METHOD,
+                 batch_size=DEFAULT_BATCH_SIZE, coalesce_inserts=False,
+                 parallel=1, online_schema_change=None, checkpoint=False,
+                 ledger=False, baseline=True, status_cache_path=None,
+                 validate=False, validate_workers=None,
+                 mmap_statements=False):
         if logger is None:
             self.logger = logging.getLogger(__name__)
         else:
             self.logger = logger
 
-        self.helpers = Helpers(logger)
-        self.database = DatabaseTools(logger)
+        if parallel > 1 and not ledger:
+            # Migrations completed after one fails are only known to have
+            # been applied through the ledger
+            raise ValueError("Parallel migrations require the ledger")
+
+        self.metrics = Metrics() if metrics is None else metrics
+        self.helpers = Helpers(logger, manifest_path=manifest_path,
+                               metrics=self.metrics)
+        self.database = DatabaseTools(
+            logger, metrics=self.metrics, backend=backend,
+            data_method=data_method, batch_size=batch_size,
+            coalesce_inserts=coalesce_inserts,
+            online_schema_change=online_schema_change,
+            checkpoint=checkpoint, mmap_statements=mmap_statements)
+        self.ledger = Ledger(self.database, logger) if ledger else None
+        # Exceptions recorded as the failure of the migration being applied
+        self.migration_errors = self.database.migration_errors
+        self.slowest_limit = 5
+        self.inline_version_update = inline_version_update
+        self.parallel = parallel
+        self.baseline = baseline
+        self.status_cache = shared_status_cache(status_cache_path)
+        self.validate = validate
+        self.validate_workers = validate_workers
+        # MigrationOutcome of each pending migration in the latest run
+        self.outcomes = []
 
     def process_single_file(self, db_params, single_file):
         self.logger.warning(
             "Use of this option means DB version will be out of sync!")
 
-        self.database.apply_migration(db_params, single_file)
+        result = self.database.apply_migration(db_params, single_file)
 
         self.logger.info(
-            "Successfully executed SQL in file: '{}'".format(single_file)
+            "Successfully executed SQL in file: '{file}' ({summary})".format(
+                file=single_file, summary=result.summary())
         )
 
-    def update_current_version(self, db_params, new_version):
+    def open_session(self, db_params):
+        return DatabaseSession(self.database, db_params, self.logger)
+
+    def update_current_version(self, db_params, new_version, session=None):
         current_db_version = 0
         try:
-            db_connection = self.database.connect_database(db_params)
+            db_connection = self.database.open_connection(db_params, session)
             cursor = db_connection.cursor()
-            cursor.execute("UPDATE versionTable SET version = \'{}\'"
-                           .format(new_version))
+            cursor.execute(UPDATE_VERSION_SQL, (new_version,))
+            self.status_cache.invalidate(status_target(db_params))
             cursor.execute("SELECT version FROM versionTable LIMIT 1")
             db_version_row = cursor.fetchone()
             if db_version_row is not None:
                 current_db_version = db_version_row[0]
-            db_connection.close()
-        except mysql.connector.Error as error:
+            self.database.release_connection(db_connection, session)
+        except self.database.backend.Error as error:
+            if session is not None:
+                session.handle_error(error)
             self.logger.error(
                 "{} while attempting to update current database version, "
                 "assuming version 0: {}".format(type(error).__name__, error)
             )
         return current_db_version
 
+    def migration_checksum(self, sql_filename):
+        return self.helpers.describe_migration(sql_filename)[1]
+
+    def pending_migrations(self, db_params, db_version, migrations,
+                           session=None, adopt=False):
+        """Return the migrations still to apply: those above `db_version`,
+        or with a ledger, those it has no record of and `versionTable` does
+        not show as applied since. With `adopt`, the ledger is first filled
+        in with the latter."""
+        if self.ledger is None:
+            return self.helpers.get_unprocessed_migrations(db_version,
+                                                           migrations)
+
+        entries = self.ledger.entries(db_params, session=session)
+        if adopt:
+            self.ledger.adopt(db_params, db_version, entries, migrations,
+                              self.migration_checksum, session=session)
+        return unapplied_migrations(
+            migrations,
+            self.ledger.applied_versions(entries, db_version, migrations))
+
+    def ledger_recorder(self, version_code, sql_filename):
+        """Return the callable `apply_migration` runs to record a migration
+        in the ledger, inside the same transaction as its statements and
+        version update with `--inline-version`, or None without a ledger."""
+        if self.ledger is None:
+            return None
+        checksum = self.migration_checksum(sql_filename)
+
+        def record(cursor, result):
+            self.ledger.write(cursor, version_code, sql_filename, checksum,
+                              result.elapsed)
+        return record
+
     def process_migrations(self, db_params, db_version,
-                           unprocessed_migrations):
+                           unprocessed_migrations, session=None):
         total_processed = 0
+        slowest = SlowestStatements(self.slowest_limit)
+        if self.ledger is not None and len(unprocessed_migrations):
+            self.ledger.create_table(db_params, session=session)
         for version_code, sql_filename in unprocessed_migrations:
             self.logger.debug(
                 "Applying migration: {version} with filename: '{file}'".format
                 (version=version_code, file=sql_filename)
             )
             try:
-                self.database.apply_migration(db_params, sql_filename)
+                # Out of order migrations found via the ledger never move
+                # versionTable backwards
+                new_version = max(int(db_version), version_code)
+                record = self.ledger_recorder(version_code, sql_filename)
+                with self.metrics.phase('migration'):
+                    if self.inline_version_update:
+                        result = self.database.apply_migration(
+                            db_params, sql_filename, session=session,
+                            version=new_version, record=record)
+                    else:
+                        result = self.database.apply_migration(
+                            db_params, sql_filename, session=session,
+                            record=record)
                 self.logger.info(
                     "Upgraded DB version from {old} to {new} by executing file"
                     ": '{file}'".format(
                         old=db_version, new=version_code, file=sql_filename)
                 )
+                self.logger.info(
+                    "Migration {version} timing: {summary}".format(
+                        version=version_code, summary=result.summary())
+                )
+                for statement in result.slowest:
+                    slowest.add(sql_filename, statement)
 
-                db_version = self.update_current_version(db_params,
-                                                         version_code)
+                if self.inline_version_update or record is not None:
+                    self.status_cache.invalidate(status_target(db_params))
+                if self.inline_version_update:
+                    db_version = new_version
+                else:
+                    db_version = self.update_current_version(
+                        db_params, new_version, session=session)
                 total_processed += 1
-            except mysql.connector.Error as error:
+                self.metrics.increment('migrations_applied')
+                self.outcomes.append(applied_outcome(version_code,
+                                                     sql_filename, result))
+            except self.migration_errors as error:
+                self.metrics.increment('migrations_failed')
+                self.outcomes.append(failed_outcome(version_code,
+                                                    sql_filename, error))
+                if session is not None:
+                    session.handle_error(error)
                 self.logger.error(
                     "{type} while processing migration in file: '{file}': "
                     "{error}".format(type=type(error).__name__,
                                      file=sql_filename,
                                      error=error))
                 break
+
+        self.log_slowest_statements(slowest)
         return db_version, total_processed
 
-    def process_migrations_in_directory(self, db_params, sql_directory):
-        self.logger.debug(
-            "Looking for migrations in dir: {}".format(sql_directory))
+    def log_slowest_statements(self, slowest):
+        if not len(slowest):
+            return
+        self.logger.info(
+            "Slowest {} statements executed:".format(len(slowest)))
+        for filename, statement in slowest:
+            self.logger.info(
+                "  {elapsed:.3f}s statement #{index} ({checksum}) in file: "
+                "'{file}', {rows} rows affected, {warnings} warnings".format(
+                    elapsed=statement.elapsed, index=statement.index,
+                    checksum=statement.checksum[:12], file=filename,
+                    rows=statement.rows_affected,
+                    warnings=statement.warnings)
+            )
 
+    def plan_migrations(self, db_params, sql_directory):
         migrations = self.helpers.populate_migrations(sql_directory)
-        self.logger.debug("Migrations found: {}".format(len(migrations)))
+        with self.open_session(db_params) as session:
+            db_version = self.database.fetch_current_version(
+                db_params, session=session)
+            unprocessed = self.pending_migrations(db_params, db_version,
+                                                  migrations, session=session)
 
-        db_version = self.database.fetch_current_version(db_params)
-        self.logger.info(
-            "Starting with database version: {}".format(db_version))
+        pending = []
+        for version_code, sql_filename in unprocessed:
+            size, checksum, statements = self.helpers.describe_migration(
+                sql_filename)
+            pending.append(PlanEntry(version_code, sql_filename, size,
+                                     checksum, statements))
 
-        unprocessed = self.helpers.get_unprocessed_migrations(db_version,
-                                                              migrations)
-        self.logger.info(
-            "Migrations yet to be processed: {unprocessed} (out of {total} "
-            "in dir)".format(
-                unprocessed=len(unprocessed),
-                total=len(migrations)
+        return MigrationPlan(db_version, len(migrations), pending)
+
+    def process_migrations_in_directory(self, db_params, sql_directory):
+        with self.metrics.phase('run'):
+            self.logger.debug(
+                "Looking for migrations in dir: {}".format(sql_directory))
+
+            migrations = self.helpers.populate_migrations(sql_directory)
+            self.logger.debug("Migrations found: {}".format(len(migrations)))
+
+            return self.process_planned_migrations(
+                db_params, migrations,
+                baselines=self.find_baselines(sql_directory))
+
+    def find_baselines(self, sql_directory):
+        if not self.baseline:
+            return []
+        return find_baselines(sql_directory)
+
+    def process_planned_migrations(self, db_params, migrations, baselines=()):
+        self.outcomes = []
+        with self.open_session(db_params) as session:
+            db_version = self.database.fetch_current_version(
+                db_params, session=session)
+            self.logger.info(
+                "Starting with database version: {}".format(db_version))
+
+            # Files are validated before anything is written to the
+            # database, by loading a baseline or adopting the ledger
+            unprocessed = self.pending_migrations(
+                db_params, db_version, migrations, session=session)
+            invalid = []
+            if self.validate and len(unprocessed):
+                invalid = self.validate_migrations(
+                    db_params, migrations, unprocessed,
+                    session=session).invalid
+
+            baseline_failed = False
+            if not invalid:
+                try:
+                    db_version = self.load_baseline(db_params, db_version,
+                                                    migrations, baselines,
+                                                    session=session)
+                except self.migration_errors as error:
+                    self.metrics.increment('migrations_failed')
+                    session.handle_error(error)
+                    self.logger.error(
+                        "{type} while loading baseline: {error}".format(
+                            type=type(error).__name__, error=error))
+                    baseline_failed = True
+                else:
+                    unprocessed = self.pending_migrations(
+                        db_params, db_version, migrations, session=session,
+                        adopt=True)
+            self.logger.info(
+                "Migrations yet to be processed: {unprocessed} (out of "
+                "{total} in dir)".format(
+                    unprocessed=len(unprocessed),
+                    total=len(migrations)
+                )
             )
-        )
 
-        db_version, total_processed = self.process_migrations(
-            db_params,
-            db_version,
-            unprocessed
-        )
+            if baseline_failed:
+                total_processed = 0
+            elif invalid:
+                self.metrics.increment('migrations_invalid', len(invalid))
+                self.outcomes.extend(
+                    failed_outcome(validation.version, validation.filename,
+                                   MigrationValidationError(validation.error))
+                    for validation in invalid)
+                self.logger.error(
+                    "Not applying any migrations, as {} files failed "
+                    "validation".format(len(invalid)))
+                total_processed = 0
+            elif self.parallel > 1:
+                from migration_runner.scheduler import MigrationScheduler
+
+                scheduler = MigrationScheduler(self, workers=self.parallel)
+                db_version, total_processed = scheduler.process_migrations(
+                    db_params, db_version, unprocessed, session=session)
+            else:
+                db_version, total_processed = self.process_migrations(
+                    db_params,
+                    db_version,
+                    unprocessed,
+                    session=session
+                )
+
+        self.logger.debug(
+            "Database connections opened during run: {}".format(
+                session.handshakes))
+
+        attempted = set(outcome.version for outcome in self.outcomes)
+        self.outcomes.extend(
+            MigrationOutcome(version_code, sql_filename, SKIPPED, 0.0, 0, 0,
+                             None)
+            for version_code, sql_filename in unprocessed
+            if version_code not in attempted)
 
         self.logger.info(
             "Database version now {version} after processing {processed}"
             " migrations. Remaining: {unprocessed}.".format
             (version=db_version, processed=total_processed,
              unprocessed=(len(unprocessed) - total_processed)))
+
+        return db_version, total_processed, len(unprocessed) - total_processed
+
+    def validate_migrations(self, db_params, migrations, unprocessed,
+                            session=None):
+        """Check that the `unprocessed` migrations can be read, decoded
+        and split into statements and, with a ledger, that the files of
+        applied migrations are unchanged, before any migration is applied.
+        Returns a `ValidationReport`."""
+        applied = []
+        checksums = {}
+        if self.ledger is not None:
+            entries = self.ledger.entries(db_params, session=session)
+            checksums = dict((version, entry.checksum)
+                             for version, entry in entries.items())
+            applied = [(version, path) for version, path in migrations
+                       if version in checksums]
+
+        validator = MigrationValidator(workers=self.validate_workers,
+                                       logger=self.logger)
+        with self.metrics.phase('validate'):
+            return validator.validate(unprocessed, applied, checksums)
+
+    def verify_migrations(self, db_params, sql_directory):
+        """Compare the appliedMigrations ledger against the migrations in
+        `sql_directory`, returning a `Verification`."""
+        migrations = self.helpers.populate_migrations(sql_directory)
+        ledger = self.ledger or Ledger(self.database, self.logger)
+        return ledger.verify(ledger.entries(db_params), migrations,
+                             self.migration_checksum)
+
+    def load_baseline(self, db_params, db_version, migrations, baselines,
+                      session=None):
+        """Load the newest of `baselines` taken from the same migrations as
+        `migrations` into an empty database, returning the database version
+        afterwards."""
+        if int(db_version) or not baselines:
+            return db_version
+
+        db_connection = self.database.open_connection(db_params, session)
+        tables = [name for name, _ in list_tables(db_connection.cursor())
+                  if name not in EMPTY_DATABASE_TABLES]
+        self.database.release_connection(db_connection, session)
+        if tables or (self.ledger is not None and
+                      self.ledger.entries(db_params, session=session)):
+            self.logger.debug("Database is not empty, not loading a baseline")
+            return db_version
+
+        baseline = select_baseline(baselines, migrations,
+                                   self.migration_checksum, self.logger)
+        if baseline is None:
+            return db_version
+
+        self.logger.info(
+            "Loading baseline at version {version} from file: "
+            "'{file}'".format(version=baseline.version, file=baseline.path))
+        with self.metrics.phase('migration'):
+            result = self.database.apply_migration(db_params, baseline.path,
+                                                   session=session)
+        self.logger.info(
+            "Baseline loaded ({summary})".format(summary=result.summary()))
+        return self.update_current_version(db_params, baseline.version,
+                                           session=session)
+
+    def squash_migrations(self, db_params, sql_directory, output=None):
+        """Write a baseline of the schema and data of the database, which
+        must have been migrated with the migrations in `sql_directory`."""
+        migrations = self.helpers.populate_migrations(sql_directory)
+        db_version = int(self.database.fetch_current_version(db_params))
+        if not db_version:
+            raise BaselineError(
+                "Database has no migrations applied, so there is nothing to "
+                "squash")
+        if output is None:
+            output = baseline_path(sql_directory, db_version)
+
+        fingerprint = migrations_fingerprint(migrations, db_version,
+                                             self.migration_checksum)
+        self.logger.info(
+            "Writing baseline at version {version} to file: '{file}'".format(
+                version=db_version, file=output))
+        return BaselineDumper(self.database, self.logger).dump(
+            db_params, output, db_version, fingerprint)
+
+    def status(self, db_params, ttl=DEFAULT_STATUS_TTL):
+        """Return the `SchemaStatus` of the database, read from it at most
+        once every `ttl` seconds."""
+        def fetch():
+            with self.open_session(db_params) as session:
+                db_version = self.database.fetch_current_version(
+                    db_params, session=session)
+                ledger = self.ledger or Ledger(self.database, self.logger)
+                entries = ledger.entries(db_params, session=session)
+            return int(db_version), ledger_hash(entries)
+
+        return self.status_cache.lookup(status_target(db_params), ttl, fetch)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Data migrations: CSV files loaded into a table in sequence with ordinary
+SQL migrations.
+
+A data migration is named like any other migration, e.g.
+`057.seed_products.csv`, and starts with `# key: value` directive lines
+followed by a header row naming the columns to load:
+
+    # table: product
+    # batch_size: 5000
+    sku,name,price
+    A-1,"Chair, oak",45.00
+    A-2,Stool,\\N
+
+`table` is required and `batch_size` optionally overrides the run's batch
+size. Fields follow RFC 4180 quoting, and an unquoted or quoted `\\N` loads
+as NULL.
+"""
+import csv
+import itertools
+from collections import namedtuple
+
+from migration_runner.errors import MigrationRunnerError
+
+DATA_EXTENSIONS = ('.csv',)
+
+DATA_METHODS = ('executemany', 'load-data')
+
+DEFAULT_DATA_METHOD = 'executemany'
+
+DEFAULT_BATCH_SIZE = 1000
+
+NULL = '\\N'
+
+DIRECTIVES = ('table', 'batch_size')
+
+DataSpec = namedtuple('DataSpec', [
+    'table', 'columns', 'batch_size', 'header_lines', 'line_terminator'
+])
+
+
+class DataMigrationError(MigrationRunnerError, ValueError):
+    """Raised when a data migration file is malformed."""
+
+
+def is_data_migration(filename):
+    return filename.endswith(DATA_EXTENSIONS)
+
+
+def quote_identifier(name):
+    return '.'.join('`{}`'.format(part.strip().replace('`', '``'))
+                    for part in name.split('.'))
+
+
+def read_data_spec(data_file, filename=None):
+    """Read the directives and header row from the start of `data_file`,
+    which must be opened with `newline=''`, leaving it positioned at the
+    first row of data."""
+    filename = filename or getattr(data_file, 'name', '<data>')
+    directives = {}
+    header_lines = 0
+    line = ''
+    for line in data_file:
+        header_lines += 1
+        if not line.startswith('#'):
+            break
+        key, separator, value = line[1:].partition(':')
+        key = key.strip().lower()
+        if not separator or key not in DIRECTIVES:
+            raise DataMigrationError(
+                "Unknown directive '{}' on line {} of data migration "
+                "'{}'".format(line.strip(), header_lines, filename))
+        directives[key] = value.strip()
+    else:
+        line = ''
+
+    if not directives.get('table'):
+        raise DataMigrationError(
+            "Data migration '{}' has no '# table:' directive".format(
+                filename))
+    columns = next(csv.reader([line]), [])
+    if not columns:
+        raise DataMigrationError(
+            "Data migration '{}' has no header row naming its "
+            "columns".format(filename))
+
+    batch_size = None
+    if 'batch_size' in directives:
+        try:
+            batch_size = int(directives['batch_size'])
+        except ValueError:
+            batch_size = 0
+        if batch_size < 1:
+            raise DataMigrationError(
+                "Invalid batch_size '{}' in data migration '{}'".format(
+                    directives['batch_size'], filename))
+
+    return DataSpec(
+        table=directives['table'],
+        columns=[column.strip() for column in columns],
+        batch_size=batch_size,
+        header_lines=header_lines,
+        line_terminator='\r\n' if line.endswith('\r\n') else '\n'
+    )
+
+
+def insert_statement(spec):
+    return "INSERT INTO {table} ({columns}) VALUES ({values})".format(
+        table=quote_identifier(spec.table),
+        columns=", ".join(quote_identifier(c) for c in spec.columns),
+        values=", ".join(["%s"] * len(spec.columns))
+    )
+
+
+def load_data_statement(spec):
+    """Return a `LOAD DATA LOCAL INFILE` statement taking the file path as
+    its only parameter, and reading fields exactly as `data_batches` does:
+    no backslash escapes, with `\\N` mapped to NULL explicitly."""
+    variables = ["@c{}".format(i) for i in range(len(spec.columns))]
+    return (
+        "LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+        "CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+        "LINES TERMINATED BY '{lines}' IGNORE {ignore} LINES "
+        "({variables}) SET {assignments}".format(
+            table=quote_identifier(spec.table),
+            lines=spec.line_terminator.replace('\r', '\\r').replace(
+                '\n', '\\n'),
+            ignore=spec.header_lines,
+            variables=", ".join(variables),
+            assignments=", ".join(
+                "{} = NULLIF({}, '\\\\N')".format(quote_identifier(column),
+                                                  variable)
+                for column, variable in zip(spec.columns, variables))
+        )
+    )
+
+
+def data_batches(spec, data_file, batch_size):
+    """Yield lists of at most `batch_size` row tuples read from
+    `data_file`, positioned after the header by `read_data_spec`."""
+    reader = csv.reader(data_file)
+    width = len(spec.columns)
+    rows = (row for row in reader if row)
+    while True:
+        batch = []
+        for row in itertools.islice(rows, batch_size):
+            if len(row) != width:
+                raise DataMigrationError(
+                    "Expected {} fields on line {} of data migration '{}', "
+                    "found {}".format(width,
+                                      reader.line_num + spec.header_lines,
+                                      getattr(data_file, 'name', '<data>'),
+                                      len(row)))
+            batch.append(tuple(None if field == NULL else field
+                               for field in row))
+        if not batch:
+            return
+        yield batch
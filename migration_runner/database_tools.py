@@ -1,18 +1,70 @@
 # -*- coding: utf-8 -*-
 import io
 import logging
-import sys
+import os
+from timeit import default_timer
 
-import mysql.connector
+from migration_runner.backends import get_backend
+from migration_runner.checkpoint import CheckpointError, StatementCheckpoint
+from migration_runner.chunked import (ChunkedExecutor, ChunkedMigrationError,
+                                      read_chunk_spec)
+from migration_runner.coalesce import (DEFAULT_MAX_ALLOWED_PACKET,
+                                       InsertCoalescer)
+from migration_runner.data import (DEFAULT_BATCH_SIZE, DEFAULT_DATA_METHOD,
+                                   DataMigrationError, data_batches,
+                                   insert_statement, is_data_migration,
+                                   load_data_statement, read_data_spec)
+from migration_runner.mapped import (has_carriage_returns, map_file,
+                                     mapped_lines)
+from migration_runner.errors import DatabaseConnectionError
+from migration_runner.helpers import Helpers
+from migration_runner.metrics import Metrics
+from migration_runner.online import OnlineSchemaChangeError
+from migration_runner.results import (MigrationResult, StatementResult,
+                                      statement_checksum)
+from migration_runner.statements import (IncompleteStatementError,
+                                         split_statements)
+
+UPDATE_VERSION_SQL = "UPDATE versionTable SET version = %s"
+
+# Migrations applied in parallel commit in any order
+ADVANCE_VERSION_SQL = (
+    "UPDATE versionTable SET version = GREATEST(version, %s)"
+)
 
 
 class DatabaseTools:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, metrics=None, backend=None,
+                 data_method=DEFAULT_DATA_METHOD,
+                 batch_size=DEFAULT_BATCH_SIZE, coalesce_inserts=False,
+                 online_schema_change=None, checkpoint=False,
+                 mmap_statements=False):
         if logger is None:
             self.logger = logging.getLogger(__name__)
         else:
             self.logger = logger
 
+        self.metrics = Metrics() if metrics is None else metrics
+        self.backend = get_backend(backend)
+        self.data_method = data_method
+        self.batch_size = batch_size
+        self.coalesce_inserts = coalesce_inserts
+        self.online_schema_change = online_schema_change
+        self.checkpoint = checkpoint
+        self.mmap_statements = mmap_statements
+        self.chunked = ChunkedExecutor(self.logger)
+        self._max_allowed_packet = None
+
+    @property
+    def migration_errors(self):
+        """Exceptions which fail the migration being applied, rather than
+        indicating a bug. These include a file which cannot be decoded or
+        ends inside a quoted string or comment."""
+        return (self.backend.Error, DataMigrationError,
+                OnlineSchemaChangeError, ChunkedMigrationError,
+                CheckpointError, IncompleteStatementError,
+                UnicodeDecodeError)
+
     def connect_database(self, db_params):
         try:
             host, user, password, name = db_params
@@ -22,38 +74,248 @@ class DatabaseTools:
                 (user=user, password=password, host=host, db=name)
             )
 
-            db_connection = mysql.connector.connect(user=user,
-                                                    password=password,
-                                                    host=host,
-                                                    database=name)
-            db_connection.autocommit = True
-            return db_connection
+            with self.metrics.phase('connect'):
+                return self.backend.connect(
+                    host=host, user=user, password=password, database=name,
+                    local_infile=self.data_method == 'load-data')
 
-        except mysql.connector.Error as error:
-            self.logger.error(
+        except self.backend.Error as error:
+            raise DatabaseConnectionError(
                 "{} while connecting to database: {}".format(
                     type(error).__name__,
-                    error))
-            sys.exit(1)
+                    error), cause=error)
 
-    def fetch_current_version(self, db_params):
+    def open_connection(self, db_params, session=None):
+        if session is not None:
+            return session.connection()
+        return self.connect_database(db_params)
+
+    @staticmethod
+    def release_connection(db_connection, session=None):
+        if session is None:
+            db_connection.close()
+
+    def fetch_current_version(self, db_params, session=None):
         current_db_version = 0
         try:
-            db_connection = self.connect_database(db_params)
+            db_connection = self.open_connection(db_params, session)
             cursor = db_connection.cursor()
             cursor.execute("SELECT version FROM versionTable LIMIT 1")
             current_db_version = int(cursor.fetchone()[0])
-            db_connection.close()
-        except mysql.connector.Error as error:
+            self.release_connection(db_connection, session)
+        except self.backend.Error as error:
+            if session is not None:
+                session.handle_error(error)
             self.logger.error(
                 "{} while attempting to fetch database version, assuming"
                 " version 0: {}".format(type(error).__name__, error)
             )
         return current_db_version
 
-    def apply_migration(self, db_params, sql_filename):
-        with io.open(sql_filename) as sql_file:
-            db_connection = self.connect_database(db_params)
+    def apply_migration(self, db_params, sql_filename, session=None,
+                        version=None, record=None):
+        """Apply the migration in `sql_filename`, returning its
+        `MigrationResult`. With `version`, its statements and the update of
+        `versionTable` to it, if higher, run in one transaction. `record`,
+        if given, is called with the cursor and result once the statements
+        have run, and before that transaction commits."""
+        data_migration = is_data_migration(sql_filename)
+        if data_migration:
+            migration_file = io.open(sql_filename, encoding='utf-8',
+                                     newline='')
+        else:
+            migration_file = io.open(sql_filename)
+
+        with migration_file:
+            spec = None
+            chunk_spec = None
+            if data_migration:
+                spec = read_data_spec(migration_file, sql_filename)
+            else:
+                chunk_spec = read_chunk_spec(sql_filename)
+            db_connection = self.open_connection(db_params, session)
             cursor = db_connection.cursor()
-            cursor.execute(sql_file.read(), multi=True)
-            db_connection.close()
+            result = MigrationResult(sql_filename)
+            checkpoint = None
+            if self.checkpoint and not data_migration:
+                checkpoint = self.open_checkpoint(cursor, sql_filename)
+            if version is not None and chunk_spec is None:
+                # Each chunk of a chunked migration commits on its own
+                self.backend.start_transaction(db_connection)
+            try:
+                if data_migration:
+                    self.load_data(cursor, sql_filename, migration_file,
+                                   spec, result)
+                else:
+                    statements = enumerate(self.read_statements(
+                        cursor, migration_file,
+                        mappable=chunk_spec is None and checkpoint is None))
+                    if checkpoint is not None:
+                        statements = checkpoint.pending(statements)
+                    for index, statement in statements:
+                        result.record(self.apply_statement(
+                            cursor, db_params, sql_filename, index,
+                            statement, chunk_spec))
+                        if checkpoint is not None:
+                            checkpoint.save(index, statement)
+                    if checkpoint is not None:
+                        checkpoint.clear()
+                if record is not None:
+                    record(cursor, result)
+                if version is not None:
+                    cursor.execute(ADVANCE_VERSION_SQL, (version,))
+                    db_connection.commit()
+            except self.migration_errors:
+                if version is not None:
+                    db_connection.rollback()
+                raise
+            self.release_connection(db_connection, session)
+
+        self.metrics.increment('statements_executed', result.statements)
+        self.metrics.increment('bytes_read', os.path.getsize(sql_filename))
+        return result
+
+    def open_checkpoint(self, cursor, sql_filename):
+        try:
+            version = Helpers.extract_sequence_num(sql_filename)
+        except AttributeError:
+            # Not named like a migration, as with --single-file
+            return None
+        return StatementCheckpoint(cursor, version, sql_filename, self.logger)
+
+    def read_statements(self, cursor, sql_file, mappable=False):
+        if mappable and self.mmap_statements:
+            statements = self.read_mapped_statements(sql_file)
+            if statements is not None:
+                return statements
+
+        statements = split_statements(sql_file)
+        if not self.coalesce_inserts:
+            return statements
+        return InsertCoalescer(self.max_allowed_packet(cursor)).coalesce(
+            statements)
+
+    def read_mapped_statements(self, sql_file):
+        """Split a large migration into statements as undecoded bytes, read
+        through a memory map, for the driver to send as they are. Returns
+        None when the text path must be used instead: for small files, for
+        files with carriage returns, which text mode would translate, and
+        when statements must be inspected as text."""
+        if self.coalesce_inserts or self.online_schema_change is not None:
+            return None
+        buffer = map_file(sql_file)
+        if buffer is None:
+            return None
+        if has_carriage_returns(buffer):
+            buffer.close()
+            return None
+        self.logger.debug(
+            "Reading statements through a memory map from file: "
+            "'{}'".format(sql_file.name))
+        return split_statements(mapped_lines(buffer), binary=True)
+
+    def max_allowed_packet(self, cursor):
+        if self._max_allowed_packet is None:
+            try:
+                cursor.execute("SELECT @@max_allowed_packet")
+                self._max_allowed_packet = int(cursor.fetchall()[0][0])
+            except self.backend.Error as error:
+                self.logger.warning(
+                    "{} while reading max_allowed_packet, assuming {} "
+                    "bytes: {}".format(type(error).__name__,
+                                       DEFAULT_MAX_ALLOWED_PACKET, error))
+                self._max_allowed_packet = DEFAULT_MAX_ALLOWED_PACKET
+        return self._max_allowed_packet
+
+    def load_data(self, cursor, data_filename, data_file, spec, result):
+        if self.data_method == 'load-data':
+            result.record(self.execute_statement(
+                cursor, 0, load_data_statement(spec),
+                (os.path.abspath(data_filename),)))
+            return
+
+        statement = insert_statement(spec)
+        batches = data_batches(spec, data_file,
+                               spec.batch_size or self.batch_size)
+        for index, rows in enumerate(batches):
+            result.record(self.execute_batch(cursor, index, statement, rows))
+
+    def execute_statement(self, cursor, index, statement, params=None):
+        start = default_timer()
+        if params is None:
+            cursor.execute(statement)
+        else:
+            cursor.execute(statement, params)
+        if self.backend.has_rows(cursor):
+            cursor.fetchall()
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=cursor.rowcount,
+            warnings=self.backend.warning_count(cursor),
+            elapsed=elapsed
+        )
+
+    def apply_statement(self, cursor, db_params, sql_filename, index,
+                        statement, chunk_spec=None):
+        if chunk_spec is not None:
+            statement_result = self.execute_chunked(
+                cursor, sql_filename, index, statement, chunk_spec)
+            if statement_result is not None:
+                return statement_result
+        if self.online_schema_change is not None and \
+                self.online_schema_change.handles(statement):
+            return self.alter_online(cursor, index, statement, db_params)
+        return self.execute_statement(cursor, index, statement)
+
+    def execute_chunked(self, cursor, sql_filename, index, statement,
+                        chunk_spec):
+        start = default_timer()
+        rows = self.chunked.run(cursor, sql_filename, index, statement,
+                                chunk_spec)
+        if rows is None:
+            return None
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=rows,
+            warnings=0,
+            elapsed=elapsed
+        )
+
+    def alter_online(self, cursor, index, statement, db_params):
+        host, user, password, name = db_params
+
+        def connect_replica(replica_host):
+            return self.backend.connect(host=replica_host, user=user,
+                                        password=password, database=name)
+
+        start = default_timer()
+        rows = self.online_schema_change.run(cursor, statement,
+                                             connect_replica=connect_replica)
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=rows,
+            warnings=0,
+            elapsed=elapsed
+        )
+
+    def execute_batch(self, cursor, index, statement, rows):
+        start = default_timer()
+        cursor.executemany(statement, rows)
+        elapsed = default_timer() - start
+
+        return StatementResult(
+            index=index,
+            checksum=statement_checksum(statement),
+            rows_affected=cursor.rowcount,
+            warnings=self.backend.warning_count(cursor),
+            elapsed=elapsed
+        )
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Exceptions raised by migration_runner.
+
+Every error the package raises on purpose derives from
+`MigrationRunnerError`, so a program embedding it can handle them all with
+one `except` clause. Errors from the database driver itself are left as
+they are, and are available as `DatabaseTools.backend.Error`.
+"""
+
+
+class MigrationRunnerError(Exception):
+    """Base class for errors raised by migration_runner."""
+
+
+class DatabaseConnectionError(MigrationRunnerError):
+    """Raised when a connection to the database cannot be opened; the
+    driver's exception is available as `cause`."""
+
+    def __init__(self, message, cause=None):
+        super(DatabaseConnectionError, self).__init__(message)
+        self.cause = cause
+
+
+class InvalidMigrationFilenameError(MigrationRunnerError, ValueError):
+    """Raised when a file in the migrations directory has no version
+    number."""
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import io
+import logging
+import re
+import shlex
+from collections import namedtuple
+from timeit import default_timer
+
+from migration_runner.controller import Controller
+from migration_runner.errors import DatabaseConnectionError
+
+# Quoted text and escapes, or a `#` beginning a word, which starts a comment
+# as it does in a shell; one inside a word, as in a password, does not
+TARGET_LINE_TOKEN = re.compile(
+    r"""'[^']*'|"(?:[^"\\]|\\.)*"|\\.|(?:^|(?<=\s))#""")
+
+TargetResult = namedtuple('TargetResult', [
+    'target', 'db_version', 'processed', 'remaining', 'elapsed', 'error'
+])
+
+
+class TargetLoggerAdapter(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return "[{}] {}".format(self.extra['target'], msg), kwargs
+
+
+def split_target_line(line):
+    """Split a line of a targets file into shell-quoted fields, dropping
+    any comment."""
+    for match in TARGET_LINE_TOKEN.finditer(line):
+        if match.group() == '#':
+            line = line[:match.start()]
+            break
+    return shlex.split(line)
+
+
+def target_name(db_params):
+    host, _, _, name = db_params
+    return "{}/{}".format(host, name)
+
+
+class FanOut:
+    """Apply one migration plan to many databases with a bounded pool.
+
+    The migrations directory is scanned once and the resulting plan shared
+    read-only between worker threads, each of which drives its own
+    Controller and database session for one target at a time.
+    """
+
+    def __init__(self, logger=None, workers=8, controller_factory=None):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.workers = workers
+        if controller_factory is None:
+            self.controller_factory = Controller
+        else:
+            self.controller_factory = controller_factory
+
+    @staticmethod
+    def read_targets(targets_filename):
+        """Parse a targets file with one `user host db_name password` line
+        per database, matching the order of the CLI arguments."""
+        targets = []
+        with io.open(targets_filename) as targets_file:
+            for line_number, line in enumerate(targets_file, 1):
+                fields = split_target_line(line)
+                if not fields:
+                    continue
+                if len(fields) != 4:
+                    raise ValueError(
+                        "Expected 'user host db_name password' on line {} of "
+                        "targets file '{}'".format(line_number,
+                                                   targets_filename))
+                user, host, name, password = fields
+                targets.append((host, user, password, name))
+        return targets
+
+    def process_target(self, db_params, migrations, baselines=()):
+        name = target_name(db_params)
+        controller = self.controller_factory(
+            TargetLoggerAdapter(self.logger, {'target': name}))
+
+        start = default_timer()
+        try:
+            db_version, processed, remaining = \
+                controller.process_planned_migrations(
+                    db_params, migrations, baselines=baselines)
+            error = "migration failed" if remaining else None
+        except DatabaseConnectionError as exception:
+            self.logger.error("[{}] {}".format(name, exception))
+            db_version, processed, remaining = None, 0, None
+            error = "connection failed"
+        except Exception as exception:
+            self.logger.error("[{}] {}: {}".format(
+                name, type(exception).__name__, exception))
+            db_version, processed, remaining = None, 0, None
+            error = type(exception).__name__
+
+        return TargetResult(name, db_version, processed, remaining,
+                            default_timer() - start, error)
+
+    def process_targets(self, targets, sql_directory):
+        planner = self.controller_factory(self.logger)
+        migrations = planner.helpers.populate_migrations(sql_directory)
+        baselines = planner.find_baselines(sql_directory)
+        self.logger.info(
+            "Applying {migrations} migrations to {targets} databases with "
+            "{workers} workers".format(migrations=len(migrations),
+                                       targets=len(targets),
+                                       workers=self.workers))
+
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(max(1, min(self.workers, len(targets))))
+        try:
+            results = pool.map(
+                lambda db_params: self.process_target(db_params, migrations,
+                                                      baselines),
+                targets
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+        self.log_summary(results)
+        return results
+
+    def log_summary(self, results):
+        width = max([len("TARGET")] + [len(r.target) for r in results])
+        row = "{target:<{width}}  {version:>10}  {applied:>7}  " \
+              "{remaining:>9}  {elapsed:>8}  {status}"
+        self.logger.info(row.format(
+            target="TARGET", width=width, version="VERSION",
+            applied="APPLIED", remaining="REMAINING", elapsed="TIME",
+            status="STATUS"))
+        for result in results:
+            self.logger.info(row.format(
+                target=result.target, width=width,
+                version=self._cell(result.db_version),
+                applied=result.processed,
+                remaining=self._cell(result.remaining),
+                elapsed="{:.2f}s".format(result.elapsed),
+                status=result.error or "ok"))
+
+        failed = len([result for result in results if result.error])
+        self.logger.info(
+            "Fan-out complete: {ok} succeeded, {failed} failed".format(
+                ok=len(results) - failed, failed=failed))
+
+    @staticmethod
+    def _cell(value):
+        return "-" if value is None else value
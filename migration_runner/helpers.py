@@ -1,17 +1,65 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
 import os
 import re
-import sys
+
+from migration_runner.data import DATA_EXTENSIONS, is_data_migration
+from migration_runner.errors import InvalidMigrationFilenameError
+from migration_runner.index import MigrationIndex
+from migration_runner.manifest import MigrationManifest
+from migration_runner.metrics import Metrics
+
+MIGRATION_EXTENSIONS = (".sql",) + DATA_EXTENSIONS
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
 
 
 class Helpers:
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, manifest_path=None, metrics=None):
         if logger is None:
             self.logger = logging.getLogger(__name__)
         else:
             self.logger = logger
 
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.manifest_path = manifest_path
+        self.manifest = None
+
+    @staticmethod
+    def is_migration_file(filename):
+        return filename.endswith(MIGRATION_EXTENSIONS)
+
+    @staticmethod
+    def scan_file(filename):
+        """Return the sha256 checksum of a file and an estimate of the number
+        of statements in it, counted from delimiters, in a single pass.
+        For data migrations the estimate is of lines, i.e. rows."""
+        checksum = hashlib.sha256()
+        delimiter = b'\n' if is_data_migration(filename) else b';'
+        delimiters = 0
+        with open(filename, 'rb') as migration_file:
+            for chunk in iter(
+                    lambda: migration_file.read(CHECKSUM_CHUNK_SIZE), b''):
+                checksum.update(chunk)
+                delimiters += chunk.count(delimiter)
+        return checksum.hexdigest(), delimiters
+
+    def file_checksum(self, filename):
+        return self.scan_file(filename)[0]
+
+    def describe_migration(self, filename):
+        """Return (size, checksum, estimated statements) for a migration,
+        from the manifest when one has been loaded."""
+        if self.manifest is not None:
+            entry = self.manifest.entry(filename)
+            if entry is not None:
+                return entry['size'], entry['checksum'], entry['statements']
+
+        checksum, statements = self.scan_file(filename)
+        return os.path.getsize(filename), checksum, statements
+
     @staticmethod
     def extract_sequence_num(filename):
         sequence_num = re.search(
@@ -25,13 +73,13 @@ class Helpers:
         try:
             migrations.append((self.extract_sequence_num(filename), filename))
         except AttributeError:
-            self.logger.error("Invalid filename found: {}".format(filename))
-            sys.exit(1)
+            raise InvalidMigrationFilenameError(
+                "Invalid filename found: {}".format(filename))
 
     def find_migrations(self, sql_directory):
         migrations = []
         for filename in os.listdir(sql_directory):
-            if filename.endswith(".sql"):
+            if self.is_migration_file(filename):
                 self.append_migration(
                     migrations,
                     str(os.path.join(sql_directory, filename))
@@ -40,10 +88,11 @@ class Helpers:
 
     @staticmethod
     def sort_migrations(migrations):
-        if (
-            all(isinstance(tup, tuple) for tup in migrations) and
-            all(isinstance(tup[0], int) for tup in migrations) and
-            all(isinstance(tup[1], str) for tup in migrations)
+        if all(
+            isinstance(tup, tuple) and
+            isinstance(tup[0], int) and
+            isinstance(tup[1], str)
+            for tup in migrations
         ):
             migrations.sort(key=lambda tup: tup[0])
         else:
@@ -51,10 +100,18 @@ class Helpers:
                 "Migrations list did not contain only tuple(int, str)")
 
     def populate_migrations(self, sql_directory):
-        migrations = self.find_migrations(sql_directory)
-        self.sort_migrations(migrations)
-        return migrations
+        with self.metrics.phase('plan'):
+            if self.manifest_path is not None:
+                self.manifest = MigrationManifest(self.manifest_path, self,
+                                                  self.logger)
+                return MigrationIndex(self.manifest.migrations(sql_directory))
+
+            migrations = self.find_migrations(sql_directory)
+            self.sort_migrations(migrations)
+            return MigrationIndex(migrations)
 
     @staticmethod
     def get_unprocessed_migrations(db_version, migrations):
+        if isinstance(migrations, MigrationIndex):
+            return migrations.pending(db_version)
         return [tup for tup in migrations if tup[0] > int(db_version)]
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left, bisect_right
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # pragma: no cover
+    from collections import Sequence
+
+
+class MigrationIndex(Sequence):
+    """Sorted migrations held as a version array plus a parallel path table.
+
+    Behaves like the list of (version, path) tuples it was built from, but
+    versions are stored in a compact machine-integer array (falling back to
+    a plain list for versions too big for 64 bits) so that pending
+    migrations can be found with a binary search.
+    """
+
+    def __init__(self, migrations=()):
+        versions = []
+        self.paths = []
+        for version, path in migrations:
+            versions.append(version)
+            self.paths.append(path)
+        try:
+            self.versions = array('q', versions)
+        except (OverflowError, ValueError):
+            self.versions = versions
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return list(self)[item]
+            return MigrationView(self, start, max(start, stop))
+        return self.versions[item], self.paths[item]
+
+    def __iter__(self):
+        return zip(self.versions, self.paths)
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, list(self))
+
+    def pending(self, db_version):
+        start = bisect_right(self.versions, int(db_version))
+        return MigrationView(self, start, len(self))
+
+    def add(self, version, path):
+        """Insert a migration, keeping the index sorted."""
+        position = bisect_right(self.versions, version)
+        try:
+            self.versions.insert(position, version)
+        except OverflowError:
+            self.versions = list(self.versions)
+            self.versions.insert(position, version)
+        self.paths.insert(position, path)
+
+    def unapplied(self, applied):
+        """Return the migrations whose versions are not in the set
+        `applied`, found by set difference rather than a scan."""
+        unapplied = []
+        for version in sorted(set(self.versions).difference(applied)):
+            for position in range(bisect_left(self.versions, version),
+                                  bisect_right(self.versions, version)):
+                unapplied.append(self[position])
+        return unapplied
+
+
+class MigrationView(Sequence):
+    """Read-only window onto a contiguous range of a MigrationIndex."""
+
+    def __init__(self, index, start, stop):
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return list(self)[item]
+            return MigrationView(self.index, self.start + start,
+                                 self.start + max(start, stop))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("MigrationView index out of range")
+        return self.index[self.start + item]
+
+    def __iter__(self):
+        versions = self.index.versions
+        paths = self.index.paths
+        for position in range(self.start, self.stop):
+            yield versions[position], paths[position]
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, list(self))
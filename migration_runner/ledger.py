@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from collections import namedtuple
+
+# ER_NO_SUCH_TABLE
+NO_SUCH_TABLE = 1146
+
+CREATE_LEDGER_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS appliedMigrations ("
+    "version BIGINT NOT NULL PRIMARY KEY, "
+    "filename VARCHAR(255) NOT NULL, "
+    "checksum CHAR(64) NOT NULL, "
+    "duration DOUBLE NOT NULL, "
+    "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+)
+
+RECORD_SQL = (
+    "REPLACE INTO appliedMigrations (version, filename, checksum, duration) "
+    "VALUES (%s, %s, %s, %s)"
+)
+
+LedgerEntry = namedtuple('LedgerEntry', [
+    'version', 'filename', 'checksum', 'duration', 'applied_at'
+])
+
+Verification = namedtuple('Verification', [
+    'applied', 'edited', 'missing', 'pending'
+])
+
+
+def unapplied_migrations(migrations, applied):
+    """Return the (version, path) tuples of `migrations` whose versions are
+    not in the set `applied`, in version order."""
+    if hasattr(migrations, 'unapplied'):
+        return migrations.unapplied(applied)
+    return [migration for migration in migrations
+            if migration[0] not in applied]
+
+
+class Ledger:
+    """The `appliedMigrations` table: one row per applied migration with
+    the checksum of the file applied, how long it took and when.
+
+    Unlike the single version in `versionTable`, the ledger records exactly
+    which migrations have run, so a file numbered below the latest applied
+    version is still picked up, and edited or deleted files can be found.
+    A database migrated before the ledger was introduced is adopted by
+    recording every migration up to its `versionTable` version as applied,
+    as are migrations applied by runs without the ledger since its latest
+    entry.
+    """
+
+    def __init__(self, database, logger=None):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.database = database
+
+    def entries(self, db_params, session=None):
+        """Return a dict of version to `LedgerEntry`, empty if the ledger
+        table does not exist yet."""
+        db_connection = self.database.open_connection(db_params, session)
+        cursor = db_connection.cursor()
+        try:
+            cursor.execute("SELECT version, filename, checksum, duration, "
+                           "applied_at FROM appliedMigrations")
+            rows = cursor.fetchall()
+        except self.database.backend.Error as error:
+            if self.database.backend.error_code(error) != NO_SUCH_TABLE:
+                raise
+            rows = []
+        self.database.release_connection(db_connection, session)
+        return dict((int(row[0]), LedgerEntry(int(row[0]), *row[1:]))
+                    for row in rows)
+
+    @staticmethod
+    def unrecorded_versions(entries, db_version, migrations):
+        """Versions above the latest in the ledger up to `db_version`, which
+        `versionTable` shows were applied without recording them, as before
+        the ledger was introduced or by a run without it."""
+        latest = max(entries) if entries else 0
+        return set(version for version, _ in migrations
+                   if latest < version <= int(db_version))
+
+    @classmethod
+    def applied_versions(cls, entries, db_version, migrations):
+        """Versions to treat as applied: those in the ledger and those
+        applied since without being recorded."""
+        return set(entries).union(
+            cls.unrecorded_versions(entries, db_version, migrations))
+
+    def create_table(self, db_params, session=None):
+        """Create the ledger table if it does not exist yet. Being DDL, this
+        cannot be done inside the transaction of a migration."""
+        db_connection = self.database.open_connection(db_params, session)
+        cursor = db_connection.cursor()
+        cursor.execute(CREATE_LEDGER_TABLE_SQL)
+        self.database.release_connection(db_connection, session)
+
+    @staticmethod
+    def write(cursor, version, filename, checksum, duration):
+        """Record a migration using `cursor`, so inside its transaction if
+        one is open. The table must already exist."""
+        cursor.execute(RECORD_SQL, (version, os.path.basename(filename),
+                                    checksum, duration))
+
+    def adopt(self, db_params, db_version, entries, migrations, checksum,
+              session=None):
+        """Record the migrations applied without the ledger, as given by
+        `unrecorded_versions`, as applied with their current checksums."""
+        unrecorded = self.unrecorded_versions(entries, db_version, migrations)
+        adopted = [(version, os.path.basename(path), checksum(path), 0.0)
+                   for version, path in migrations if version in unrecorded]
+        if not adopted:
+            return 0
+
+        db_connection = self.database.open_connection(db_params, session)
+        cursor = db_connection.cursor()
+        cursor.execute(CREATE_LEDGER_TABLE_SQL)
+        cursor.executemany(RECORD_SQL, adopted)
+        self.database.release_connection(db_connection, session)
+        self.logger.info(
+            "Recorded {count} migrations up to version {version} in the "
+            "appliedMigrations ledger".format(count=len(adopted),
+                                              version=db_version))
+        return len(adopted)
+
+    @staticmethod
+    def verify(entries, migrations, checksum):
+        """Compare the ledger against the migrations directory.
+
+        Returns a `Verification` of the applied migrations checked, those
+        whose files have been edited since they were applied (as
+        (entry, path, current checksum) tuples), ledger entries with no
+        file, and migrations not yet applied.
+        """
+        paths = dict(migrations)
+        edited = []
+        for version in sorted(set(entries).intersection(paths)):
+            current = checksum(paths[version])
+            if current != entries[version].checksum:
+                edited.append((entries[version], paths[version], current))
+
+        missing = [entries[version]
+                   for version in sorted(set(entries).difference(paths))]
+        pending = unapplied_migrations(migrations, set(entries))
+        return Verification(len(entries), edited, missing, pending)
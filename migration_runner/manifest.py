@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import logging
+import os
+
+MANIFEST_FORMAT = 2
+
+
+class MigrationManifest:
+    """On-disk index of a migrations directory.
+
+    Stores the parsed version, size, mtime, checksum and estimated statement
+    count of every migration file along with the sorted order, keyed by the
+    directory's own mtime.
+    When the directory has not changed its listing is reused as-is, and only
+    files whose size or mtime differ from the index are re-parsed and
+    re-hashed, so planning cost no longer grows with the full history.
+
+    The manifest file should live outside the migrations directory, as
+    writing it would otherwise change the directory mtime on every save.
+    """
+
+    def __init__(self, path, helpers, logger=None):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.path = path
+        self.helpers = helpers
+        self.entries = {}
+
+    def load(self, sql_directory):
+        try:
+            with io.open(self.path, encoding='utf-8') as manifest_file:
+                data = json.load(manifest_file)
+        except (IOError, OSError, ValueError) as error:
+            self.logger.debug(
+                "Ignoring unreadable manifest '{}': {}".format(self.path,
+                                                               error))
+            return None
+
+        if (
+            data.get('format') != MANIFEST_FORMAT or
+            data.get('directory') != os.path.abspath(sql_directory)
+        ):
+            return None
+        return data
+
+    def save(self, sql_directory, directory_mtime, order):
+        data = {
+            'format': MANIFEST_FORMAT,
+            'directory': os.path.abspath(sql_directory),
+            'directory_mtime': directory_mtime,
+            'files': self.entries,
+            'order': order,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(data, manifest_file, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+    def _entry(self, sql_directory, filename, cached):
+        stat = os.stat(os.path.join(sql_directory, filename))
+        if (
+            cached is not None and
+            cached['size'] == stat.st_size and
+            cached['mtime'] == stat.st_mtime
+        ):
+            return cached, False
+
+        path = str(os.path.join(sql_directory, filename))
+        parsed = []
+        self.helpers.append_migration(parsed, path)
+        checksum, statements = self.helpers.scan_file(path)
+        return {
+            'version': parsed[0][0],
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'checksum': checksum,
+            'statements': statements,
+        }, True
+
+    def migrations(self, sql_directory):
+        data = self.load(sql_directory) or {}
+        cached_entries = data.get('files', {})
+        directory_mtime = os.stat(sql_directory).st_mtime
+
+        if data.get('directory_mtime') == directory_mtime:
+            filenames = list(cached_entries)
+        else:
+            filenames = [filename for filename in os.listdir(sql_directory)
+                         if self.helpers.is_migration_file(filename)]
+
+        changed = set(filenames) != set(cached_entries)
+        self.entries = {}
+        for filename in filenames:
+            entry, updated = self._entry(sql_directory, filename,
+                                         cached_entries.get(filename))
+            self.entries[filename] = entry
+            changed = changed or updated
+
+        if changed or data.get('directory_mtime') != directory_mtime:
+            order = sorted(self.entries,
+                           key=lambda name: self.entries[name]['version'])
+            self.save(sql_directory, directory_mtime, order)
+            self.logger.debug(
+                "Migration manifest '{}' updated".format(self.path))
+        else:
+            order = data['order']
+            self.logger.debug(
+                "Migration manifest '{}' is fresh".format(self.path))
+
+        return [
+            (self.entries[filename]['version'],
+             str(os.path.join(sql_directory, filename)))
+            for filename in order
+        ]
+
+    def entry(self, path):
+        return self.entries.get(os.path.basename(path))
+
+    def checksum(self, path):
+        return self.entries[os.path.basename(path)]['checksum']
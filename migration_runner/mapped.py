@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import mmap
+import os
+
+# Files at least this large are memory-mapped rather than read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+# Pages of a mapped file already read are dropped from the process's
+# resident set every this many bytes, as mapped pages otherwise count
+# towards it until the whole file has been read
+RELEASE_INTERVAL = 4 * 1024 * 1024
+
+
+def map_file(migration_file, threshold=MMAP_THRESHOLD):
+    """Return a read-only memory map of the open `migration_file`, or None
+    if it is smaller than `threshold` bytes."""
+    size = os.fstat(migration_file.fileno()).st_size
+    if not size or size < threshold:
+        return None
+    return mmap.mmap(migration_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def advise(buffer, option, *args):
+    # madvise() is only available from Python 3.8, and not on every platform
+    if hasattr(buffer, 'madvise') and hasattr(mmap, option):
+        buffer.madvise(getattr(mmap, option), *args)
+
+
+def has_carriage_returns(buffer, release_interval=RELEASE_INTERVAL):
+    """Return whether the memory map `buffer` contains a carriage return,
+    releasing the pages read to find out as it goes."""
+    for start in range(0, len(buffer), release_interval):
+        found = buffer.find(b'\r', start, start + release_interval) != -1
+        advise(buffer, 'MADV_DONTNEED', start,
+               min(release_interval, len(buffer) - start))
+        if found:
+            return True
+    return False
+
+
+def mapped_checksum(buffer, release_interval=RELEASE_INTERVAL):
+    """Return the SHA-256 hex digest of the memory map `buffer`, releasing
+    the pages read as it goes."""
+    digest = hashlib.sha256()
+    with memoryview(buffer) as view:
+        for start in range(0, len(buffer), release_interval):
+            end = min(start + release_interval, len(buffer))
+            digest.update(view[start:end])
+            advise(buffer, 'MADV_DONTNEED', start, end - start)
+    return digest.hexdigest()
+
+
+def mapped_lines(buffer, release_interval=RELEASE_INTERVAL):
+    """Yield the lines of the memory map `buffer` as bytes, closing it once
+    they have all been read."""
+    advise(buffer, 'MADV_SEQUENTIAL')
+    released = 0
+    try:
+        for line in iter(buffer.readline, b''):
+            yield line
+            position = buffer.tell()
+            if position - released >= release_interval:
+                # The pages remain in the page cache; only this process's
+                # mapping of them is dropped
+                end = position - position % mmap.PAGESIZE
+                advise(buffer, 'MADV_DONTNEED', released, end - released)
+                released = end
+    finally:
+        buffer.close()
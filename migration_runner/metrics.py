@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from timeit import default_timer
+
+PHASES = ('plan', 'validate', 'connect', 'migration', 'run')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0, 900.0)
+
+DESCRIPTIONS = {
+    'plan_seconds': "Time taken to scan and sort the migrations directory.",
+    'validate_seconds': "Time taken to validate migration files before "
+                        "applying any.",
+    'connect_seconds': "Time taken to open a database connection.",
+    'migration_seconds': "Time taken to apply a single migration file.",
+    'run_seconds': "Time taken for a whole migration run.",
+    'statements_executed': "SQL statements executed.",
+    'bytes_read': "Bytes of migration files read.",
+    'migrations_applied': "Migration files applied successfully.",
+    'migrations_failed': "Migration files which raised a database error.",
+    'migrations_invalid': "Migration files which failed validation.",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """Counters and histograms describing a migration run.
+
+    Phases (see `PHASES`) are timed with `phase()`, which records a
+    `<phase>_seconds` histogram and, for phases named in `profile_phases`,
+    accumulates a cProfile profile which `write_profiles()` dumps to disk.
+    """
+
+    def __init__(self, prefix='migration_runner', profile_phases=(),
+                 profile_dir='.'):
+        self.prefix = prefix
+        self.profile_phases = set(profile_phases)
+        self.profile_dir = profile_dir
+        self.counters = {}
+        self.histograms = {}
+        self._profiles = {}
+        self._profiling = False
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    @contextmanager
+    def phase(self, name):
+        profile = None
+        if name in self.profile_phases and not self._profiling:
+            if name not in self._profiles:
+                import cProfile
+
+                self._profiles[name] = cProfile.Profile()
+            profile = self._profiles[name]
+            self._profiling = True
+            profile.enable()
+
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.observe(name + '_seconds', default_timer() - start)
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+
+    def write_profiles(self):
+        filenames = []
+        for name, profile in sorted(self._profiles.items()):
+            filename = os.path.join(self.profile_dir, name + '.prof')
+            profile.dump_stats(filename)
+            filenames.append(filename)
+        return filenames
+
+    @staticmethod
+    def _format_bound(bound):
+        return '+Inf' if bound == float('inf') else repr(float(bound))
+
+    def as_openmetrics(self):
+        lines = []
+        for name in sorted(self.counters):
+            metric = "{}_{}".format(self.prefix, name)
+            lines.append("# HELP {} {}".format(metric,
+                                               DESCRIPTIONS.get(name, name)))
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("{}_total {}".format(metric, self.counters[name]))
+
+        for name in sorted(self.histograms):
+            metric = "{}_{}".format(self.prefix, name)
+            histogram = self.histograms[name]
+            lines.append("# HELP {} {}".format(metric,
+                                               DESCRIPTIONS.get(name, name)))
+            lines.append("# TYPE {} histogram".format(metric))
+            for bound, total in histogram.cumulative():
+                lines.append('{}_bucket{{le="{}"}} {}'.format(
+                    metric, self._format_bound(bound), total))
+            lines.append("{}_sum {!r}".format(metric, histogram.sum))
+            lines.append("{}_count {}".format(metric, histogram.count))
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self):
+        return {
+            'counters': dict(self.counters),
+            'histograms': dict(
+                (name, {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': [[self._format_bound(bound), total]
+                                for bound, total in histogram.cumulative()],
+                })
+                for name, histogram in self.histograms.items()
+            ),
+        }
+
+    def write_openmetrics(self, filename):
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as metrics_file:
+            metrics_file.write(self.as_openmetrics())
+        os.rename(temp_filename, filename)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as report_file:
+            json.dump(self.as_dict(), report_file, indent=2, sort_keys=True)
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+import time
+from timeit import default_timer
+
+from migration_runner.errors import MigrationRunnerError
+
+IDENTIFIER = r'(?:`(?:[^`]|``)+`|[\w$]+)'
+
+ALTER_TABLE = re.compile(
+    r'^\s*ALTER\s+TABLE\s+(' + IDENTIFIER + r'(?:\s*\.\s*' + IDENTIFIER +
+    r')?)\s+(.+?)\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+
+# Renaming the table itself is instant, and cannot be done on a copy
+TABLE_RENAME = re.compile(r'\bRENAME\s+(?!(?:COLUMN|INDEX|KEY)\b)',
+                          re.IGNORECASE)
+
+COLUMN_RENAMES = (
+    re.compile(r'\bCHANGE\s+(?:COLUMN\s+)?(' + IDENTIFIER + r')\s+(' +
+               IDENTIFIER + r')', re.IGNORECASE),
+    re.compile(r'\bRENAME\s+COLUMN\s+(' + IDENTIFIER + r')\s+TO\s+(' +
+               IDENTIFIER + r')', re.IGNORECASE),
+)
+
+MAX_IDENTIFIER_LENGTH = 64
+
+# ER_DUP_ENTRY, expected when the copy meets a row the triggers already wrote
+DUPLICATE_ENTRY = 1062
+
+
+class OnlineSchemaChangeError(MigrationRunnerError):
+    """Raised when an ALTER cannot be applied as an online schema change."""
+
+
+def unquote(identifier):
+    identifier = identifier.strip()
+    if identifier.startswith('`'):
+        return identifier[1:-1].replace('``', '`')
+    return identifier
+
+
+def quote(identifier):
+    return '`{}`'.format(identifier.replace('`', '``'))
+
+
+def parse_alter(statement):
+    """Return (schema, table, alter specification) for an ALTER TABLE which
+    can be run as an online schema change, or None."""
+    match = ALTER_TABLE.match(statement)
+    if match is None or TABLE_RENAME.search(match.group(2)):
+        return None
+    parts = re.findall(IDENTIFIER, match.group(1))
+    schema = unquote(parts[0]) if len(parts) == 2 else None
+    return schema, unquote(parts[-1]), match.group(2)
+
+
+def column_renames(specification):
+    renames = {}
+    for pattern in COLUMN_RENAMES:
+        for old, new in pattern.findall(specification):
+            if unquote(old).lower() != unquote(new).lower():
+                renames[unquote(old).lower()] = unquote(new)
+    return renames
+
+
+def primary_key_columns(cursor, schema, table):
+    """Return the primary key columns of `table`, in index order."""
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+        "AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY' "
+        "ORDER BY SEQ_IN_INDEX",
+        (schema, table))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def unique_keys(cursor, schema, table):
+    """Return the lower case column names of each unique key of `table`,
+    including its primary key, as sets."""
+    cursor.execute(
+        "SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+        "AND TABLE_NAME = %s AND NON_UNIQUE = 0 "
+        "ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (schema, table))
+    keys = {}
+    for index, column in cursor.fetchall():
+        # Functional key parts have no column, and only match themselves
+        keys.setdefault(index, set()).add(
+            column.lower() if column is not None else "({})".format(index))
+    return list(keys.values())
+
+
+def estimate_rows(cursor, schema, table):
+    """Return the server's estimate of the number of rows in `table`."""
+    cursor.execute(
+        "SELECT TABLE_ROWS FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+        "AND TABLE_NAME = %s",
+        (schema, table))
+    rows = cursor.fetchall()
+    return int(rows[0][0] or 0) if rows else 0
+
+
+class Throttle:
+    """Pauses an online schema change between chunks while the server is
+    busy or its replicas are lagging.
+
+    `max_threads_running` is compared against the primary's
+    Threads_running status, and `max_replica_lag` against
+    Seconds_Behind_Master on a connection to each of `replica_hosts`,
+    opened by `connect_replica(host)`. A replica which is not replicating
+    counts as lagging.
+    """
+
+    def __init__(self, max_threads_running=None, max_replica_lag=None,
+                 replica_hosts=(), connect_replica=None, chunk_sleep=0.0,
+                 check_interval=1.0, sleep=time.sleep):
+        self.max_threads_running = max_threads_running
+        self.max_replica_lag = max_replica_lag
+        self.replica_hosts = list(replica_hosts)
+        self.connect_replica = connect_replica
+        self.chunk_sleep = chunk_sleep
+        self.check_interval = check_interval
+        self.sleep = sleep
+        self.throttled = 0.0
+        self._replica_connections = None
+
+    @staticmethod
+    def _status(cursor, statement):
+        cursor.execute(statement)
+        rows = cursor.fetchall()
+        names = [column[0] for column in cursor.description or ()]
+        return [dict(zip(names, row)) for row in rows]
+
+    def reason(self, cursor):
+        if self.max_threads_running is not None:
+            status = self._status(
+                cursor, "SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            running = int(status[0]['Value']) if status else 0
+            if running > self.max_threads_running:
+                return "{} threads running (max {})".format(
+                    running, self.max_threads_running)
+
+        if self.max_replica_lag is not None and self.replica_hosts:
+            if self._replica_connections is None:
+                self._replica_connections = [
+                    self.connect_replica(host) for host in self.replica_hosts]
+            for host, connection in zip(self.replica_hosts,
+                                        self._replica_connections):
+                replica_cursor = connection.cursor()
+                status = self._status(replica_cursor, "SHOW SLAVE STATUS")
+                replica_cursor.close()
+                lag = status[0].get('Seconds_Behind_Master') if status \
+                    else None
+                if lag is None or int(lag) > self.max_replica_lag:
+                    return "replica {} lag is {}s (max {}s)".format(
+                        host, "unknown" if lag is None else lag,
+                        self.max_replica_lag)
+        return None
+
+    def wait(self, cursor, logger):
+        while True:
+            reason = self.reason(cursor)
+            if reason is None:
+                break
+            logger.info("Throttling online schema change: {}".format(reason))
+            self.sleep(self.check_interval)
+            self.throttled += self.check_interval
+        if self.chunk_sleep:
+            self.sleep(self.chunk_sleep)
+
+    def close(self):
+        for connection in self._replica_connections or ():
+            connection.close()
+        self._replica_connections = None
+
+
+class OnlineSchemaChange:
+    """Apply ALTER TABLE without locking the table, in the style of
+    pt-online-schema-change.
+
+    The ALTER is applied to an empty shadow copy of the table, triggers
+    replay writes made to the original onto the shadow, rows are copied
+    across in primary key order in chunks of `chunk_size`, pausing while
+    a `Throttle` built from the remaining options says so, and finally the
+    two tables are swapped with one atomic RENAME TABLE. Renamed columns
+    are followed via their CHANGE / RENAME COLUMN clauses; dropped columns
+    are simply not copied.
+
+    Rows are copied with INSERT IGNORE and replayed with REPLACE, which
+    would silently drop rows a new unique key rejects, so such ALTERs are
+    refused, and the copy is abandoned on any warning, such as a value
+    truncated to fit a narrowed column, rather than changing data a plain
+    ALTER would have failed on.
+    """
+
+    def __init__(self, logger=None, chunk_size=1000,
+                 max_threads_running=None, max_replica_lag=None,
+                 replica_hosts=(), chunk_sleep=0.0, drop_old_table=True,
+                 progress_interval=30.0, sleep=time.sleep):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.chunk_size = chunk_size
+        self.max_threads_running = max_threads_running
+        self.max_replica_lag = max_replica_lag
+        self.replica_hosts = list(replica_hosts)
+        self.chunk_sleep = chunk_sleep
+        self.drop_old_table = drop_old_table
+        self.progress_interval = progress_interval
+        self.sleep = sleep
+
+    def throttle(self, connect_replica=None):
+        return Throttle(self.max_threads_running, self.max_replica_lag,
+                        self.replica_hosts if connect_replica else (),
+                        connect_replica, chunk_sleep=self.chunk_sleep,
+                        sleep=self.sleep)
+
+    @staticmethod
+    def handles(statement):
+        return parse_alter(statement) is not None
+
+    @staticmethod
+    def _rows(cursor, statement, params=()):
+        cursor.execute(statement, params)
+        return cursor.fetchall()
+
+    def _columns(self, cursor, schema, table):
+        return [(name, extra) for name, extra in self._rows(
+            cursor,
+            "SELECT COLUMN_NAME, EXTRA FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+            "AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+            (schema, table))]
+
+    def _check_table(self, cursor, schema, table, names):
+        if any(len(name) > MAX_IDENTIFIER_LENGTH for name in names.values()):
+            raise OnlineSchemaChangeError(
+                "Table name '{}' is too long for an online schema "
+                "change".format(table))
+
+        existing = self._rows(
+            cursor,
+            "SELECT TABLE_NAME FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+            "AND TABLE_NAME IN (%s, %s)",
+            (schema, names['shadow'], names['old']))
+        if existing:
+            raise OnlineSchemaChangeError(
+                "Table '{}' already exists, possibly left by an interrupted "
+                "online schema change".format(existing[0][0]))
+
+        triggers = self._rows(
+            cursor,
+            "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS "
+            "WHERE EVENT_OBJECT_SCHEMA = COALESCE(%s, DATABASE()) "
+            "AND EVENT_OBJECT_TABLE = %s",
+            (schema, table))
+        if triggers:
+            raise OnlineSchemaChangeError(
+                "Table '{}' already has triggers, so cannot be changed "
+                "online".format(table))
+
+        # CREATE TABLE ... LIKE does not copy foreign keys, and RENAME TABLE
+        # would leave those of child tables pointing at the old copy
+        foreign_keys = self._rows(
+            cursor,
+            "SELECT DISTINCT CONSTRAINT_NAME, TABLE_NAME "
+            "FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE REFERENCED_TABLE_NAME IS NOT NULL "
+            "AND ((TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+            "AND TABLE_NAME = %s) "
+            "OR (REFERENCED_TABLE_SCHEMA = COALESCE(%s, DATABASE()) "
+            "AND REFERENCED_TABLE_NAME = %s))",
+            (schema, table, schema, table))
+        if foreign_keys:
+            raise OnlineSchemaChangeError(
+                "Table '{}' has or is referenced by foreign keys ({}), so "
+                "cannot be changed online".format(
+                    table, ", ".join("{} on '{}'".format(name, owner)
+                                     for name, owner in foreign_keys)))
+
+        primary_key = primary_key_columns(cursor, schema, table)
+        if not primary_key:
+            raise OnlineSchemaChangeError(
+                "Table '{}' has no primary key, so cannot be copied in "
+                "chunks".format(table))
+        return primary_key
+
+    def _column_mapping(self, cursor, schema, table, shadow, renames,
+                        primary_key):
+        shadow_columns = dict(
+            (name.lower(), name) for name, extra in
+            self._columns(cursor, schema, shadow)
+            if 'GENERATED' not in extra.upper())
+        mapping = []
+        for name, extra in self._columns(cursor, schema, table):
+            if 'GENERATED' in extra.upper():
+                continue
+            target = renames.get(name.lower(), name).lower()
+            if target in shadow_columns:
+                mapping.append((name, shadow_columns[target]))
+
+        copied = dict((old.lower(), new) for old, new in mapping)
+        missing = [column for column in primary_key
+                   if column.lower() not in copied]
+        if missing:
+            raise OnlineSchemaChangeError(
+                "Primary key column(s) {} of table '{}' would not survive "
+                "the ALTER, so cannot be changed online".format(
+                    ", ".join(missing), table))
+        return mapping, [copied[column.lower()] for column in primary_key]
+
+    @staticmethod
+    def _check_unique_keys(cursor, schema, table, shadow, mapping):
+        """Refuse an ALTER adding a unique key which rows of the table could
+        violate: one not implied by an existing unique key."""
+        old_names = dict((new.lower(), old.lower()) for old, new in mapping)
+        existing = unique_keys(cursor, schema, table)
+        for key in unique_keys(cursor, schema, shadow):
+            columns = set(old_names[column] for column in key
+                          if column in old_names)
+            if not any(unique <= columns for unique in existing):
+                raise OnlineSchemaChangeError(
+                    "The ALTER adds a unique key on ({}) to table '{}', "
+                    "which the online copy would enforce by silently "
+                    "dropping duplicate rows, so it cannot be changed "
+                    "online".format(", ".join(sorted(key)), table))
+
+    @staticmethod
+    def _trigger_statements(qualify, names, mapping, primary_key,
+                            shadow_key):
+        new_columns = ", ".join(quote(new) for _, new in mapping)
+        new_values = ", ".join("NEW." + quote(old) for old, _ in mapping)
+        key = ", ".join(quote(column) for column in shadow_key)
+        old_key = ", ".join("OLD." + quote(c) for c in primary_key)
+        new_key = ", ".join("NEW." + quote(c) for c in primary_key)
+        table = qualify(names['table'])
+        shadow = qualify(names['shadow'])
+        replace = "REPLACE INTO {} ({}) VALUES ({})".format(
+            shadow, new_columns, new_values)
+
+        return [
+            "CREATE TRIGGER {} AFTER DELETE ON {} FOR EACH ROW "
+            "DELETE IGNORE FROM {} WHERE ({}) = ({})".format(
+                qualify(names['delete']), table, shadow, key, old_key),
+            "CREATE TRIGGER {} AFTER UPDATE ON {} FOR EACH ROW BEGIN "
+            "DELETE IGNORE FROM {} WHERE NOT (({}) <=> ({})) "
+            "AND ({}) = ({}); {}; END".format(
+                qualify(names['update']), table, shadow, old_key, new_key,
+                key, old_key, replace),
+            "CREATE TRIGGER {} AFTER INSERT ON {} FOR EACH ROW {}".format(
+                qualify(names['insert']), table, replace),
+        ]
+
+    def _copy(self, cursor, throttle, qualify, names, mapping, primary_key,
+              estimated_rows):
+        key = ", ".join(quote(column) for column in primary_key)
+        placeholders = ", ".join(["%s"] * len(primary_key))
+        table = qualify(names['table'])
+        insert = (
+            "INSERT LOW_PRIORITY IGNORE INTO {shadow} ({new}) "
+            "SELECT {old} FROM {table} FORCE INDEX (PRIMARY) "
+            "WHERE {{where}} LOCK IN SHARE MODE".format(
+                shadow=qualify(names['shadow']),
+                new=", ".join(quote(new) for _, new in mapping),
+                old=", ".join(quote(old) for old, _ in mapping),
+                table=table)
+        )
+
+        copied = 0
+        chunks = 0
+        lower = None
+        start = default_timer()
+        last_report = start
+        while True:
+            throttle.wait(cursor, self.logger)
+
+            bound = "({}) > ({})".format(key, placeholders)
+            params = list(lower or ())
+            upper = self._rows(
+                cursor,
+                "SELECT {key} FROM {table} FORCE INDEX (PRIMARY) {where} "
+                "ORDER BY {key} LIMIT 1 OFFSET %s".format(
+                    key=key, table=table,
+                    where="WHERE " + bound if lower is not None else ""),
+                tuple(params + [self.chunk_size - 1]))
+
+            conditions = [bound] if lower is not None else []
+            if upper:
+                conditions.append("({}) <= ({})".format(key, placeholders))
+                params.extend(upper[0])
+            cursor.execute(
+                insert.format(where=" AND ".join(conditions) or "1 = 1"),
+                tuple(params))
+            copied += max(cursor.rowcount, 0)
+            chunks += 1
+            self._check_warnings(cursor, names['table'])
+
+            now = default_timer()
+            if now - last_report >= self.progress_interval:
+                last_report = now
+                self._log_progress(names['table'], copied, estimated_rows,
+                                   now - start)
+            if not upper:
+                break
+            lower = tuple(upper[0])
+
+        self.logger.info(
+            "Copied {rows} rows of '{table}' in {chunks} chunks in "
+            "{elapsed:.1f}s ({throttled:.1f}s throttled)".format(
+                rows=copied, table=names['table'], chunks=chunks,
+                elapsed=default_timer() - start,
+                throttled=throttle.throttled))
+        return copied
+
+    def _check_warnings(self, cursor, table):
+        warnings = [row for row in self._rows(cursor, "SHOW WARNINGS")
+                    if int(row[1]) != DUPLICATE_ENTRY]
+        if warnings:
+            raise OnlineSchemaChangeError(
+                "Copying rows of '{}' raised {} warnings, so the rows copied "
+                "would differ from the original; the first was: {} {}: "
+                "{}".format(table, len(warnings), *warnings[0]))
+
+    def _log_progress(self, table, copied, estimated_rows, elapsed):
+        if estimated_rows and copied < estimated_rows:
+            eta = elapsed * (estimated_rows - copied) / max(copied, 1)
+            self.logger.info(
+                "Copying '{table}': {copied} of ~{total} rows ({percent:.0f}%"
+                "), about {eta:.0f}s remaining".format(
+                    table=table, copied=copied, total=estimated_rows,
+                    percent=100.0 * copied / estimated_rows, eta=eta))
+        else:
+            self.logger.info("Copying '{}': {} rows so far".format(
+                table, copied))
+
+    def run(self, cursor, statement, connect_replica=None):
+        """Apply `statement`, an ALTER TABLE, online and return the number
+        of rows copied. `connect_replica(host)` opens the connections used
+        to check replica lag."""
+        schema, table, specification = parse_alter(statement)
+        names = {
+            'table': table,
+            'shadow': "_{}_new".format(table),
+            'old': "_{}_old".format(table),
+            'insert': "_{}_osc_ins".format(table),
+            'update': "_{}_osc_upd".format(table),
+            'delete': "_{}_osc_del".format(table),
+        }
+
+        def qualify(name):
+            if schema is None:
+                return quote(name)
+            return "{}.{}".format(quote(schema), quote(name))
+
+        primary_key = self._check_table(cursor, schema, table, names)
+        estimated_rows = estimate_rows(cursor, schema, table)
+
+        self.logger.info(
+            "Altering '{}' (~{} rows) online via shadow table '{}'".format(
+                table, estimated_rows, names['shadow']))
+
+        throttle = self.throttle(connect_replica)
+        created = []
+        try:
+            cursor.execute("CREATE TABLE {} LIKE {}".format(
+                qualify(names['shadow']), qualify(table)))
+            created.append(('TABLE', names['shadow']))
+            cursor.execute("ALTER TABLE {} {}".format(
+                qualify(names['shadow']), specification))
+
+            mapping, shadow_key = self._column_mapping(
+                cursor, schema, table, names['shadow'],
+                column_renames(specification), primary_key)
+            self._check_unique_keys(cursor, schema, table, names['shadow'],
+                                    mapping)
+            for trigger, name in zip(
+                    self._trigger_statements(qualify, names, mapping,
+                                             primary_key, shadow_key),
+                    (names['delete'], names['update'], names['insert'])):
+                cursor.execute(trigger)
+                created.append(('TRIGGER', name))
+
+            copied = self._copy(cursor, throttle, qualify, names, mapping,
+                                primary_key, estimated_rows)
+
+            cursor.execute("RENAME TABLE {} TO {}, {} TO {}".format(
+                qualify(table), qualify(names['old']),
+                qualify(names['shadow']), qualify(table)))
+            # Triggers move with the original table, and are dropped first
+            created = [(kind, name) for kind, name in created
+                       if kind == 'TRIGGER']
+            if self.drop_old_table:
+                created.insert(0, ('TABLE', names['old']))
+            else:
+                self.logger.info("Original table kept as '{}'".format(
+                    names['old']))
+        finally:
+            throttle.close()
+            for kind, name in reversed(created):
+                cursor.execute("DROP {} IF EXISTS {}".format(kind,
+                                                             qualify(name)))
+
+        return copied
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import heapq
+import itertools
+from collections import namedtuple
+
+StatementResult = namedtuple('StatementResult', [
+    'index', 'checksum', 'rows_affected', 'warnings', 'elapsed'
+])
+
+PlanEntry = namedtuple('PlanEntry', [
+    'version', 'filename', 'size', 'checksum', 'statements'
+])
+
+MigrationPlan = namedtuple('MigrationPlan', [
+    'db_version', 'total_migrations', 'pending'
+])
+
+APPLIED = 'applied'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# What happened to one pending migration in a run: APPLIED, FAILED (with
+# the exception raised as `error`) or SKIPPED after an earlier failure
+MigrationOutcome = namedtuple('MigrationOutcome', [
+    'version', 'filename', 'status', 'elapsed', 'statements',
+    'rows_affected', 'error'
+])
+
+
+def applied_outcome(version, filename, result):
+    return MigrationOutcome(version, filename, APPLIED, result.elapsed,
+                            result.statements, result.rows_affected, None)
+
+
+def failed_outcome(version, filename, error):
+    return MigrationOutcome(version, filename, FAILED, 0.0, 0, 0, error)
+
+
+def plan_as_dict(plan):
+    return {
+        'db_version': plan.db_version,
+        'total_migrations': plan.total_migrations,
+        'pending': [entry._asdict() for entry in plan.pending],
+    }
+
+
+def statement_checksum(statement):
+    if not isinstance(statement, bytes):
+        statement = statement.encode('utf-8')
+    return hashlib.sha256(statement).hexdigest()
+
+
+class SlowestStatements:
+    """Bounded collection of the slowest statements seen so far."""
+
+    def __init__(self, limit=5):
+        self.limit = limit
+        self._heap = []
+        self._counter = itertools.count()
+
+    def add(self, filename, statement_result):
+        entry = (statement_result.elapsed, next(self._counter),
+                 filename, statement_result)
+        if len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def __iter__(self):
+        for entry in sorted(self._heap, reverse=True):
+            yield entry[2], entry[3]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class MigrationResult:
+    """Aggregated timings for the statements executed from one file.
+
+    Only totals and the slowest few statements are kept, so memory stays
+    constant regardless of how many statements the file contains.
+    """
+
+    def __init__(self, filename, slowest_limit=5):
+        self.filename = filename
+        self.statements = 0
+        self.rows_affected = 0
+        self.warnings = 0
+        self.elapsed = 0.0
+        self._slowest = SlowestStatements(slowest_limit)
+
+    def record(self, statement_result):
+        self.statements += 1
+        self.rows_affected += max(statement_result.rows_affected, 0)
+        self.warnings += statement_result.warnings
+        self.elapsed += statement_result.elapsed
+        self._slowest.add(self.filename, statement_result)
+
+    @property
+    def slowest(self):
+        return [result for _, result in self._slowest]
+
+    def summary(self):
+        return (
+            "{statements} statements in {elapsed:.3f}s, {rows} rows "
+            "affected, {warnings} warnings".format(
+                statements=self.statements, elapsed=self.elapsed,
+                rows=self.rows_affected, warnings=self.warnings)
+        )
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+import threading
+from collections import namedtuple
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from migration_runner.data import (DataMigrationError, is_data_migration,
+                                   read_data_spec)
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.results import (SlowestStatements, applied_outcome,
+                                      failed_outcome)
+from migration_runner.statements import (IncompleteStatementError,
+                                         split_statements)
+from migration_runner.status import status_target
+
+DEPENDS_HEADER = re.compile(r'^\s*--\s*depends\s*:(.*)$', re.IGNORECASE)
+
+IDENTIFIER = r'(?:`(?:[^`]|``)+`|[\w$]+)'
+
+# Table names following the keywords which introduce them
+TABLE_REFERENCE = re.compile(
+    r'\b(?:FROM|JOIN|INTO|UPDATE|TABLE|TABLES|EXISTS|ON|REFERENCES|LIKE|TO)'
+    r'\s+(' + IDENTIFIER + r'(?:\s*\.\s*' + IDENTIFIER + r')?)',
+    re.IGNORECASE
+)
+
+WORD = re.compile(IDENTIFIER)
+
+FOREIGN_KEY = re.compile(r'\bREFERENCES\s+(' + IDENTIFIER + r')',
+                         re.IGNORECASE)
+
+TABLE_DEFINITION = re.compile(
+    r'^(?:CREATE|ALTER)\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(' + IDENTIFIER + r'(?:\s*\.\s*' + IDENTIFIER + r')?)',
+    re.IGNORECASE
+)
+
+# Statements whose effects cannot be pinned to the tables they name
+BARRIER_STATEMENT = re.compile(
+    r'^(?:CREATE|ALTER|DROP)\s+(?:OR\s+REPLACE\s+)?'
+    r'(?:(?:ALGORITHM|DEFINER|SQL\s+SECURITY)\s*=?\s*\S+\s+)*'
+    r'(?:VIEW|PROCEDURE|FUNCTION|TRIGGER|EVENT|DATABASE|SCHEMA|USER)\b'
+    r'|^(?:GRANT|REVOKE|RENAME\s+USER|USE|FLUSH|LOCK|UNLOCK|CALL|PREPARE|'
+    r'EXECUTE|HANDLER|LOAD)\b'
+    r'|^SET\s+(?:GLOBAL\b|PERSIST\b|@@GLOBAL\.)',
+    re.IGNORECASE
+)
+
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"",
+                            re.DOTALL)
+
+COMMENT = re.compile(r'/\*.*?\*/|(?:--\s|#)[^\n]*', re.DOTALL)
+
+# Words captured after the keywords above which are never table names
+NOT_TABLES = frozenset([
+    'if', 'not', 'exists', 'select', 'duplicate', 'delete', 'update',
+    'set', 'table', 'tables', 'values', 'value', 'outfile', 'dumpfile',
+    'local', 'temporary', 'ignore', 'low_priority', 'high_priority',
+    'delayed', 'quick', 'lateral', 'dual', 'schedule', 'completion',
+])
+
+VERSION_TABLE = 'versiontable'
+
+MigrationAnalysis = namedtuple('MigrationAnalysis', [
+    'version', 'path', 'tables', 'barrier', 'depends', 'words',
+    'foreign_keys'
+])
+
+
+class DependsHeaderError(MigrationRunnerError):
+    """Raised for a `-- depends:` header which is not a list of versions."""
+
+
+def normalise_table(name):
+    """Return the lower case, unqualified, unquoted name of a table."""
+    name = re.split(r'\s*\.\s*(?=`|[\w$])', name.strip())[-1]
+    if name.startswith('`'):
+        name = name[1:-1].replace('``', '`')
+    return name.lower()
+
+
+def read_depends_header(path):
+    """Return the versions listed in a `-- depends:` header at the top of a
+    migration, an empty list for `-- depends: none`, or None if the file
+    has no such header."""
+    with io.open(path) as migration_file:
+        for number, line in enumerate(migration_file, 1):
+            if not line.strip():
+                continue
+            match = DEPENDS_HEADER.match(line)
+            if match:
+                value = match.group(1).strip()
+                if value.lower() == 'none':
+                    return []
+                try:
+                    return [int(version) for version in
+                            re.split(r'[\s,]+', value) if version]
+                except ValueError:
+                    raise DependsHeaderError(
+                        "Invalid depends header on line {line} of migration "
+                        "'{file}': '{header}'".format(
+                            line=number, file=path, header=line.strip()))
+            if not line.lstrip().startswith(('--', '#')):
+                return None
+    return None
+
+
+def statement_text(statement):
+    """Strip string literals and comments, which can name tables only by
+    coincidence."""
+    return COMMENT.sub(' ', STRING_LITERAL.sub("''", statement)).strip()
+
+
+class MigrationGraph:
+    """Dependency graph over pending migrations, in version order.
+
+    Each migration is analysed for the tables it references. Two
+    migrations sharing a table, including one linked through a foreign key
+    declared by either, are ordered as written. Migrations touching stored
+    programs, views, users, global state or `versionTable` are barriers,
+    ordered against every other migration. A `-- depends: 12, 45` (or
+    `-- depends: none`) header replaces the analysis for its migration.
+    """
+
+    def __init__(self, migrations):
+        self.migrations = list(migrations)
+        self.analyses = []
+        self.depends = {}
+        self.dependents = dict((version, []) for version, _ in
+                               self.migrations)
+        self._build()
+
+    @staticmethod
+    def analyse(version, path):
+        if is_data_migration(path):
+            try:
+                with io.open(path, encoding='utf-8',
+                             newline='') as data_file:
+                    table = normalise_table(read_data_spec(data_file,
+                                                           path).table)
+                return MigrationAnalysis(version, path, set([table]), False,
+                                         None, set(), [])
+            except DataMigrationError:
+                return MigrationAnalysis(version, path, set(), True, None,
+                                         set(), [])
+
+        depends = read_depends_header(path)
+        tables = set()
+        words = set()
+        foreign_keys = []
+        barrier = False
+        try:
+            with io.open(path) as sql_file:
+                for statement in split_statements(sql_file):
+                    statement = statement_text(statement)
+                    if BARRIER_STATEMENT.match(statement):
+                        barrier = True
+                    for match in TABLE_REFERENCE.finditer(statement):
+                        table = normalise_table(match.group(1))
+                        if table not in NOT_TABLES:
+                            tables.add(table)
+                    # Unquoted identifiers cannot be all digits, so numbers
+                    # are left out rather than kept for every row of a dump
+                    words.update(normalise_table(word)
+                                 for word in WORD.findall(statement)
+                                 if not word.isdigit())
+                    referenced = FOREIGN_KEY.findall(statement)
+                    table = TABLE_DEFINITION.match(statement)
+                    if referenced and table:
+                        foreign_keys.append(
+                            set([normalise_table(table.group(1))] +
+                                [normalise_table(name)
+                                 for name in referenced]))
+        except (IncompleteStatementError, UnicodeDecodeError):
+            return MigrationAnalysis(version, path, set(), True, depends,
+                                     set(), [])
+
+        return MigrationAnalysis(version, path, tables,
+                                 barrier or VERSION_TABLE in tables, depends,
+                                 words, foreign_keys)
+
+    def _build(self):
+        analyses = [self.analyse(version, path)
+                    for version, path in self.migrations]
+
+        # Every name introduced by a keyword anywhere is a known table, so
+        # other mentions of it (in comma joins, say) are picked up too
+        known = set()
+        linked = {}
+        for analysis in analyses:
+            known.update(analysis.tables)
+            for group in analysis.foreign_keys:
+                for table in group:
+                    linked.setdefault(table, set()).update(group)
+
+        pending = set(version for version, _ in self.migrations)
+        touched_by = {}
+        earlier = []
+        last_barrier = None
+        for analysis in analyses:
+            tables = analysis.tables.union(analysis.words.intersection(known))
+            for table in list(tables):
+                tables.update(linked.get(table, ()))
+
+            if analysis.depends is not None:
+                depends = set(version for version in analysis.depends
+                              if version in pending and
+                              version < analysis.version)
+            elif analysis.barrier:
+                depends = set(earlier)
+            else:
+                depends = set()
+                if last_barrier is not None:
+                    depends.add(last_barrier)
+                for table in tables:
+                    depends.update(touched_by.get(table, ()))
+
+            self.depends[analysis.version] = depends
+            for version in depends:
+                self.dependents[version].append(analysis.version)
+            for table in tables:
+                touched_by.setdefault(table, []).append(analysis.version)
+            if analysis.barrier and analysis.depends is None:
+                last_barrier = analysis.version
+            earlier.append(analysis.version)
+            self.analyses.append(analysis._replace(tables=tables))
+
+    def roots(self):
+        return [version for version, _ in self.migrations
+                if not self.depends[version]]
+
+
+class MigrationScheduler:
+    """Apply pending migrations concurrently, following a MigrationGraph.
+
+    Up to `workers` migrations run at once, each worker thread with its own
+    database session. Pending migrations are found through the ledger,
+    which each migration is recorded in as it completes, so migrations
+    which completed after another failed are not applied again by the next
+    run. `versionTable` is advanced to the highest version for which every
+    pending migration at or below it has completed or, with
+    `--inline-version`, to the highest version applied, inside each
+    migration's transaction.
+    """
+
+    def __init__(self, controller, workers=4):
+        self.controller = controller
+        self.logger = controller.logger
+        self.workers = workers
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self, db_params):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self.controller.open_session(db_params)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _apply(self, db_params, version, path, completed):
+        session = self._session(db_params)
+        try:
+            record = self.controller.ledger_recorder(version, path)
+            with self.controller.metrics.phase('migration'):
+                if self.controller.inline_version_update:
+                    result = self.controller.database.apply_migration(
+                        db_params, path, session=session, version=version,
+                        record=record)
+                else:
+                    result = self.controller.database.apply_migration(
+                        db_params, path, session=session, record=record)
+        except Exception as exception:
+            # Handed to the scheduling thread, which stops the run and
+            # re-raises anything other than a migration failure
+            if isinstance(exception, self.controller.database.backend.Error):
+                session.handle_error(exception)
+            completed.put((version, None, exception))
+        else:
+            completed.put((version, result, None))
+
+    def process_migrations(self, db_params, db_version, migrations,
+                           session=None):
+        migrations = list(migrations)
+        graph = MigrationGraph(migrations)
+        paths = dict(migrations)
+        order = [version for version, _ in migrations]
+        waiting = dict((version, len(graph.depends[version]))
+                       for version in order)
+        ready = graph.roots()
+        done = set()
+        running = 0
+        failed = False
+        unexpected = None
+        high_water = 0
+        slowest = SlowestStatements(self.controller.slowest_limit)
+
+        self.logger.info(
+            "Applying {count} migrations with up to {workers} in parallel, "
+            "{roots} initially independent".format(
+                count=len(order), workers=self.workers, roots=len(ready)))
+
+        from multiprocessing.pool import ThreadPool
+
+        if self.controller.ledger is not None and order:
+            self.controller.ledger.create_table(db_params, session=session)
+
+        completed = queue.Queue()
+        pool = ThreadPool(max(1, min(self.workers, len(order))))
+        try:
+            while ready or running:
+                while ready and running < self.workers and not failed:
+                    version = ready.pop(0)
+                    self.logger.debug(
+                        "Starting migration: {version} with filename: "
+                        "'{file}'".format(version=version,
+                                          file=paths[version]))
+                    pool.apply_async(self._apply, (db_params, version,
+                                                   paths[version], completed))
+                    running += 1
+                if not running:
+                    break
+
+                version, result, error = completed.get()
+                running -= 1
+                if error is not None:
+                    failed = True
+                    if not isinstance(
+                            error, self.controller.migration_errors):
+                        unexpected = unexpected or error
+                        continue
+                    self.controller.metrics.increment('migrations_failed')
+                    self.controller.outcomes.append(
+                        failed_outcome(version, paths[version], error))
+                    self.logger.error(
+                        "{type} while processing migration in file: '{file}'"
+                        ": {error}".format(type=type(error).__name__,
+                                           file=paths[version], error=error))
+                    continue
+
+                done.add(version)
+                self.controller.status_cache.invalidate(
+                    status_target(db_params))
+                self.controller.metrics.increment('migrations_applied')
+                self.controller.outcomes.append(
+                    applied_outcome(version, paths[version], result))
+                self.logger.info(
+                    "Migration {version} applied from file: '{file}' "
+                    "({summary})".format(version=version, file=paths[version],
+                                         summary=result.summary()))
+                for statement in result.slowest:
+                    slowest.add(paths[version], statement)
+                for dependent in graph.dependents[version]:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        ready.append(dependent)
+                ready.sort()
+
+                advanced = high_water
+                while high_water < len(order) and order[high_water] in done:
+                    high_water += 1
+                if self.controller.inline_version_update:
+                    db_version = max(int(db_version), version)
+                elif high_water > advanced:
+                    db_version = self.controller.update_current_version(
+                        db_params, max(int(db_version),
+                                       order[high_water - 1]),
+                        session=session)
+        finally:
+            pool.close()
+            pool.join()
+            for worker_session in self._sessions:
+                worker_session.close()
+
+        if unexpected is not None:
+            raise unexpected
+
+        self.controller.log_slowest_statements(slowest)
+        beyond = sorted(done.difference(order[:high_water]))
+        if beyond:
+            self.logger.warning(
+                "Migrations {} completed after an earlier migration failed; "
+                "they are recorded in the ledger, so will not be applied "
+                "again".format(", ".join(str(version) for version in beyond)))
+        return db_version, len(done)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+# Client errors meaning the server side of the connection has gone away:
+# CR_SERVER_GONE_ERROR, CR_SERVER_LOST, CR_SERVER_LOST_EXTENDED,
+# CR_CONNECTION_ERROR and CR_CONN_HOST_ERROR
+CONNECTION_LOST_ERRORS = (2006, 2013, 2055, 2002, 2003)
+
+
+class DatabaseSession:
+    """Single database connection reused for the whole of a migration run.
+
+    The connection is opened lazily on first use. If it has been idle for
+    longer than `ping_interval` seconds it is pinged before being handed out,
+    and if a caller reports a lost-connection error it is dropped so the next
+    use transparently reconnects.
+    """
+
+    def __init__(self, database, db_params, logger=None, ping_interval=30):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.database = database
+        self.db_params = db_params
+        self.ping_interval = ping_interval
+        self.handshakes = 0
+        self._connection = None
+        self._last_used = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _is_alive(self):
+        if time.time() - self._last_used < self.ping_interval:
+            return True
+        try:
+            self.database.backend.ping(self._connection)
+            return True
+        except self.database.backend.Error as error:
+            self.logger.warning(
+                "{} on idle database connection, reconnecting: {}".format(
+                    type(error).__name__, error)
+            )
+            return False
+
+    def connection(self):
+        if self._connection is None or not self._is_alive():
+            self._connection = self.database.connect_database(self.db_params)
+            self.handshakes += 1
+        self._last_used = time.time()
+        return self._connection
+
+    def cursor(self):
+        return self.connection().cursor()
+
+    def handle_error(self, error):
+        if self.database.backend.error_code(error) in CONNECTION_LOST_ERRORS:
+            self.logger.warning(
+                "Database connection lost, will reconnect on next use")
+            self._connection = None
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except self.database.backend.Error:
+                pass
+            self._connection = None
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import re
+
+from migration_runner.coalesce import LEADING_COMMENTS
+from migration_runner.errors import MigrationRunnerError
+
+DEFAULT_DELIMITER = ';'
+
+DELIMITER_COMMAND = re.compile(r'^\s*DELIMITER\s+(\S+)', re.IGNORECASE)
+
+# Header of statements whose body is a BEGIN ... END compound block, matched
+# after any LEADING_COMMENTS
+COMPOUND_HEADER = re.compile(
+    r'CREATE\b.*?\b(PROCEDURE|FUNCTION|TRIGGER|EVENT)\b',
+    re.IGNORECASE | re.DOTALL
+)
+
+END_QUALIFIER = re.compile(r'\s+(IF|LOOP|WHILE|REPEAT|CASE)\b', re.IGNORECASE)
+
+QUOTE_END = {
+    "'": re.compile(r"\\.|'", re.DOTALL),
+    '"': re.compile(r'\\.|"', re.DOTALL),
+    '`': re.compile(r'`'),
+}
+
+BLOCK_COMMENT_END = re.compile(r'\*/')
+
+
+class Syntax:
+    """The patterns and tokens a `StatementSplitter` looks for, compiled
+    either for text or, with `binary`, for bytes."""
+
+    def __init__(self, binary=False):
+        if binary:
+            self.literal = lambda text: text.encode('ascii')
+            self.text = lambda literal: literal.decode('ascii')
+        else:
+            self.literal = self.text = lambda text: text
+
+        literal = self.literal
+        self.empty = literal('')
+        self.default_delimiter = literal(DEFAULT_DELIMITER)
+        self.block_comment = literal('/*')
+        # /*! ... */ is executed by MySQL, and /*+ ... */ holds optimizer
+        # hints, so unlike other comments they are statement content
+        self.executable_comments = (literal('!'), literal('+'))
+        self.line_comments = (literal('--'), literal('#'))
+        self.begin, self.end, self.case = (literal(keyword) for keyword in
+                                           ('BEGIN', 'END', 'CASE'))
+        self.delimiter_command = self.compile(DELIMITER_COMMAND)
+        self.leading_comments = self.compile(LEADING_COMMENTS)
+        self.compound_header = self.compile(COMPOUND_HEADER)
+        self.end_qualifier = self.compile(END_QUALIFIER)
+        self.block_comment_end = self.compile(BLOCK_COMMENT_END)
+        self.quote_end = dict((literal(quote), self.compile(pattern))
+                              for quote, pattern in QUOTE_END.items())
+
+    def compile(self, pattern):
+        return re.compile(self.literal(pattern.pattern),
+                          pattern.flags & ~re.UNICODE)
+
+    def token(self, delimiter):
+        literal = self.literal
+        tokens = [literal(r"['\"`]"), literal(r'--(?=\s|$)'), literal(r'#'),
+                  literal(r'/\*'), re.escape(delimiter)]
+        if delimiter == self.default_delimiter:
+            tokens.append(literal(r'\b(?:BEGIN|END|CASE)\b'))
+        return re.compile(literal('|').join(tokens), re.IGNORECASE)
+
+
+TEXT_SYNTAX = Syntax()
+
+BINARY_SYNTAX = Syntax(binary=True)
+
+
+class IncompleteStatementError(MigrationRunnerError, ValueError):
+    pass
+
+
+class StatementSplitter:
+    """Incrementally split a stream of SQL text into single statements.
+
+    Lines are consumed one at a time and each statement is yielded as soon
+    as its delimiter is seen, so memory use is bounded by the size of the
+    largest statement rather than the whole file. Quoted strings and
+    identifiers, comments, `DELIMITER` commands and BEGIN ... END bodies of
+    stored programs are all honoured when looking for statement boundaries.
+
+    With `binary`, lines and the statements yielded are bytes, so that a
+    file can be sent to the server without being decoded; the delimiters
+    and keywords looked for are all ASCII, so this is safe for UTF-8.
+    """
+
+    def __init__(self, delimiter=DEFAULT_DELIMITER, binary=False):
+        self.syntax = BINARY_SYNTAX if binary else TEXT_SYNTAX
+        self.delimiter = None
+        self._token = None
+        self._set_delimiter(self.syntax.literal(delimiter))
+
+    def _set_delimiter(self, delimiter):
+        self.delimiter = delimiter
+        self._token = self.syntax.token(delimiter)
+
+    def _is_compound(self, statement):
+        syntax = self.syntax
+        return syntax.compound_header.match(
+            statement, syntax.leading_comments.match(statement).end())
+
+    def split(self, lines):
+        syntax = self.syntax
+        pieces = []
+        has_content = False
+        state = None
+        depth = 0
+
+        for line in lines:
+            if state is None and not has_content:
+                command = syntax.delimiter_command.match(line)
+                if command:
+                    self._set_delimiter(command.group(1))
+                    pieces = []
+                    continue
+
+            position = 0
+            length = len(line)
+            while position < length:
+                if state is not None:
+                    if state == syntax.block_comment:
+                        match = syntax.block_comment_end.search(
+                            line, position)
+                    else:
+                        match = syntax.quote_end[state].search(
+                            line, position)
+                        while match and match.group() != state:
+                            match = syntax.quote_end[state].search(
+                                line, match.end())
+                    if match is None:
+                        pieces.append(line[position:])
+                        break
+                    pieces.append(line[position:match.end()])
+                    position = match.end()
+                    state = None
+                    continue
+
+                match = self._token.search(line, position)
+                if match is None:
+                    chunk = line[position:]
+                    if chunk.strip():
+                        has_content = True
+                    pieces.append(chunk)
+                    break
+
+                before = line[position:match.start()]
+                if before.strip():
+                    has_content = True
+                token = match.group()
+                upper = token.upper()
+
+                if token == self.delimiter and depth == 0:
+                    pieces.append(before)
+                    position = match.end()
+                    if has_content:
+                        yield syntax.empty.join(pieces).strip()
+                    pieces = []
+                    has_content = False
+                    continue
+
+                pieces.append(before)
+                position = match.end()
+
+                if token in syntax.quote_end:
+                    pieces.append(token)
+                    has_content = True
+                    state = token
+                elif token == syntax.block_comment:
+                    pieces.append(token)
+                    state = syntax.block_comment
+                    if line[position:position + 1] in \
+                            syntax.executable_comments:
+                        has_content = True
+                elif token in syntax.line_comments:
+                    pieces.append(line[match.start():])
+                    break
+                elif upper == syntax.begin:
+                    pieces.append(token)
+                    has_content = True
+                    if depth > 0 or self._is_compound(
+                            syntax.empty.join(pieces)):
+                        depth += 1
+                elif upper == syntax.case:
+                    pieces.append(token)
+                    has_content = True
+                    if depth > 0:
+                        depth += 1
+                elif upper == syntax.end:
+                    pieces.append(token)
+                    has_content = True
+                    qualifier = syntax.end_qualifier.match(line, position)
+                    if qualifier:
+                        pieces.append(qualifier.group())
+                        position = qualifier.end()
+                        if qualifier.group(1).upper() != syntax.case:
+                            continue
+                    if depth > 0:
+                        depth -= 1
+                else:
+                    pieces.append(token)
+
+        if state is not None:
+            raise IncompleteStatementError(
+                "Unterminated {} at end of input".format(
+                    'comment' if state == syntax.block_comment else
+                    'quoted string ' + syntax.text(state)))
+
+        if has_content:
+            yield syntax.empty.join(pieces).strip()
+
+
+def split_statements(lines, delimiter=DEFAULT_DELIMITER, binary=False):
+    return StatementSplitter(delimiter, binary=binary).split(lines)
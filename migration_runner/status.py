@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_STATUS_TTL = 5.0
+
+SchemaStatus = namedtuple('SchemaStatus', [
+    'target', 'version', 'ledger_hash', 'checked_at', 'cached'
+])
+
+
+def status_target(db_params):
+    host, _, _, name = db_params
+    return "{}/{}".format(host, name)
+
+
+def ledger_hash(entries):
+    """Checksum over the versions and checksums in the appliedMigrations
+    ledger, or None when there is no ledger."""
+    if not entries:
+        return None
+    digest = hashlib.sha256()
+    for version in sorted(entries):
+        digest.update("{} {}\n".format(
+            version, entries[version].checksum).encode('ascii'))
+    return digest.hexdigest()
+
+
+class StatusCache:
+    """Recently read (version, ledger hash) of each database, so that
+    frequent status checks do not each log in to MySQL.
+
+    Entries are held in memory and, given a `path`, in a JSON file shared
+    with other processes, including runners, which invalidate a database's
+    entry whenever they change its version. The file is only parsed again
+    when it has changed. Only one thread at a time reads any one database;
+    others wait for its result.
+    """
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.entries = {}
+        self._file_signature = None
+        self._lock = threading.Lock()
+        self._target_locks = {}
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (getattr(stat, 'st_mtime_ns', stat.st_mtime),
+                         stat.st_size, stat.st_ino)
+        except OSError:
+            signature = None
+        if signature != self._file_signature:
+            self._file_signature = signature
+            self.entries = self._load() if signature else {}
+
+    def _load(self):
+        try:
+            with io.open(self.path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with io.open(temp_path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(json.dumps(entries, sort_keys=True))
+        os.rename(temp_path, self.path)
+
+    def _update_file(self, target, entry):
+        with self._lock:
+            entries = self._load()
+            if entry is None:
+                if target not in entries:
+                    return
+                del entries[target]
+            else:
+                entries[target] = entry
+            self._save(entries)
+
+    def get(self, target, ttl):
+        """Return the cached `SchemaStatus` of `target` if it was read less
+        than `ttl` seconds ago, else None."""
+        if self.path is not None:
+            self._refresh()
+        entry = self.entries.get(target)
+        if entry is None or self.clock() - entry['checked_at'] >= ttl:
+            return None
+        return SchemaStatus(target, entry['version'], entry['ledger_hash'],
+                            entry['checked_at'], True)
+
+    def put(self, target, version, ledger_hash):
+        entry = {'version': version, 'ledger_hash': ledger_hash,
+                 'checked_at': self.clock()}
+        self.entries[target] = entry
+        if self.path is not None:
+            self._update_file(target, entry)
+        return SchemaStatus(target, version, ledger_hash,
+                            entry['checked_at'], False)
+
+    def invalidate(self, target):
+        self.entries.pop(target, None)
+        if self.path is not None:
+            self._update_file(target, None)
+
+    def lookup(self, target, ttl, fetch):
+        """Return the status of `target`, calling `fetch()` for its
+        (version, ledger hash) when there is no fresh entry."""
+        status = self.get(target, ttl)
+        if status is not None:
+            return status
+        with self._lock:
+            target_lock = self._target_locks.setdefault(target,
+                                                        threading.Lock())
+        with target_lock:
+            # Another thread may have read it while this one waited
+            status = self.get(target, ttl)
+            if status is not None:
+                return status
+            version, current_ledger_hash = fetch()
+            return self.put(target, version, current_ledger_hash)
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def shared_status_cache(path=None):
+    """Return the process-wide `StatusCache` for `path`."""
+    if path is not None:
+        path = os.path.abspath(path)
+    with _shared_caches_lock:
+        if path not in _shared_caches:
+            _shared_caches[path] = StatusCache(path)
+        return _shared_caches[path]
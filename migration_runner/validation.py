@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import codecs
+import hashlib
+import io
+import logging
+import multiprocessing
+from collections import namedtuple
+from timeit import default_timer
+
+from migration_runner.chunked import read_chunk_spec
+from migration_runner.data import is_data_migration, read_data_spec
+from migration_runner.errors import MigrationRunnerError
+from migration_runner.mapped import (MMAP_THRESHOLD, map_file,
+                                     mapped_checksum, mapped_lines)
+from migration_runner.statements import split_statements
+
+FileValidation = namedtuple('FileValidation', [
+    'version', 'filename', 'size', 'checksum', 'statements', 'elapsed',
+    'error'
+])
+
+
+class MigrationValidationError(MigrationRunnerError):
+    """Raised for a migration file which failed validation."""
+
+
+class ValidationReport(namedtuple('ValidationReport', [
+    'files', 'elapsed', 'workers'
+])):
+    """The `FileValidation` of each file checked, in version order, and how
+    long checking them all took."""
+
+    __slots__ = ()
+
+    @property
+    def invalid(self):
+        return [validation for validation in self.files
+                if validation.error is not None]
+
+    @property
+    def size(self):
+        return sum(validation.size for validation in self.files)
+
+
+def count_statements(filename, lines):
+    """Count the statements, or rows of a data migration, in the UTF-8
+    encoded `lines`, decoding them incrementally."""
+    lines = codecs.iterdecode(lines, 'utf-8')
+    if is_data_migration(filename):
+        read_data_spec(lines, filename)
+        return sum(1 for line in lines if line.strip())
+
+    read_chunk_spec(filename)
+    return sum(1 for _ in split_statements(lines))
+
+
+def validate_file(task):
+    """Check one migration file: that it can be read and decoded as UTF-8,
+    that its statements split cleanly when `parse` is set, and that its
+    checksum is `expected` when one is given.
+
+    `task` is a (version, filename, expected, parse) tuple, so that this
+    can be mapped over a process pool. Problems are returned in the
+    `error` of the `FileValidation` rather than raised.
+    """
+    version, filename, expected, parse = task
+    start = default_timer()
+    size = 0
+    checksum = None
+    statements = None
+    error = None
+    try:
+        with open(filename, 'rb') as migration_file:
+            mapped = map_file(migration_file, MMAP_THRESHOLD)
+            try:
+                if mapped is None:
+                    buffer = migration_file.read()
+                    checksum = hashlib.sha256(buffer).hexdigest()
+                    lines = io.BytesIO(buffer)
+                else:
+                    buffer = mapped
+                    checksum = mapped_checksum(mapped)
+                    lines = mapped_lines(mapped)
+                size = len(buffer)
+                if parse:
+                    statements = count_statements(filename, lines)
+            finally:
+                if mapped is not None:
+                    mapped.close()
+        if expected is not None and checksum != expected:
+            error = ("checksum {current} does not match {expected} recorded "
+                     "in the appliedMigrations ledger; the file has been "
+                     "edited since it was applied".format(
+                         current=checksum[:12], expected=expected[:12]))
+    except (IOError, OSError, UnicodeDecodeError,
+            MigrationRunnerError) as exception:
+        error = "{}: {}".format(type(exception).__name__, exception)
+    return FileValidation(version, filename, size, checksum, statements,
+                          default_timer() - start, error)
+
+
+class MigrationValidator:
+    """Validate migration files before any is applied.
+
+    Files are checked concurrently in a pool of `workers` processes, since
+    decoding and splitting statements is CPU bound, and large files are
+    memory-mapped and decoded a line at a time rather than copied into each
+    worker. Pending files are fully parsed; files already applied are only
+    hashed and compared with their checksums in the appliedMigrations
+    ledger. Checking stops at the first invalid file unless `fail_fast` is
+    unset.
+    """
+
+    def __init__(self, workers=None, logger=None, fail_fast=True):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.workers = workers or multiprocessing.cpu_count()
+        self.fail_fast = fail_fast
+        self.slowest_limit = 5
+
+    def validations(self, tasks):
+        if self.workers == 1 or len(tasks) < 2:
+            for task in tasks:
+                yield validate_file(task)
+            return
+
+        workers = min(self.workers, len(tasks))
+        pool = multiprocessing.Pool(workers)
+        try:
+            for validation in pool.imap_unordered(
+                    validate_file, tasks,
+                    max(1, len(tasks) // (workers * 4))):
+                yield validation
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def validate(self, pending, applied=(), checksums=None):
+        """Validate the (version, path) tuples in `pending` and, against
+        the `checksums` dict of version to ledger checksum, those in
+        `applied`. Returns a `ValidationReport`."""
+        checksums = checksums or {}
+        tasks = [(version, path, None, True) for version, path in pending]
+        tasks.extend((version, path, checksums.get(version), False)
+                     for version, path in applied)
+
+        start = default_timer()
+        files = []
+        validations = self.validations(tasks)
+        try:
+            for validation in validations:
+                files.append(validation)
+                self.logger.debug(
+                    "Validated file: '{file}' in {elapsed:.3f}s".format(
+                        file=validation.filename,
+                        elapsed=validation.elapsed))
+                if validation.error is not None and self.fail_fast:
+                    break
+        finally:
+            validations.close()
+
+        files.sort(key=lambda validation: validation.version)
+        report = ValidationReport(files, default_timer() - start,
+                                  min(self.workers, max(1, len(tasks))))
+        self.log_report(report, len(tasks))
+        return report
+
+    def log_report(self, report, total):
+        for validation in report.invalid:
+            self.logger.error(
+                "Migration file: '{file}' failed validation: {error}".format(
+                    file=validation.filename, error=validation.error))
+        self.logger.info(
+            "Validated {count} of {total} migration files ({size} bytes) in "
+            "{elapsed:.3f}s with {workers} workers".format(
+                count=len(report.files), total=total, size=report.size,
+                elapsed=report.elapsed, workers=report.workers))
+
+        slowest = sorted(report.files, key=lambda validation:
+                         validation.elapsed, reverse=True)[:self.slowest_limit]
+        if slowest:
+            self.logger.info(
+                "Slowest {} files validated:".format(len(slowest)))
+        for validation in slowest:
+            self.logger.info(
+                "  {elapsed:.3f}s validating file: '{file}'".format(
+                    elapsed=validation.elapsed, file=validation.filename))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+from timeit import default_timer
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from migration_runner.errors import MigrationRunnerError
+
+DEFAULT_DEBOUNCE = 0.5
+
+# How often an idle watcher checks whether it has been stopped
+STOP_POLL_INTERVAL = 1.0
+
+
+class WatchUnavailableError(MigrationRunnerError):
+    """Raised when the optional `watchdog` package is not installed."""
+
+
+class MigrationWatcher:
+    """Apply migrations as they are added to a directory, until stopped.
+
+    Pending migrations are applied on start, then the directory is watched
+    with `watchdog`. Filesystem events are debounced: once an event arrives,
+    more are collected until none has arrived for `debounce` seconds, so a
+    file is only read once its editor has finished writing it. The
+    migrations are kept in a sorted in-memory index, and one database
+    session is kept open for the whole watch, so applying a new file costs
+    neither a directory scan nor a login. A migration which fails is tried
+    again after the next change to the directory.
+    """
+
+    def __init__(self, controller, db_params, sql_directory,
+                 debounce=DEFAULT_DEBOUNCE, logger=None, clock=default_timer):
+        if logger is None:
+            self.logger = logging.getLogger(__name__)
+        else:
+            self.logger = logger
+
+        self.controller = controller
+        self.db_params = db_params
+        self.sql_directory = sql_directory
+        self.debounce = debounce
+        self.clock = clock
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self.session = None
+        self.migrations = None
+        self.known = set()
+        self.db_version = 0
+
+    def notify(self, path):
+        """Record a filesystem event on `path`; safe to call from any
+        thread."""
+        self.events.put((path, self.clock()))
+
+    def stop(self):
+        self.stopped.set()
+
+    def observe(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError as error:
+            raise WatchUnavailableError(
+                "Watching for new migrations requires the watchdog package "
+                "(pip install migration_runner[watch]): {}".format(error))
+
+        watcher = self
+
+        class EventHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    watcher.notify(getattr(event, 'dest_path', None) or
+                                   event.src_path)
+
+        observer = Observer()
+        observer.schedule(EventHandler(), self.sql_directory,
+                          recursive=False)
+        observer.start()
+        return observer
+
+    def start(self):
+        """Open the session and apply any migrations already pending."""
+        controller = self.controller
+        self.session = controller.open_session(self.db_params)
+        self.migrations = controller.helpers.populate_migrations(
+            self.sql_directory)
+        self.known = set(path for _, path in self.migrations)
+
+        db_version = controller.database.fetch_current_version(
+            self.db_params, session=self.session)
+        self.db_version = controller.load_baseline(
+            self.db_params, db_version, self.migrations,
+            controller.find_baselines(self.sql_directory),
+            session=self.session)
+        self.logger.info(
+            "Watching for new migrations in dir: {dir}, database version: "
+            "{version}".format(dir=self.sql_directory,
+                               version=self.db_version))
+        self.apply_pending()
+
+    def wait_for_changes(self):
+        """Block until the directory has changed and then been quiet for
+        `debounce` seconds, returning the paths changed and when the first
+        change was seen, or None once stopped."""
+        paths = set()
+        first_seen = None
+        while not self.stopped.is_set():
+            timeout = self.debounce if paths else STOP_POLL_INTERVAL
+            try:
+                path, seen = self.events.get(timeout=timeout)
+            except queue.Empty:
+                if paths:
+                    return paths, first_seen
+                continue
+            paths.add(path)
+            if first_seen is None:
+                first_seen = seen
+        return None
+
+    def add_migrations(self, paths):
+        added = 0
+        for path in sorted(paths):
+            filename = os.path.basename(path)
+            if path in self.known or not os.path.isfile(path) or \
+                    not self.controller.helpers.is_migration_file(filename):
+                continue
+            try:
+                version = self.controller.helpers.extract_sequence_num(path)
+            except AttributeError:
+                self.logger.warning(
+                    "Ignoring new file with no version number: {}".format(
+                        path))
+                continue
+            self.known.add(path)
+            self.migrations.add(version, path)
+            added += 1
+            if self.controller.ledger is None and \
+                    version <= int(self.db_version):
+                self.logger.warning(
+                    "New migration file: '{file}' is numbered at or below "
+                    "the database version {version}, so will not be applied "
+                    "without --ledger".format(file=path,
+                                              version=self.db_version))
+        return added
+
+    def apply_pending(self):
+        pending = self.controller.pending_migrations(
+            self.db_params, self.db_version, self.migrations,
+            session=self.session, adopt=True)
+        if not len(pending):
+            return 0
+        self.db_version, processed = self.controller.process_migrations(
+            self.db_params, self.db_version, pending, session=self.session)
+        if processed < len(pending):
+            self.logger.error(
+                "{remaining} migrations not applied; they will be tried again "
+                "when the directory next changes".format(
+                    remaining=len(pending) - processed))
+        return processed
+
+    def apply_changes(self, paths, first_seen):
+        added = self.add_migrations(paths)
+        start = self.clock()
+        processed = self.apply_pending()
+        finished = self.clock()
+        self.logger.info(
+            "{changed} files changed, {added} new migrations, {processed} "
+            "applied in {apply:.3f}s, {latency:.3f}s after the first change "
+            "(debounce {debounce:.3f}s)".format(
+                changed=len(paths), added=added, processed=processed,
+                apply=finished - start, latency=finished - first_seen,
+                debounce=self.debounce))
+        return processed
+
+    def run(self):
+        observer = self.observe()
+        try:
+            self.start()
+            while True:
+                changes = self.wait_for_changes()
+                if changes is None:
+                    break
+                self.apply_changes(*changes)
+        finally:
+            observer.stop()
+            observer.join()
+            if self.session is not None:
+                self.session.close()
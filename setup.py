@@ -15,6 +15,13 @@ setup_requirements = ['pytest-runner', 'callable_pip']
 
 test_requirements = ['pytest', 'tox', 'flake8', 'coverage', 'coveralls']
 
+extra_requirements = {
+    'async': ['aiomysql'],
+    'mysqlclient': ['mysqlclient'],
+    'pymysql': ['PyMySQL'],
+    'watch': ['watchdog'],
+}
+
 # read the contents of your README file
 this_directory = path.abspath(path.dirname(__file__))
 with open(path.join(this_directory, 'README.md')) as f:
@@ -43,6 +50,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=long_description,
     long_description_content_type='text/markdown',
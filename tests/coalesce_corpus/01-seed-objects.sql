@@ -0,0 +1,21 @@
+-- Single-row seed data in the style of 046.create_seed_items.sql, with
+-- values containing delimiters, parentheses and doubled quotes
+CREATE TABLE object (
+  id INTEGER PRIMARY KEY,
+  name VARCHAR(64) NOT NULL,
+  type VARCHAR(64),
+  description TEXT
+);
+
+INSERT INTO object (name, type, description) VALUES ('Chair', 'furniture', 'Somewhere to rest; without difficulty');
+INSERT INTO object (name, type, description) VALUES ('Table', 'furniture', 'Platform (for dining)');
+INSERT INTO object (name, type, description) VALUES ('Knife', 'utensils', 'Used to cut things, especially food');
+INSERT INTO object (name, type, description) VALUES ('Fork', 'utensils', 'It''s for eating');
+INSERT INTO object (name, type, description) VALUES ('Bed', 'furniture', NULL);
+INSERT INTO object (name, type, description)
+VALUES ('Lamp', 'lighting', 'Spans
+two lines');
+INSERT INTO object (name, type, description) VALUES ('Rug', 'furnishing', '),(');
+INSERT INTO object (name, type, description) VALUES ('Shelf', 'furniture', 'VALUES (1)');
+insert into object (name, type, description) values ('Mug', 'kitchen', 'lower case');
+INSERT INTO object (name, type, description) VALUES ('Spoon', 'utensils', '');
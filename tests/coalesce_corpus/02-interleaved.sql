@@ -0,0 +1,19 @@
+-- Runs broken up by other statements, other tables and other column lists
+CREATE TABLE room (id INTEGER PRIMARY KEY, name VARCHAR(64), floor INT);
+CREATE TABLE item (id INTEGER PRIMARY KEY, room_id INT, name VARCHAR(64));
+
+INSERT INTO room (name, floor) VALUES ('Kitchen', 0);
+INSERT INTO room (name, floor) VALUES ('Lounge', 0);
+INSERT INTO room (floor, name) VALUES (1, 'Bedroom');
+INSERT INTO room (floor, name) VALUES (1, 'Bathroom');
+UPDATE room SET floor = floor + 1 WHERE floor = 1;
+INSERT INTO room (name, floor) VALUES ('Attic', 3);
+INSERT INTO item (room_id, name) VALUES (1, 'Oven');
+INSERT INTO room (name, floor) VALUES ('Cellar', -1);
+INSERT INTO item (room_id, name) VALUES (1, 'Sink');
+INSERT INTO item (room_id, name) VALUES (2, 'Sofa');
+INSERT INTO item (room_id, name) VALUES (3, 'Bed');
+DELETE FROM item WHERE name = 'Sink';
+INSERT INTO item (room_id, name) VALUES (4, 'Bath');
+INSERT INTO item VALUES (100, 5, 'Trunk');
+INSERT INTO item VALUES (101, 5, 'Boxes');
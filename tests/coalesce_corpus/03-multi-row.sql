@@ -0,0 +1,8 @@
+-- Existing multi-row INSERTs merge with their single-row neighbours
+CREATE TABLE customer (id INTEGER PRIMARY KEY, name VARCHAR(64), credit DECIMAL(10, 2));
+
+INSERT INTO customer (name, credit) VALUES ('Ada', 10.50), ('Brian', 0);
+INSERT INTO customer (name, credit) VALUES ('Cleo', -2.25);
+INSERT INTO customer (name, credit) VALUES ('Dev', 1 + 2 * 3), ('Ezra', 1e3);
+INSERT INTO customer (name, credit) VALUES (UPPER('fay'), ABS(-7));
+INSERT INTO customer (name, credit) VALUES ( 'Gus' , NULL );
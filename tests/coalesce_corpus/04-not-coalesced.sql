@@ -0,0 +1,12 @@
+-- Statements which must be left exactly as written
+CREATE TABLE counter (id INTEGER PRIMARY KEY, seen INT, note VARCHAR(64));
+CREATE TABLE archive (id INTEGER PRIMARY KEY, seen INT);
+
+INSERT INTO counter (seen, note) VALUES ((SELECT COUNT(*) FROM counter), 'first');
+INSERT INTO counter (seen, note) VALUES ((SELECT COUNT(*) FROM counter), 'second');
+INSERT INTO counter (seen, note) VALUES ((SELECT COUNT(*) FROM counter), 'third');
+INSERT INTO counter (seen, note) VALUES (7, 'plain'); -- trailing comment
+INSERT INTO counter (seen, note) VALUES (8, /* inline */ 'commented');
+INSERT INTO counter (seen, note) VALUES (9, 'plain again');
+INSERT INTO archive (seen) SELECT seen FROM counter WHERE seen < 5;
+INSERT INTO archive (seen) SELECT seen FROM counter WHERE seen >= 5;
@@ -1,8 +1,14 @@
 import logging
+import sys
+
+import mysql.connector
 import pytest
 
 from migration_runner import Helpers, DatabaseTools, Controller
 
+# The asyncio engine uses async/await syntax, which Python 2 cannot parse
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 5) else []
+
 
 @pytest.fixture
 def logger():
@@ -122,3 +128,79 @@ def db_params_tup():
         "db_password",
         "db_name"
     )
+
+
+class FakeCursor(object):
+    """A cursor over the database in `state`: keeps `versionTable` in
+    `state['version']` and `appliedMigrations` in `state['ledger']` (None
+    until it is created), records every other statement executed in
+    `state['executed']` and fails those containing `state['fail_on']`."""
+
+    def __init__(self, state):
+        self.state = state
+        self.with_rows = False
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, statement, params=()):
+        self._rows = []
+        self.rowcount = 0
+        ledger = self.state['ledger']
+        if statement.startswith('SELECT version FROM versionTable'):
+            self._rows = [(self.state['version'],)]
+        elif statement.startswith('UPDATE versionTable'):
+            self.state['version'] = params[0]
+        elif 'appliedMigrations' not in statement:
+            if self.state['fail_on'] and self.state['fail_on'] in statement:
+                raise mysql.connector.Error("Syntax error")
+            self.rowcount = 1
+            self.state['executed'].append(statement)
+        elif statement.startswith('CREATE'):
+            if ledger is None:
+                self.state['ledger'] = {}
+        elif ledger is None:
+            raise mysql.connector.Error(
+                "Table 'db.appliedMigrations' doesn't exist", errno=1146)
+        elif statement.startswith('SELECT'):
+            self._rows = [row + (None,) for row in ledger.values()]
+        elif statement.startswith('REPLACE'):
+            ledger[params[0]] = tuple(params)
+
+    def executemany(self, statement, seq_params):
+        for params in seq_params:
+            self.execute(statement, params)
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchwarnings(self):
+        return None
+
+
+@pytest.fixture
+def state():
+    return {'version': 0, 'ledger': None, 'executed': [], 'fail_on': None}
+
+
+@pytest.fixture
+def connect(mocker, state):
+    connect = mocker.patch('mysql.connector.connect')
+    connect.return_value.cursor.side_effect = lambda *args, **kwargs: \
+        FakeCursor(state)
+    return connect
+
+
+@pytest.fixture
+def migration_versions():
+    return (1, 2)
+
+
+@pytest.fixture
+def migrations_dir(tmpdir, migration_versions):
+    for version in migration_versions:
+        tmpdir.join("{:03d}.create.sql".format(version)).write(
+            "CREATE TABLE t{} (id INT);\n".format(version))
+    return tmpdir
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest
+
+from migration_runner import aio
+from migration_runner.aio import AsyncController, AsyncDatabaseTools
+
+
+class StubError(Exception):
+    pass
+
+
+class StubServer(object):
+    """In-memory stand-in for a MySQL server speaking the aiomysql API."""
+
+    def __init__(self, version=0, fail_on=None, delay=0):
+        self.version = version
+        self.fail_on = fail_on
+        self.delay = delay
+        self.executed = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.open_connections = 0
+        self.peak_connections = 0
+
+    async def connect(self, **kwargs):
+        self.open_connections += 1
+        self.peak_connections = max(self.peak_connections,
+                                    self.open_connections)
+        await asyncio.sleep(self.delay)
+        return StubConnection(self)
+
+
+class StubConnection(object):
+    def __init__(self, server):
+        self.server = server
+
+    async def cursor(self):
+        return StubCursor(self.server)
+
+    async def begin(self):
+        pass
+
+    async def commit(self):
+        self.server.commits += 1
+
+    async def rollback(self):
+        self.server.rollbacks += 1
+
+    def close(self):
+        self.server.open_connections -= 1
+
+
+class StubCursor(object):
+    def __init__(self, server):
+        self.server = server
+        self.description = None
+        self.rowcount = 0
+
+    async def execute(self, statement, params=None):
+        await asyncio.sleep(0)
+        if self.server.fail_on and self.server.fail_on in statement:
+            raise StubError("1064 (42000): You have an error in your SQL")
+        self.server.executed.append((statement, params))
+        if statement.startswith("UPDATE versionTable"):
+            self.server.version = params[0]
+        self.description = (('version',),) if "SELECT" in statement \
+            else None
+        self.rowcount = 1
+
+    async def executemany(self, statement, rows):
+        await asyncio.sleep(0)
+        self.server.executed.append((statement, rows))
+        self.rowcount = len(rows)
+
+    async def fetchone(self):
+        return (self.server.version,)
+
+    async def fetchall(self):
+        return [(self.server.version,)]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def migrations_dir(tmpdir):
+    tmpdir.join("001.create.sql").write("CREATE TABLE a (x INT);")
+    tmpdir.join("002.seed.sql").write(
+        "INSERT INTO a VALUES (1);\nINSERT INTO a VALUES (2);")
+    tmpdir.join("003.alter.sql").write("ALTER TABLE a ADD y INT;")
+    return str(tmpdir)
+
+
+def async_controller(server):
+    database = AsyncDatabaseTools(connect=server.connect,
+                                  error_class=StubError)
+    return AsyncController(database=database)
+
+
+class TestAsyncDatabaseTools(object):
+    """Tests for AsyncDatabaseTools class in `migration_runner` package."""
+
+    def test_apply_migration_reads_off_the_loop(self, tmpdir, mocker,
+                                                monkeypatch):
+        monkeypatch.setattr(aio, 'READ_AHEAD', 10)
+        path = tmpdir.join("004.seed.sql")
+        path.write("INSERT INTO a VALUES (1);\n" * 25)
+        server = StubServer()
+        threads = []
+
+        def spy(function):
+            def in_thread(*args):
+                threads.append(threading.current_thread())
+                return function(*args)
+            return in_thread
+        mocker.patch.object(aio, 'open_migration', spy(aio.open_migration))
+        read_ahead = mocker.patch.object(aio, 'read_ahead',
+                                         side_effect=spy(aio.read_ahead))
+
+        async def apply():
+            connection = await server.connect()
+            return await AsyncDatabaseTools(
+                connect=server.connect, error_class=StubError).apply_migration(
+                    connection, str(path))
+
+        result = run(apply())
+
+        assert result.statements == 25
+        assert read_ahead.call_count == 4
+        assert len(threads) == 5
+        assert threading.current_thread() not in threads
+
+    def test_apply_data_migration(self, tmpdir):
+        server = StubServer()
+        tmpdir.join("004.seed.csv").write_binary(
+            b'# table: a\r\nx,note\r\n1,"two\r\nlines"\r\n2,one\r\n')
+
+        async def apply():
+            connection = await server.connect()
+            return await AsyncDatabaseTools(
+                connect=server.connect, error_class=StubError).apply_migration(
+                    connection, str(tmpdir.join("004.seed.csv")), version=4)
+
+        result = run(apply())
+
+        assert result.statements == 1
+        assert server.executed[0][1] == [("1", "two\r\nlines"),
+                                         ("2", "one")]
+        assert server.version == 4
+
+
+class TestAsyncController(object):
+    """Tests for AsyncController class in `migration_runner` package."""
+
+    def test_process_migrations_in_directory(self, migrations_dir,
+                                             db_params_tup):
+        server = StubServer(version=1)
+
+        result = run(async_controller(server).process_migrations_in_directory(
+            db_params_tup, migrations_dir))
+
+        assert result == (3, 2, 0)
+        assert server.version == 3
+        assert server.commits == 2
+        assert server.open_connections == 0
+        assert [s for s, _ in server.executed] == [
+            "SELECT version FROM versionTable LIMIT 1",
+            "INSERT INTO a VALUES (1)",
+            "INSERT INTO a VALUES (2)",
+            "UPDATE versionTable SET version = %s",
+            "ALTER TABLE a ADD y INT",
+            "UPDATE versionTable SET version = %s",
+        ]
+
+    def test_process_migrations_stops_on_error(self, migrations_dir,
+                                               db_params_tup):
+        server = StubServer(version=0, fail_on="INSERT")
+
+        result = run(async_controller(server).process_migrations_in_directory(
+            db_params_tup, migrations_dir))
+
+        assert result == (1, 1, 2)
+        assert server.version == 1
+
+    @pytest.mark.parametrize('content', [
+        b"INSERT INTO a VALUES ('unterminated);\n",
+        b"INSERT INTO a VALUES ('caf\xe9');\n",
+    ])
+    def test_process_migrations_unreadable_file(self, migrations_dir,
+                                                db_params_tup, tmpdir,
+                                                content):
+        tmpdir.join("002.seed.sql").write_binary(content)
+        server = StubServer(version=1)
+
+        result = run(async_controller(server).process_migrations_in_directory(
+            db_params_tup, migrations_dir))
+
+        assert result == (1, 0, 2)
+        assert server.version == 1
+        assert server.rollbacks == 1
+        assert server.open_connections == 0
+
+    def test_process_targets_bounded_concurrency(self, migrations_dir):
+        server = StubServer(version=3, delay=0.001)
+        targets = [("host", "user", "pass", "db_{}".format(n))
+                   for n in range(50)]
+
+        results = run(async_controller(server).process_targets(
+            targets, migrations_dir, concurrency=10))
+
+        assert len(results) == 50
+        assert not any(r.error for r in results)
+        assert server.peak_connections <= 10
+        assert server.open_connections == 0
+
+    def test_process_targets_reports_connection_failure(self, migrations_dir):
+        server = StubServer()
+
+        async def refuse(**kwargs):
+            raise StubError("2003: Can't connect to MySQL server")
+
+        controller = async_controller(server)
+        controller.database._connect = refuse
+
+        results = run(controller.process_targets(
+            [("host", "user", "pass", "db")], migrations_dir))
+
+        assert results[0].error == "StubError"
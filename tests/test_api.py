@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import mysql.connector
+import pytest
+
+import migration_runner
+from migration_runner.api import MigrationRunner, RunResult
+from migration_runner.database_tools import DatabaseTools
+from migration_runner.errors import (DatabaseConnectionError,
+                                     InvalidMigrationFilenameError,
+                                     MigrationRunnerError)
+from migration_runner.results import APPLIED, FAILED, SKIPPED
+from migration_runner.statements import IncompleteStatementError
+
+
+@pytest.fixture
+def state(state):
+    state.update(version=1)
+    return state
+
+
+@pytest.fixture
+def migration_versions():
+    return (1, 2, 3, 4)
+
+
+@pytest.fixture(autouse=True)
+def shared_caches(monkeypatch):
+    monkeypatch.setattr('migration_runner.status._shared_caches', {})
+
+
+class TestMigrationRunner(object):
+    """Tests for MigrationRunner class in `migration_runner` package."""
+
+    def test_run_returns_outcomes(self, connect, state, migrations_dir,
+                                  db_params_tup):
+        result = MigrationRunner().run(db_params_tup, str(migrations_dir))
+
+        assert isinstance(result, RunResult)
+        assert result.target == 'db_host/db_name'
+        assert result.db_version == 4
+        assert result.succeeded
+        assert [(o.version, o.status) for o in result.migrations] == [
+            (2, APPLIED), (3, APPLIED), (4, APPLIED)]
+        assert result.migrations[0].filename == str(
+            migrations_dir.join('002.create.sql'))
+        assert result.migrations[0].statements == 1
+
+    def test_run_reports_failure(self, connect, state, migrations_dir,
+                                 db_params_tup):
+        state['fail_on'] = 't3'
+
+        result = MigrationRunner().run(db_params_tup, str(migrations_dir))
+
+        assert not result.succeeded
+        assert result.db_version == 2
+        assert [o.version for o in result.applied] == [2]
+        assert [o.version for o in result.failed] == [3]
+        assert [o.version for o in result.skipped] == [4]
+        assert isinstance(result.failed[0].error, mysql.connector.Error)
+        assert result.skipped[0].status == SKIPPED
+        assert result.failed[0].status == FAILED
+
+    @pytest.mark.parametrize('inline_version_update', [False, True])
+    def test_run_records_unterminated_statement(
+            self, connect, state, migrations_dir, db_params_tup,
+            inline_version_update):
+        migrations_dir.join('003.create.sql').write(
+            "INSERT INTO t VALUES ('unterminated);\n")
+
+        result = MigrationRunner(
+            inline_version_update=inline_version_update).run(
+                db_params_tup, str(migrations_dir))
+
+        assert [(o.version, o.status) for o in result.migrations] == [
+            (2, APPLIED), (3, FAILED), (4, SKIPPED)]
+        assert isinstance(result.failed[0].error, IncompleteStatementError)
+        assert result.db_version == 2
+        assert connect.return_value.rollback.call_count == int(
+            inline_version_update)
+
+    def test_connection_error_raised(self, mocker, migrations_dir,
+                                     db_params_tup):
+        mocker.patch('mysql.connector.connect',
+                     side_effect=mysql.connector.Error("refused"))
+
+        with pytest.raises(DatabaseConnectionError) as excinfo:
+            MigrationRunner().run(db_params_tup, str(migrations_dir))
+
+        assert isinstance(excinfo.value, MigrationRunnerError)
+        assert isinstance(excinfo.value.cause, mysql.connector.Error)
+
+    def test_invalid_filename_raised(self, connect, migrations_dir,
+                                     db_params_tup):
+        migrations_dir.join('create.sql').write("CREATE TABLE x (id INT);\n")
+
+        with pytest.raises(InvalidMigrationFilenameError):
+            MigrationRunner().run(db_params_tup, str(migrations_dir))
+
+    def test_migrations_cached_until_directory_changes(
+            self, connect, state, migrations_dir, db_params_tup, mocker):
+        runner = MigrationRunner()
+        find = mocker.spy(migration_runner.Helpers, 'find_migrations')
+
+        runner.run(db_params_tup, str(migrations_dir))
+        runner.run(db_params_tup, str(migrations_dir))
+        assert find.call_count == 1
+
+        migrations_dir.join('005.create.sql').write(
+            "CREATE TABLE t5 (id INT);\n")
+        os.utime(str(migrations_dir), (0, 0))
+        result = runner.run(db_params_tup, str(migrations_dir))
+
+        assert find.call_count == 2
+        assert [o.version for o in result.applied] == [5]
+
+    def test_migrations_cache_sees_nanosecond_changes(
+            self, connect, state, migrations_dir, db_params_tup, mocker):
+        runner = MigrationRunner()
+        find = mocker.spy(migration_runner.Helpers, 'find_migrations')
+        second = 1500000000 * 10 ** 9
+        os.utime(str(migrations_dir), ns=(second, second))
+        runner.run(db_params_tup, str(migrations_dir))
+
+        migrations_dir.join('005.create.sql').write(
+            "CREATE TABLE t5 (id INT);\n")
+        os.utime(str(migrations_dir), ns=(second, second + 1))
+        result = runner.run(db_params_tup, str(migrations_dir))
+
+        assert find.call_count == 2
+        assert [o.version for o in result.applied] == [5]
+
+    def test_migrations_cache_sees_replaced_directory(
+            self, connect, state, migrations_dir, db_params_tup, mocker,
+            tmpdir_factory):
+        runner = MigrationRunner()
+        find = mocker.spy(migration_runner.Helpers, 'find_migrations')
+        directory = str(migrations_dir)
+        mtime = os.stat(directory).st_mtime_ns
+        runner.run(db_params_tup, directory)
+
+        migrations_dir.move(tmpdir_factory.mktemp('old').join('sql'))
+        os.mkdir(directory)
+        for version in (1, 2, 3, 4, 5):
+            with open(os.path.join(directory, "{:03d}.create.sql".format(
+                    version)), 'w') as migration:
+                migration.write("CREATE TABLE t{} (id INT);\n".format(
+                    version))
+        os.utime(directory, ns=(mtime, mtime))
+        result = runner.run(db_params_tup, directory)
+
+        assert find.call_count == 2
+        assert [o.version for o in result.applied] == [5]
+
+    def test_run_records_runner_error(self, connect, state, migrations_dir,
+                                      db_params_tup, mocker):
+        apply_migration = DatabaseTools.apply_migration
+
+        def lose_connection(database, db_params, sql_filename, **kwargs):
+            if sql_filename.endswith('003.create.sql'):
+                raise DatabaseConnectionError("Lost connection to database")
+            return apply_migration(database, db_params, sql_filename,
+                                   **kwargs)
+        mocker.patch.object(DatabaseTools, 'apply_migration',
+                            lose_connection)
+
+        result = MigrationRunner().run(db_params_tup, str(migrations_dir))
+
+        assert [(o.version, o.status) for o in result.migrations] == [
+            (2, APPLIED), (3, FAILED), (4, SKIPPED)]
+        assert isinstance(result.failed[0].error, DatabaseConnectionError)
+        assert result.db_version == 2
+
+    def test_concurrent_runs(self, connect, state, migrations_dir,
+                             db_params_tup):
+        runner = MigrationRunner()
+        results = []
+
+        def run():
+            results.append(runner.run(db_params_tup, str(migrations_dir)))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 4
+        assert all(not result.failed for result in results)
+        assert state['version'] == 4
+
+    def test_plan_applies_nothing(self, connect, state, migrations_dir,
+                                  db_params_tup):
+        plan = MigrationRunner().plan(db_params_tup, str(migrations_dir))
+
+        assert [entry.version for entry in plan.pending] == [2, 3, 4]
+        assert state['executed'] == []
+
+    def test_lazy_exports(self):
+        assert migration_runner.MigrationRunner is MigrationRunner
+        assert migration_runner.MigrationRunnerError is MigrationRunnerError
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import types
+
+import mysql.connector
+import pytest
+from mock import MagicMock
+
+from migration_runner.backends import (BackendUnavailableError,
+                                       MySQLConnectorBackend, get_backend)
+from migration_runner.controller import Controller
+
+
+class FakeError(Exception):
+    pass
+
+
+def fake_driver(name):
+    module = types.ModuleType(name)
+    module.Error = FakeError
+    module.connect = MagicMock()
+    return module
+
+
+@pytest.fixture
+def mysqldb(mocker):
+    module = fake_driver('MySQLdb')
+    mocker.patch.dict('sys.modules', {'MySQLdb': module})
+    return module
+
+
+@pytest.fixture
+def pymysql(mocker):
+    module = fake_driver('pymysql')
+    mocker.patch.dict('sys.modules', {'pymysql': module})
+    return module
+
+
+class TestBackends(object):
+    """Tests for the database backends in `migration_runner` package."""
+
+    def test_default_backend(self):
+        backend = get_backend()
+
+        assert isinstance(backend, MySQLConnectorBackend)
+        assert backend.Error is mysql.connector.Error
+
+    def test_backend_instance_passed_through(self):
+        backend = MySQLConnectorBackend()
+
+        assert get_backend(backend) is backend
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            get_backend('oracle')
+
+    def test_missing_driver(self, mocker):
+        mocker.patch.dict('sys.modules', {'MySQLdb': None})
+
+        with pytest.raises(BackendUnavailableError):
+            get_backend('mysqlclient').load()
+
+    def test_c_extension_required(self, mocker):
+        mocker.patch.object(mysql.connector, 'HAVE_CEXT', False)
+
+        with pytest.raises(BackendUnavailableError):
+            get_backend('mysql-connector-c').load()
+
+    def test_c_extension_connect(self, mocker, db_params_dict):
+        mocker.patch.object(mysql.connector, 'HAVE_CEXT', True)
+        mocker.patch('mysql.connector.connect')
+
+        connection = get_backend('mysql-connector-c').connect(
+            **db_params_dict)
+
+        mysql.connector.connect.assert_called_with(use_pure=False,
+                                                   **db_params_dict)
+        assert connection.autocommit is True
+        assert connection.get_warnings is True
+
+    def test_mysqldb_connect(self, mysqldb, db_params_dict):
+        connection = get_backend('mysqlclient').connect(**db_params_dict)
+
+        mysqldb.connect.assert_called_with(
+            user='db_user', passwd='db_password', host='db_host',
+            db='db_name', charset='utf8mb4', local_infile=0)
+        connection.autocommit.assert_called_with(True)
+
+    def test_pymysql_connect(self, pymysql, db_params_dict):
+        get_backend('pymysql').connect(**db_params_dict)
+
+        pymysql.connect.assert_called_with(charset='utf8mb4',
+                                           autocommit=True,
+                                           local_infile=False,
+                                           **db_params_dict)
+
+    def test_error_codes(self):
+        assert get_backend('mysql-connector').error_code(
+            mysql.connector.errors.OperationalError(errno=2013)) == 2013
+        assert get_backend('pymysql').error_code(
+            FakeError(2006, "MySQL server has gone away")) == 2006
+        assert get_backend('pymysql').error_code(FakeError("text")) is None
+
+    def test_dbapi_has_rows(self):
+        cursor = MagicMock(description=None)
+
+        assert not get_backend('mysqlclient').has_rows(cursor)
+        cursor.description = (('version', 3),)
+        assert get_backend('mysqlclient').has_rows(cursor)
+
+    def test_controller_stops_on_backend_error(self, pymysql, tmpdir,
+                                               db_params_tup):
+        migration = tmpdir.join('001.fail.sql')
+        migration.write("SELECT 1;")
+        cursor = pymysql.connect.return_value.cursor.return_value
+        cursor.execute.side_effect = FakeError(1064, "syntax error")
+
+        controller = Controller(backend='pymysql')
+        db_version, processed = controller.process_migrations(
+            db_params_tup, 0, [(1, str(migration))])
+
+        assert (db_version, processed) == (0, 0)
+        assert controller.metrics.counters['migrations_failed'] == 1
+
+    def test_session_reconnects_on_lost_connection(self, pymysql,
+                                                   db_params_tup):
+        controller = Controller(backend='pymysql')
+
+        with controller.open_session(db_params_tup) as session:
+            session.connection()
+            session.handle_error(FakeError(2013, "Lost connection"))
+            session.connection()
+
+        assert session.handshakes == 2
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+
+import pytest
+
+from migration_runner import Controller
+from migration_runner.baseline import (Baseline, BaselineError,
+                                       dump_literal, find_baselines,
+                                       migrations_fingerprint, order_views,
+                                       read_baseline, select_baseline)
+
+
+class FakeCursor(object):
+    """Answers the queries made when squashing or loading a baseline from
+    the tables in `state`, recording every other statement executed."""
+
+    def __init__(self, state):
+        self.state = state
+        self.with_rows = False
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, statement, params=()):
+        self._rows = []
+        tables = self.state['tables']
+        if statement.startswith('SELECT version FROM versionTable'):
+            self._rows = [(self.state['version'],)]
+        elif statement.startswith('UPDATE versionTable'):
+            self.state['version'] = params[0]
+        elif statement == 'SHOW FULL TABLES':
+            self._rows = [(name, 'VIEW' if name.startswith('v_') else
+                           'BASE TABLE') for name in tables]
+        elif statement.startswith('SHOW CREATE VIEW'):
+            self._rows = [('v_names', "CREATE ALGORITHM=UNDEFINED "
+                           "DEFINER=`root`@`%` SQL SECURITY DEFINER VIEW "
+                           "`v_names` AS select `room`.`name` from `room`",
+                           'utf8', 'utf8_general_ci')]
+        elif statement.startswith('SHOW CREATE TABLE'):
+            name = statement.split('`')[1]
+            self._rows = [(name, "CREATE TABLE `{}` (...)".format(name))]
+        elif 'information_schema.COLUMNS' in statement:
+            self._rows = [(column,) for column in tables[params[0]][0]]
+        elif statement.startswith('SELECT `'):
+            self._rows = list(tables[statement.rsplit('`', 2)[1]][1])
+        elif statement.startswith('SHOW TRIGGERS'):
+            self._rows = [('room_bi',)]
+        elif statement.startswith('SHOW CREATE TRIGGER'):
+            self._rows = [('room_bi', '', "CREATE DEFINER=`root`@`%` TRIGGER "
+                           "room_bi BEFORE INSERT ON room FOR EACH ROW "
+                           "BEGIN SET NEW.name = TRIM(NEW.name); END")]
+        elif statement.startswith('SHOW'):
+            pass
+        else:
+            self.state['executed'].append(statement)
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchwarnings(self):
+        return None
+
+
+@pytest.fixture
+def state():
+    return {
+        'version': 2,
+        'tables': {
+            'room': (['id', 'name'], [(1, u"Kitchen"), (2, u"O'Hara's")]),
+            'versionTable': (['version'], [(2,)]),
+            'appliedMigrations': (['version'], [(1,), (2,)]),
+            'v_names': None,
+        },
+        'executed': [],
+    }
+
+
+@pytest.fixture
+def connect(mocker, state):
+    connect = mocker.patch('mysql.connector.connect')
+    connect.return_value.cursor.side_effect = lambda *args, **kwargs: \
+        FakeCursor(state)
+    return connect
+
+
+@pytest.fixture
+def migrations_dir(tmpdir):
+    for version in (1, 2, 3):
+        tmpdir.join("{:03d}.create.sql".format(version)).write(
+            "CREATE TABLE t{} (id INT);\n".format(version))
+    return tmpdir
+
+
+def checksum(path):
+    with open(path, 'rb') as migration_file:
+        return hashlib.sha256(migration_file.read()).hexdigest()
+
+
+class TestBaseline(object):
+    """Tests for baselines in `migration_runner` package."""
+
+    def test_migrations_fingerprint_covers_versions_up_to_baseline(self):
+        checksums = {'a': '1', 'b': '2', 'c': '3'}
+        migrations = [(1, 'a'), (2, 'b'), (3, 'c')]
+
+        fingerprint = migrations_fingerprint(migrations, 2, checksums.get)
+
+        assert fingerprint == migrations_fingerprint(
+            migrations[:2], 2, checksums.get)
+        checksums['b'] = '4'
+        assert fingerprint != migrations_fingerprint(
+            migrations, 2, checksums.get)
+
+    def test_find_baselines_newest_first(self, tmpdir):
+        baselines = tmpdir.mkdir('baselines')
+        baselines.join('002.baseline.sql').write(
+            "-- baseline: 2\n-- fingerprint: aa\nSELECT 1;\n")
+        baselines.join('010.baseline.sql').write(
+            "-- baseline: 10\n-- fingerprint: bb\n")
+        baselines.join('notes.txt').write("")
+
+        assert find_baselines(str(tmpdir)) == [
+            Baseline(10, str(baselines.join('010.baseline.sql')), 'bb'),
+            Baseline(2, str(baselines.join('002.baseline.sql')), 'aa'),
+        ]
+        assert find_baselines(str(baselines)) == []
+
+    def test_read_baseline_without_headers(self, tmpdir):
+        filepath = tmpdir.join('002.baseline.sql')
+        filepath.write("-- baseline: 2\nSELECT 1;\n-- fingerprint: aa\n")
+
+        with pytest.raises(BaselineError):
+            read_baseline(str(filepath))
+
+    def test_select_baseline_skips_outdated(self, logger):
+        checksums = {'a': '1', 'b': '2'}
+        migrations = [(1, 'a'), (2, 'b')]
+        current = Baseline(1, 'x', migrations_fingerprint(
+            migrations, 1, checksums.get))
+        outdated = Baseline(2, 'y', 'ff')
+
+        assert select_baseline([outdated, current], migrations,
+                               checksums.get, logger) == current
+        assert select_baseline([outdated], migrations, checksums.get,
+                               logger) is None
+
+    @pytest.mark.parametrize('value,literal', [
+        (datetime.timedelta(days=1, minutes=2, seconds=3),
+         "'24:02:03.000000'"),
+        (set(['b', 'a']), "'a,b'"),
+        (datetime.date(2019, 2, 12), "'2019-02-12'"),
+    ])
+    def test_dump_literal(self, value, literal):
+        assert dump_literal(value) == literal
+
+    def test_order_views(self):
+        views = [('a', "select from `b`"), ('b', "select from `c`"),
+                 ('c', "select from `t`")]
+
+        assert [name for name, _ in order_views(views)] == ['c', 'b', 'a']
+
+    def test_squash_writes_baseline(self, connect, state, migrations_dir,
+                                    db_params_tup):
+        baseline = Controller().squash_migrations(db_params_tup,
+                                                  str(migrations_dir))
+
+        path = migrations_dir.join('baselines', '002.baseline.sql')
+        assert baseline == Baseline(2, str(path), migrations_fingerprint(
+            [(1, str(migrations_dir.join('001.create.sql'))),
+             (2, str(migrations_dir.join('002.create.sql')))], 2, checksum))
+        contents = path.read()
+        assert contents.startswith("-- baseline: 2\n-- fingerprint: ")
+        assert "INSERT INTO `room` (`id`, `name`) VALUES\n(1, 'Kitchen'),\n" \
+               "(2, 'O''Hara''s');\n" in contents
+        assert "INSERT INTO `versionTable` (`version`) VALUES\n(2);\n" \
+            in contents
+        assert "appliedMigrations" not in contents
+        assert "ALGORITHM=UNDEFINED SQL SECURITY DEFINER VIEW `v_names`" \
+            in contents
+        assert "CREATE TRIGGER room_bi" in contents
+        assert "DEFINER=" not in contents
+        assert not migrations_dir.join('baselines').listdir('*.tmp')
+
+    def test_squash_requires_migrated_database(self, connect, state,
+                                               migrations_dir, db_params_tup):
+        state['version'] = 0
+
+        with pytest.raises(BaselineError):
+            Controller().squash_migrations(db_params_tup, str(migrations_dir))
+
+    def test_empty_database_loads_baseline(self, connect, state,
+                                           migrations_dir, db_params_tup):
+        Controller().squash_migrations(db_params_tup, str(migrations_dir))
+        state.update(version=0, tables={}, executed=[])
+
+        result = Controller().process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert result == (3, 1, 0)
+        assert "INSERT INTO `room` (`id`, `name`) VALUES\n(1, 'Kitchen'),\n" \
+               "(2, 'O''Hara''s')" in state['executed']
+        assert "CREATE TABLE t1 (id INT)" not in state['executed']
+        assert state['executed'][-1] == "CREATE TABLE t3 (id INT)"
+
+    def test_nonempty_database_ignores_baseline(self, connect, state,
+                                                migrations_dir,
+                                                db_params_tup):
+        Controller().squash_migrations(db_params_tup, str(migrations_dir))
+        state.update(version=0, executed=[])
+
+        Controller().process_migrations_in_directory(db_params_tup,
+                                                     str(migrations_dir))
+
+        assert state['executed'] == ["CREATE TABLE t{} (id INT)".format(n)
+                                     for n in (1, 2, 3)]
+
+    def test_edited_migration_ignores_baseline(self, connect, state,
+                                               migrations_dir, db_params_tup):
+        Controller().squash_migrations(db_params_tup, str(migrations_dir))
+        state.update(version=0, tables={}, executed=[])
+        migrations_dir.join('001.create.sql').write(
+            "CREATE TABLE t1 (id BIGINT);\n")
+
+        Controller().process_migrations_in_directory(db_params_tup,
+                                                     str(migrations_dir))
+
+        assert state['executed'][0] == "CREATE TABLE t1 (id BIGINT)"
+
+    def test_invalid_migration_prevents_baseline(self, connect, state,
+                                                 migrations_dir,
+                                                 db_params_tup):
+        Controller().squash_migrations(db_params_tup, str(migrations_dir))
+        state.update(version=0, tables={}, executed=[])
+        migrations_dir.join('003.create.sql').write("SELECT 'oops;\n")
+
+        result = Controller(validate=True, validate_workers=1) \
+            .process_migrations_in_directory(db_params_tup,
+                                             str(migrations_dir))
+
+        assert result == (0, 0, 3)
+        assert state['executed'] == []
+
+    def test_no_baseline_option(self, connect, state, migrations_dir,
+                                db_params_tup):
+        Controller().squash_migrations(db_params_tup, str(migrations_dir))
+        state.update(version=0, tables={}, executed=[])
+
+        Controller(baseline=False).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert len(state['executed']) == 3
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+
+import mysql.connector
+import pytest
+
+from migration_runner.checkpoint import CheckpointError
+from migration_runner.database_tools import DatabaseTools
+from migration_runner.results import statement_checksum
+
+
+class FakeCursor(object):
+    """Keeps `migrationCheckpoint` rows in memory, and fails statements
+    containing `fail_on`."""
+
+    def __init__(self, checkpoints, fail_on=None):
+        self.checkpoints = checkpoints
+        self.fail_on = fail_on
+        self.executed = []
+        self.with_rows = False
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, statement, params=()):
+        self._rows = []
+        if 'migrationCheckpoint' in statement:
+            if statement.startswith('SELECT'):
+                row = self.checkpoints.get(params[0])
+                self._rows = [row] if row else []
+            elif statement.startswith('REPLACE'):
+                self.checkpoints[params[0]] = params[1:]
+            elif statement.startswith('DELETE'):
+                self.checkpoints.pop(params[0], None)
+            return
+        if self.fail_on and self.fail_on in statement:
+            raise mysql.connector.Error("Duplicate column name")
+        self.executed.append(statement)
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchwarnings(self):
+        return None
+
+
+@pytest.fixture
+def checkpoints():
+    return {}
+
+
+@pytest.fixture
+def connect(mocker):
+    return mocker.patch('mysql.connector.connect')
+
+
+def run(connect, checkpoints, path, fail_on=None):
+    cursor = FakeCursor(checkpoints, fail_on)
+    connect.return_value.cursor.return_value = cursor
+    DatabaseTools(checkpoint=True).apply_migration(
+        ('db_host', 'db_user', 'db_password', 'db_name'), path)
+    return cursor
+
+
+class TestStatementCheckpoint(object):
+    """Tests for statement checkpoints in `migration_runner` package."""
+
+    def test_resumes_at_failed_statement(self, tmpdir, connect, checkpoints):
+        filepath = tmpdir.join("045.add_columns.sql")
+        filepath.write("ALTER TABLE a ADD x INT;\n"
+                       "ALTER TABLE a ADD y INT;\n"
+                       "ALTER TABLE a ADD z INT;\n")
+
+        with pytest.raises(mysql.connector.Error):
+            run(connect, checkpoints, str(filepath), fail_on='ADD y')
+
+        assert checkpoints[45][0] == 1
+
+        cursor = run(connect, checkpoints, str(filepath))
+
+        assert cursor.executed == ["ALTER TABLE a ADD y INT",
+                                   "ALTER TABLE a ADD z INT"]
+        assert checkpoints == {}
+
+    def test_rejects_changed_statements(self, tmpdir, connect, checkpoints):
+        filepath = tmpdir.join("045.add_columns.sql")
+        filepath.write("ALTER TABLE a ADD x INT;\nALTER TABLE a ADD y INT;\n")
+
+        with pytest.raises(mysql.connector.Error):
+            run(connect, checkpoints, str(filepath), fail_on='ADD y')
+
+        filepath.write("ALTER TABLE a ADD w INT;\nALTER TABLE a ADD y INT;\n")
+
+        with pytest.raises(CheckpointError):
+            run(connect, checkpoints, str(filepath))
+
+    def test_rejects_shortened_file(self, tmpdir, connect, checkpoints):
+        filepath = tmpdir.join("045.add_columns.sql")
+        checkpoints[45] = (3, 'a' * 64)
+        filepath.write("ALTER TABLE a ADD x INT;\n")
+
+        with pytest.raises(CheckpointError):
+            run(connect, checkpoints, str(filepath))
+
+    def test_completed_migration_runs_nothing(self, tmpdir, connect,
+                                              checkpoints):
+        statement = "ALTER TABLE a ADD x INT"
+        filepath = tmpdir.join("045.add_columns.sql")
+        filepath.write(statement + ";\n")
+        checkpoints[45] = (1, hashlib.sha256(
+            statement_checksum(statement).encode('ascii')).hexdigest())
+
+        cursor = run(connect, checkpoints, str(filepath))
+
+        assert cursor.executed == []
+        assert checkpoints == {}
+
+    def test_skips_unnumbered_files(self, tmpdir, connect, checkpoints):
+        filepath = tmpdir.join("hotfix.sql")
+        filepath.write("ALTER TABLE a ADD x INT;\n")
+
+        cursor = run(connect, checkpoints, str(filepath))
+
+        assert cursor.executed == ["ALTER TABLE a ADD x INT"]
+        assert checkpoints == {}
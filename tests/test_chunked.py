@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+
+import mysql.connector
+import pytest
+from mock import MagicMock
+
+from migration_runner.chunked import (ChunkedExecutor, ChunkedMigrationError,
+                                      ChunkSpec, parse_chunked,
+                                      read_chunk_spec, sql_literal)
+from migration_runner.database_tools import DatabaseTools
+
+ASSIGNMENT = re.compile(r'(@\w+) = %s')
+
+
+class FakeCursor(object):
+    """Answers the queries a chunked statement makes about a table whose
+    rows have the primary keys in `keys`."""
+
+    def __init__(self, keys=range(1, 8), progress=None):
+        self.keys = list(keys)
+        self.progress = progress
+        self.statements = []
+        self.variables = {}
+        self.ranges = []
+        self.description = None
+        self.with_rows = False
+        self.rowcount = -1
+        self._rows = []
+
+    def in_range(self, lower, upper):
+        return [key for key in self.keys
+                if (lower is None or key > lower) and
+                (upper is None or key <= upper)]
+
+    def execute(self, statement, params=()):
+        self.statements.append((statement, tuple(params)))
+        self.rowcount = 0
+        self._rows = []
+
+        if statement.startswith('SET @'):
+            self.variables.update(zip(ASSIGNMENT.findall(statement), params))
+        elif 'information_schema.STATISTICS' in statement:
+            self._rows = [('id',)]
+        elif 'TABLE_ROWS' in statement:
+            self._rows = [(len(self.keys),)]
+        elif statement.startswith('SELECT last_key'):
+            self._rows = [self.progress] if self.progress else []
+        elif 'LIMIT 1 OFFSET' in statement:
+            keys = self.in_range(params[0] if len(params) > 1 else None, None)
+            offset = params[-1]
+            self._rows = [(keys[offset],)] if offset < len(keys) else []
+        elif statement.startswith(('UPDATE', 'DELETE FROM `orders`',
+                                   'DELETE FROM orders')):
+            bounds = tuple(self.variables[name]
+                           if name in statement else None
+                           for name in ('@chunk_lower_0', '@chunk_upper_0'))
+            self.ranges.append(bounds)
+            self.rowcount = len(self.in_range(*bounds))
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchwarnings(self):
+        return None
+
+    def writes(self):
+        return [statement for statement, _ in self.statements
+                if statement.startswith(('UPDATE', 'DELETE FROM orders'))]
+
+
+class TestChunkedMigrations(object):
+    """Tests for chunked migrations in `migration_runner` package."""
+
+    def test_read_chunk_spec(self, tmpdir):
+        filepath = tmpdir.join("057.backfill.sql")
+        filepath.write("-- Backfill order totals\n"
+                       "-- chunked: orders\n"
+                       "-- chunk_size: 5000\n"
+                       "\n"
+                       "-- chunk_sleep: 0.25\n"
+                       "UPDATE orders SET total = 1;\n"
+                       "-- max_threads_running: 10\n")
+
+        assert read_chunk_spec(str(filepath)) == ChunkSpec(
+            table='orders', chunk_size=5000, chunk_sleep=0.25,
+            max_threads_running=None)
+
+    def test_read_chunk_spec_absent(self, tmpdir):
+        filepath = tmpdir.join("057.backfill.sql")
+        filepath.write("-- depends: none\nUPDATE orders SET total = 1;\n")
+
+        assert read_chunk_spec(str(filepath)) is None
+
+    @pytest.mark.parametrize('header', [
+        "-- chunked:\n",
+        "-- chunked: orders\n-- chunk_size: 0\n",
+        "-- chunked: orders\n-- chunk_sleep: soon\n",
+    ])
+    def test_read_chunk_spec_invalid(self, tmpdir, header):
+        filepath = tmpdir.join("057.backfill.sql")
+        filepath.write(header + "UPDATE orders SET total = 1;\n")
+
+        with pytest.raises(ChunkedMigrationError):
+            read_chunk_spec(str(filepath))
+
+    @pytest.mark.parametrize('statement,head,condition,qualifier', [
+        ("UPDATE orders SET total = 1", "UPDATE orders SET total = 1", None,
+         "`orders`"),
+        ("-- chunked: orders\nUPDATE LOW_PRIORITY orders o SET a = 1, "
+         "b = 'x WHERE y' WHERE (b = 2) -- why",
+         "UPDATE LOW_PRIORITY orders o SET a = 1, b = 'x WHERE y'",
+         "(b = 2)", "`o`"),
+        ("DELETE FROM `shop`.`orders` WHERE id IN (SELECT id FROM x WHERE y)",
+         "DELETE FROM `shop`.`orders`",
+         "id IN (SELECT id FROM x WHERE y)", "`shop`.`orders`"),
+    ])
+    def test_parse_chunked(self, statement, head, condition, qualifier):
+        chunked = parse_chunked(statement, 'orders')
+
+        assert (chunked.head, chunked.condition, chunked.qualifier) == (
+            head, condition, qualifier)
+
+    @pytest.mark.parametrize('statement', [
+        "INSERT INTO orders VALUES (1)",
+        "UPDATE customers SET n = (SELECT COUNT(*) FROM orders)",
+        "DELETE FROM customers WHERE id NOT IN (SELECT c FROM orders)",
+    ])
+    def test_parse_chunked_other_statements(self, statement):
+        assert parse_chunked(statement, 'orders') is None
+
+    @pytest.mark.parametrize('statement', [
+        "UPDATE customers c JOIN orders o ON o.c = c.id SET c.n = 1",
+        "UPDATE orders SET n = 1 ORDER BY id LIMIT 10",
+        "DELETE orders FROM orders JOIN x ON x.id = orders.id",
+        "DELETE FROM orders USING orders, x",
+    ])
+    def test_parse_chunked_rejects(self, statement):
+        with pytest.raises(ChunkedMigrationError):
+            parse_chunked(statement, 'orders')
+
+    @pytest.mark.parametrize('value,literal', [
+        (None, "NULL"),
+        (42, "42"),
+        (u"O'Brien\\", u"'O''Brien\\\\'"),
+        (b'\x00\xff', "X'00ff'"),
+    ])
+    def test_sql_literal(self, value, literal):
+        assert sql_literal(value) == literal
+
+    def test_run_updates_in_ranges(self, logger):
+        cursor = FakeCursor()
+        spec = ChunkSpec('orders', 3, 0.0, None)
+
+        rows = ChunkedExecutor(logger).run(
+            cursor, '/m/057.backfill.sql', 0,
+            "UPDATE orders SET total = 1 WHERE total IS NULL", spec)
+
+        assert rows == 7
+        assert cursor.writes() == [
+            "UPDATE orders SET total = 1 WHERE (total IS NULL) AND "
+            "(`orders`.`id`) <= (@chunk_upper_0)",
+            "UPDATE orders SET total = 1 WHERE (total IS NULL) AND "
+            "(`orders`.`id`) > (@chunk_lower_0) AND "
+            "(`orders`.`id`) <= (@chunk_upper_0)",
+            "UPDATE orders SET total = 1 WHERE (total IS NULL) AND "
+            "(`orders`.`id`) > (@chunk_lower_0)",
+        ]
+        assert cursor.ranges == [(None, 3), (3, 6), (6, None)]
+        progress = [params for statement, params in cursor.statements
+                    if statement.startswith('REPLACE INTO migrationProgress')]
+        assert [params[2:] for params in progress] == [
+            ('[3]', 3), ('[6]', 6)]
+        assert progress[0][0] == '057.backfill.sql'
+        assert [statement.split(' ', 1)[0] for statement, _
+                in cursor.statements[-4:]] == [
+            'START', 'UPDATE', 'DELETE', 'COMMIT']
+        assert cursor.statements[-2][0].startswith(
+            "DELETE FROM migrationProgress")
+
+    def test_run_commits_progress_with_each_chunk(self, logger):
+        cursor = FakeCursor()
+        spec = ChunkSpec('orders', 3, 0.0, None)
+
+        ChunkedExecutor(logger).run(
+            cursor, '057.backfill.sql', 0, "DELETE FROM orders", spec)
+
+        statements = [statement for statement, _ in cursor.statements]
+        start = statements.index("START TRANSACTION")
+        assert statements[start:start + 4] == [
+            "START TRANSACTION",
+            "DELETE FROM orders WHERE (`orders`.`id`) <= (@chunk_upper_0)",
+            "REPLACE INTO migrationProgress (migration, statement_checksum, "
+            "last_key, rows_affected) VALUES (%s, %s, %s, %s)",
+            "COMMIT",
+        ]
+
+    def test_run_rolls_back_failed_chunk(self, logger):
+        cursor = FakeCursor()
+        execute = cursor.execute
+
+        def fail_second_chunk(statement, params=()):
+            if statement.startswith('DELETE FROM orders') and cursor.ranges:
+                cursor.statements.append((statement, tuple(params)))
+                raise mysql.connector.Error("Lock wait timeout", errno=1205)
+            execute(statement, params)
+
+        cursor.execute = fail_second_chunk
+        spec = ChunkSpec('orders', 3, 0.0, None)
+
+        with pytest.raises(mysql.connector.Error):
+            ChunkedExecutor(logger).run(
+                cursor, '057.backfill.sql', 0, "DELETE FROM orders", spec)
+
+        statements = [statement for statement, _ in cursor.statements]
+        assert statements[-1] == "ROLLBACK"
+        assert [params[2] for statement, params in cursor.statements
+                if statement.startswith('REPLACE')] == ['[3]']
+
+    def test_run_passes_bounds_as_parameters(self, logger):
+        cursor = FakeCursor(progress=(u'["O\'Brien"]', 0))
+        cursor.keys = []
+        spec = ChunkSpec('orders', 3, 0.0, None)
+
+        ChunkedExecutor(logger).run(
+            cursor, '057.backfill.sql', 0, "DELETE FROM orders", spec)
+
+        assert (u"SET @chunk_lower_0 = %s", (u"O'Brien",)) in \
+            cursor.statements
+        assert not any(u"O'Brien" in statement
+                       for statement, _ in cursor.statements)
+
+    def test_run_resumes_from_progress(self, logger):
+        cursor = FakeCursor(progress=('[6]', 6))
+        spec = ChunkSpec('orders', 3, 0.0, None)
+
+        rows = ChunkedExecutor(logger).run(
+            cursor, '057.backfill.sql', 0, "DELETE FROM orders", spec)
+
+        assert rows == 7
+        assert cursor.writes() == [
+            "DELETE FROM orders WHERE (`orders`.`id`) > (@chunk_lower_0)"]
+        assert cursor.ranges == [(6, None)]
+
+    def test_run_sleeps_between_chunks(self, logger):
+        sleep = MagicMock()
+        spec = ChunkSpec('orders', 5, 0.5, None)
+
+        ChunkedExecutor(logger, sleep=sleep).run(
+            FakeCursor(), '057.backfill.sql', 0, "DELETE FROM orders", spec)
+
+        assert sleep.call_count == 2
+
+    def test_run_ignores_other_statements(self, logger):
+        cursor = FakeCursor()
+        spec = ChunkSpec('orders', 5, 0.0, None)
+
+        assert ChunkedExecutor(logger).run(
+            cursor, '057.backfill.sql', 0,
+            "UPDATE customers SET n = 0", spec) is None
+        assert cursor.statements == []
+
+    def test_apply_migration_runs_chunked(self, mocker, tmpdir,
+                                          db_params_tup):
+        mocker.patch('mysql.connector.connect')
+        mock_connection = mysql.connector.connect.return_value
+        cursor = FakeCursor()
+        mock_connection.cursor.return_value = cursor
+        database_tools = DatabaseTools()
+
+        filepath = tmpdir.join("057.backfill.sql")
+        filepath.write("-- chunked: orders\n"
+                       "-- chunk_size: 4\n"
+                       "UPDATE orders SET total = 1;\n"
+                       "UPDATE customers SET n = 0;\n")
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath),
+                                                version=57)
+
+        assert cursor.writes() == [
+            "UPDATE orders SET total = 1 WHERE "
+            "(`orders`.`id`) <= (@chunk_upper_0)",
+            "UPDATE orders SET total = 1 WHERE "
+            "(`orders`.`id`) > (@chunk_lower_0)",
+            "UPDATE customers SET n = 0",
+            "UPDATE versionTable SET version = GREATEST(version, %s)",
+        ]
+        assert result.statements == 2
+        mock_connection.start_transaction.assert_not_called()
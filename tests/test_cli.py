@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
+
 from click.testing import CliRunner
 
 import migration_runner.cli
+from migration_runner.results import MigrationPlan, PlanEntry
 
 
 class TestCLI(object):
@@ -78,3 +81,159 @@ class TestCLI(object):
         ])
 
         assert "CLI execution start" in result.output
+
+    def test_cli_run_command_explicit(self, mocker, db_params_tup,
+                                      db_params_dict):
+        process = mocker.patch(
+            'migration_runner.Controller.process_migrations_in_directory')
+
+        runner = CliRunner()
+        runner.invoke(migration_runner.cli.main, [
+            'run',
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        process.assert_called_with(db_params_tup, 'testdir')
+
+    def test_cli_fanout(self, mocker, tmpdir, db_params_tup, db_params_dict):
+        process = mocker.patch(
+            'migration_runner.fanout.FanOut.process_targets', return_value=[])
+        targets = tmpdir.join('targets.txt')
+        targets.write("{user} {host} {database} {password}\n".format(
+            **db_params_dict))
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            'fanout', '-w', '3', 'testdir', str(targets)
+        ])
+
+        assert result.exit_code == 0
+        process.assert_called_with([db_params_tup], 'testdir')
+
+    def test_cli_fanout_failure_exit_code(self, mocker, tmpdir):
+        failed = mocker.Mock(error="migration failed")
+        mocker.patch('migration_runner.fanout.FanOut.process_targets',
+                     return_value=[failed])
+        targets = tmpdir.join('targets.txt')
+        targets.write("user host db password\n")
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            'fanout', 'testdir', str(targets)
+        ])
+
+        assert result.exit_code == 1
+
+    def test_cli_plan_json(self, mocker, db_params_tup, db_params_dict):
+        plan = mocker.patch('migration_runner.Controller.plan_migrations')
+        plan.return_value = MigrationPlan(
+            db_version=45, total_migrations=46, pending=[
+                PlanEntry(46, 'testdir/046.seed.sql', 120, 'ab' * 32, 5)])
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--plan',
+            '--json',
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        plan.assert_called_with(db_params_tup, 'testdir')
+        assert json.loads(result.output) == {
+            'db_version': 45,
+            'total_migrations': 46,
+            'pending': [{'version': 46, 'filename': 'testdir/046.seed.sql',
+                         'size': 120, 'checksum': 'ab' * 32,
+                         'statements': 5}],
+        }
+
+    def test_cli_plan_text(self, mocker, db_params_dict):
+        plan = mocker.patch('migration_runner.Controller.plan_migrations')
+        plan.return_value = MigrationPlan(
+            db_version=45, total_migrations=46, pending=[
+                PlanEntry(46, 'testdir/046.seed.sql', 120, 'ab' * 32, 5)])
+        process = mocker.patch(
+            'migration_runner.Controller.process_migrations_in_directory')
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--plan',
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        assert not process.called
+        assert "pending migrations: 1 (out of 46 in dir)" in result.output
+        assert "testdir/046.seed.sql" in result.output
+
+    def test_cli_metrics_files(self, mocker, tmpdir, db_params_dict):
+        mocker.patch(
+            'migration_runner.Controller.process_migrations_in_directory')
+        metrics_file = tmpdir.join('migrations.prom')
+        report_file = tmpdir.join('report.json')
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--metrics-file', str(metrics_file),
+            '--report-file', str(report_file),
+            '--profile', 'run',
+            '--profile-dir', str(tmpdir),
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        assert result.exit_code == 0
+        assert metrics_file.read().endswith("# EOF\n")
+        assert 'counters' in json.loads(report_file.read())
+
+    def test_cli_unavailable_driver(self, mocker, db_params_dict):
+        mocker.patch(
+            'migration_runner.Controller.process_migrations_in_directory')
+        mocker.patch.dict('sys.modules', {'MySQLdb': None})
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--driver', 'mysqlclient',
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        assert result.exit_code == 2
+        assert "is not installed" in result.output
+        assert not migration_runner.Controller.\
+            process_migrations_in_directory.called
+
+    def test_cli_parallel_requires_ledger(self, mocker, db_params_dict):
+        mocker.patch(
+            'migration_runner.Controller.process_migrations_in_directory')
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--parallel', '4',
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        assert result.exit_code == 2
+        assert "--parallel requires --ledger" in result.output
+        assert not migration_runner.Controller.\
+            process_migrations_in_directory.called
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import os
+import sqlite3
+
+import pytest
+
+from migration_runner.coalesce import (PACKET_OVERHEAD, InsertCoalescer,
+                                       parse_insert)
+from migration_runner.statements import split_statements
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'coalesce_corpus')
+
+CORPUS = sorted(os.listdir(CORPUS_DIR))
+
+
+def read_corpus(filename):
+    with io.open(os.path.join(CORPUS_DIR, filename)) as sql_file:
+        return list(split_statements(sql_file))
+
+
+def execute(statements):
+    """Run statements against a fresh SQLite database and return the
+    contents of every table it ends up with."""
+    connection = sqlite3.connect(':memory:')
+    for statement in statements:
+        connection.execute(statement)
+    tables = [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+    return dict(
+        (table, connection.execute(
+            "SELECT * FROM {} ORDER BY rowid".format(table)).fetchall())
+        for table in tables
+    )
+
+
+class TestInsertCoalescer(object):
+    """Tests for INSERT coalescing in `migration_runner` package."""
+
+    @pytest.mark.parametrize('filename', CORPUS)
+    @pytest.mark.parametrize('max_packet', [PACKET_OVERHEAD + 200,
+                                            4 * 1024 * 1024])
+    def test_corpus_equivalent(self, filename, max_packet):
+        statements = read_corpus(filename)
+        coalesced = list(InsertCoalescer(max_packet).coalesce(statements))
+
+        assert execute(coalesced) == execute(statements)
+        assert len(coalesced) <= len(statements)
+
+    def test_corpus_merges_runs(self):
+        statements = read_corpus('01-seed-objects.sql')
+        coalesced = list(InsertCoalescer().coalesce(statements))
+
+        # CREATE TABLE, the first eight INSERTs, then the lower case INSERT
+        # which starts a run of its own
+        assert len(coalesced) == 4
+        assert coalesced[1].startswith(
+            "INSERT INTO object (name, type, description) VALUES "
+            "('Chair', 'furniture', 'Somewhere to rest; without difficulty'), "
+            "('Table', ")
+
+    def test_corpus_leaves_unsafe_statements(self):
+        statements = read_corpus('04-not-coalesced.sql')
+
+        assert list(InsertCoalescer().coalesce(statements)) == statements
+
+    def test_packet_limit(self):
+        statements = ["INSERT INTO t (a) VALUES ('{}')".format('x' * 100)
+                      for _ in range(50)]
+        max_packet = PACKET_OVERHEAD + 1000
+        coalesced = list(InsertCoalescer(max_packet).coalesce(statements))
+
+        assert len(coalesced) > 1
+        assert all(len(statement) <= 1000 for statement in coalesced)
+        assert sum(statement.count("('") for statement in coalesced) == 50
+
+    def test_last_insert_id_sees_final_row(self):
+        statements = [
+            "INSERT INTO t (a) VALUES (1)",
+            "INSERT INTO t (a) VALUES (2)",
+            "INSERT INTO t (a) VALUES (3)",
+            "INSERT INTO u (t_id) VALUES (LAST_INSERT_ID())",
+        ]
+
+        assert list(InsertCoalescer().coalesce(statements)) == [
+            "INSERT INTO t (a) VALUES (1), (2)",
+            "INSERT INTO t (a) VALUES (3)",
+            "INSERT INTO u (t_id) VALUES (LAST_INSERT_ID())",
+        ]
+
+    def test_leading_comments_coalesced(self):
+        statements = [
+            "/* note */\n-- leading\nINSERT INTO t (a) VALUES (1)",
+            "-- second\nINSERT INTO t (a) VALUES (2)",
+        ]
+
+        assert list(InsertCoalescer().coalesce(statements)) == [
+            "INSERT INTO t (a) VALUES (1), (2)"]
+
+    def test_mysql_only_inserts_not_coalesced(self):
+        statements = [
+            "INSERT INTO t (a) VALUES (1) ON DUPLICATE KEY UPDATE a = 1",
+            "INSERT INTO t (a) VALUES (2) ON DUPLICATE KEY UPDATE a = 2",
+            "INSERT INTO t SET a = 3",
+            "INSERT INTO t SET a = 4",
+            "INSERT INTO t (a) VALUES (5) AS new ON DUPLICATE KEY UPDATE "
+            "a = new.a",
+            "INSERT INTO t (a) VALUES (6) AS new ON DUPLICATE KEY UPDATE "
+            "a = new.a",
+        ]
+
+        assert list(InsertCoalescer().coalesce(statements)) == statements
+
+    @pytest.mark.parametrize('statement,rows', [
+        ("INSERT INTO t VALUES (1)", ["(1)"]),
+        ("INSERT IGNORE INTO `t` (`a`, `b`) VALUE ('x\\')', \"y\")",
+         ["('x\\')', \"y\")"]),
+        ("INSERT INTO t (a) VALUES (1),(2) , (3)", ["(1)", "(2)", "(3)"]),
+        ("/* note */\n-- leading\n# more\nINSERT INTO t (a) VALUES (1)",
+         ["(1)"]),
+    ])
+    def test_parse_insert(self, statement, rows):
+        assert parse_insert(statement).rows == rows
+
+    @pytest.mark.parametrize('statement', [
+        "INSERT INTO t SELECT * FROM u",
+        "INSERT INTO t SET a = 1",
+        "INSERT INTO t (a) VALUES (1) ON DUPLICATE KEY UPDATE a = 2",
+        "INSERT INTO t (a) VALUES (@a)",
+        "INSERT INTO t (a) VALUES ((SELECT MAX(a) FROM t))",
+        "INSERT INTO t (a) VALUES ('unterminated)",
+        "REPLACE INTO t (a) VALUES (1)",
+        "UPDATE t SET a = 1",
+        "/*!40000 INSERT INTO t (a) VALUES (1) */",
+        "--no space\nINSERT INTO t (a) VALUES (1)",
+    ])
+    def test_parse_insert_rejects(self, statement):
+        assert parse_insert(statement) is None
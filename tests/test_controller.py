@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import mysql.connector
-from mock import call
+from mock import ANY, call
+
+from migration_runner.results import (MigrationResult, PlanEntry,
+                                      StatementResult)
 
 
 class TestController(object):
@@ -40,7 +43,7 @@ class TestController(object):
         controller.update_current_version(db_params_tup, 45)
 
         mock_cursor.execute.assert_has_calls([
-            call("UPDATE versionTable SET version = \'45\'"),
+            call("UPDATE versionTable SET version = %s", (45,)),
             call("SELECT version FROM versionTable LIMIT 1"),
         ])
 
@@ -86,12 +89,16 @@ class TestController(object):
         controller.process_migrations(db_params_tup, 0,
                                       sorted_migrations_tuple_list)
 
-        database_tools.apply_migration.assert_has_calls([
-            call(db_params_tup, '/tmp/001.createtable.sql'),
-            call(db_params_tup, '/tmp/2-createtable.sql'),
-            call(db_params_tup, '/tmp/045.createtable.sql'),
-            call(db_params_tup, '/tmp/60.createtable.sql'),
-        ])
+        assert database_tools.apply_migration.call_args_list == [
+            call(db_params_tup, '/tmp/001.createtable.sql', session=None,
+                 record=None),
+            call(db_params_tup, '/tmp/2-createtable.sql', session=None,
+                 record=None),
+            call(db_params_tup, '/tmp/045.createtable.sql', session=None,
+                 record=None),
+            call(db_params_tup, '/tmp/60.createtable.sql', session=None,
+                 record=None),
+        ]
 
     def test_process_migrations_calls_update(
         self, controller, mocker, db_params_tup, sorted_migrations_tuple_list
@@ -103,10 +110,10 @@ class TestController(object):
                                       sorted_migrations_tuple_list)
 
         controller.update_current_version.assert_has_calls([
-            call(db_params_tup, 1),
-            call(db_params_tup, 2),
-            call(db_params_tup, 45),
-            call(db_params_tup, 60)
+            call(db_params_tup, 1, session=None),
+            call(db_params_tup, 2, session=None),
+            call(db_params_tup, 45, session=None),
+            call(db_params_tup, 60, session=None)
         ], any_order=True)
 
     def test_process_migrations_returns_expected(
@@ -139,9 +146,11 @@ class TestController(object):
         controller.process_migrations_in_directory(db_params_tup, "")
 
         helpers.populate_migrations.assert_called_with("")
-        database_tools.fetch_current_version.assert_called_with(db_params_tup)
+        database_tools.fetch_current_version.assert_called_with(
+            db_params_tup, session=ANY)
         helpers.get_unprocessed_migrations.assert_called_with(0, [])
-        controller.process_migrations.assert_called_with(db_params_tup, 0, [])
+        controller.process_migrations.assert_called_with(
+            db_params_tup, 0, [], session=ANY)
 
     def test_process_migrations_in_directory_logs_expected(
         self, controller, database_tools, logger, helpers, mocker,
@@ -161,10 +170,143 @@ class TestController(object):
 
         controller.process_migrations_in_directory(db_params_tup, "")
 
-        logger.debug.assert_called_with("Migrations found: 0")
+        logger.debug.assert_any_call("Migrations found: 0")
 
         logger.info.assert_has_calls([
             call("Migrations yet to be processed: 0 (out of 0 in dir)"),
             call("Database version now 0 after processing 0 migrations. "
                  "Remaining: 0.")
         ], any_order=True)
+
+    def test_process_migrations_in_directory_connects_once(
+        self, controller, mocker, db_params_tup, sorted_migrations_tuple_list
+    ):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.Helpers.populate_migrations')
+        mocker.patch('migration_runner.DatabaseTools.apply_migration')
+
+        controller.helpers.populate_migrations.return_value = \
+            sorted_migrations_tuple_list
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+
+        controller.process_migrations_in_directory(db_params_tup, "")
+
+        assert mysql.connector.connect.call_count == 1
+        mock_connection.close.assert_called_once_with()
+
+    def test_process_migrations_reconnects_after_lost_connection(
+        self, controller, mocker, db_params_tup, sorted_migrations_tuple_list
+    ):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.DatabaseTools.apply_migration')
+
+        controller.database.apply_migration.side_effect = [
+            MigrationResult('/tmp/001.createtable.sql'),
+            mysql.connector.errors.OperationalError(
+                "MySQL server has gone away", errno=2006),
+        ]
+
+        with controller.open_session(db_params_tup) as session:
+            session.connection()
+            controller.process_migrations(db_params_tup, 0,
+                                          sorted_migrations_tuple_list,
+                                          session=session)
+            session.connection()
+
+            assert session.handshakes == 2
+
+    def test_process_migrations_logs_slowest_statements(
+        self, controller, mocker, db_params_tup, sorted_migrations_tuple_list
+    ):
+        mocker.patch('logging.Logger.info')
+        mocker.patch('migration_runner.DatabaseTools.apply_migration')
+        mocker.patch('migration_runner.Controller.update_current_version')
+
+        result = MigrationResult('/tmp/001.createtable.sql')
+        result.record(StatementResult(index=3, checksum='a' * 64,
+                                      rows_affected=10, warnings=1,
+                                      elapsed=2.5))
+        controller.database.apply_migration.return_value = result
+
+        controller.process_migrations(db_params_tup, 0,
+                                      sorted_migrations_tuple_list[:1])
+
+        controller.logger.info.assert_has_calls([
+            call("Migration 1 timing: 1 statements in 2.500s, 10 rows "
+                 "affected, 1 warnings"),
+            call("Slowest 1 statements executed:"),
+            call("  2.500s statement #3 (aaaaaaaaaaaa) in file: "
+                 "'/tmp/001.createtable.sql', 10 rows affected, 1 warnings"),
+        ])
+
+    def test_process_migrations_inline_version_skips_update(
+        self, controller, mocker, db_params_tup, sorted_migrations_tuple_list
+    ):
+        mocker.patch('migration_runner.DatabaseTools.apply_migration')
+        mocker.patch('migration_runner.Controller.update_current_version')
+        controller.inline_version_update = True
+
+        db_version, total_processed = controller.process_migrations(
+            db_params_tup, 0, sorted_migrations_tuple_list)
+
+        assert controller.database.apply_migration.call_args_list[-1] == \
+            call(db_params_tup, '/tmp/60.createtable.sql', session=None,
+                 version=60, record=None)
+        assert not controller.update_current_version.called
+        assert db_version == 60
+        assert total_processed == 4
+
+    def test_plan_migrations_reads_version_once(
+        self, controller, mocker, tmpdir, db_params_tup
+    ):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.DatabaseTools.apply_migration')
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.fetchone.return_value = (1,)
+
+        tmpdir.join("001.create.sql").write("CREATE TABLE a (x INT);")
+        pending = tmpdir.join("002.seed.sql")
+        pending.write("INSERT INTO a VALUES (1);\nINSERT INTO a VALUES (2);")
+
+        plan = controller.plan_migrations(db_params_tup, str(tmpdir))
+
+        assert mysql.connector.connect.call_count == 1
+        assert not controller.database.apply_migration.called
+        assert plan.db_version == 1
+        assert plan.total_migrations == 2
+        assert plan.pending == [PlanEntry(
+            version=2,
+            filename=str(pending),
+            size=len(pending.read()),
+            checksum=controller.helpers.file_checksum(str(pending)),
+            statements=2
+        )]
+
+    def test_process_migrations_in_directory_interleaves_data_migrations(
+        self, controller, mocker, tmpdir, db_params_tup
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 1
+        mock_cursor.fetchone.side_effect = [(0,), (1,), (2,), (3,)]
+
+        tmpdir.join("001.create.sql").write("CREATE TABLE a (x INT);")
+        tmpdir.join("002.seed.csv").write("# table: a\nx\n1\n2\n")
+        tmpdir.join("003.index.sql").write("CREATE INDEX ax ON a (x);")
+
+        db_version, processed, remaining = \
+            controller.process_migrations_in_directory(db_params_tup,
+                                                       str(tmpdir))
+
+        assert (db_version, processed, remaining) == (3, 3, 0)
+        mock_cursor.executemany.assert_called_once_with(
+            "INSERT INTO `a` (`x`) VALUES (%s)", [("1",), ("2",)])
+        assert call("UPDATE versionTable SET version = %s", (2,)) in \
+            mock_cursor.execute.call_args_list
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+
+from migration_runner.data import (DataMigrationError, data_batches,
+                                   insert_statement, is_data_migration,
+                                   load_data_statement, read_data_spec)
+
+
+def data_file(text):
+    return io.StringIO(text, newline='')
+
+
+class TestDataMigrations(object):
+    """Tests for CSV data migrations in `migration_runner` package."""
+
+    def test_is_data_migration(self):
+        assert is_data_migration("057.seed_products.csv")
+        assert not is_data_migration("057.seed_products.sql")
+
+    def test_read_data_spec(self):
+        spec = read_data_spec(data_file(
+            u"# table: product\n# batch_size: 500\nsku,name\nA-1,Chair\n"))
+
+        assert spec.table == "product"
+        assert spec.columns == ["sku", "name"]
+        assert spec.batch_size == 500
+        assert spec.header_lines == 3
+        assert spec.line_terminator == "\n"
+
+    def test_read_data_spec_crlf(self):
+        spec = read_data_spec(data_file(u"# table: product\r\nsku\r\n"))
+
+        assert spec.line_terminator == "\r\n"
+        assert spec.batch_size is None
+
+    @pytest.mark.parametrize('text', [
+        u"sku,name\nA-1,Chair\n",
+        u"# table: product\n",
+        u"# table: product\n# batch_size: none\nsku\n",
+        u"# table: product\n# batchsize: 10\nsku\n",
+    ])
+    def test_read_data_spec_invalid(self, text):
+        with pytest.raises(DataMigrationError):
+            read_data_spec(data_file(text))
+
+    def test_data_batches(self):
+        migration = data_file(u"# table: product\nsku,name,price\n"
+                              u"A-1,\"Chair, oak\",45.00\n"
+                              u"A-2,Stool,\\N\n"
+                              u"\n"
+                              u"A-3,\"Desk \"\"L\"\"\",\"\\N\"\n")
+        spec = read_data_spec(migration)
+
+        assert list(data_batches(spec, migration, 2)) == [
+            [(u"A-1", u"Chair, oak", u"45.00"), (u"A-2", u"Stool", None)],
+            [(u"A-3", u"Desk \"L\"", None)],
+        ]
+
+    def test_data_batches_wrong_field_count(self):
+        migration = data_file(u"# table: product\nsku,name\nA-1\n")
+        spec = read_data_spec(migration)
+
+        with pytest.raises(DataMigrationError) as error:
+            list(data_batches(spec, migration, 10))
+        assert "line 3" in str(error.value)
+
+    def test_insert_statement(self):
+        spec = read_data_spec(data_file(u"# table: shop.product\nsku,name\n"))
+
+        assert insert_statement(spec) == \
+            "INSERT INTO `shop`.`product` (`sku`, `name`) VALUES (%s, %s)"
+
+    def test_load_data_statement(self):
+        spec = read_data_spec(data_file(u"# table: product\nsku,name\n"))
+
+        assert load_data_statement(spec) == (
+            "LOAD DATA LOCAL INFILE %s INTO TABLE `product` "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "ESCAPED BY '' LINES TERMINATED BY '\\n' IGNORE 2 LINES "
+            "(@c0, @c1) SET `sku` = NULLIF(@c0, '\\\\N'), "
+            "`name` = NULLIF(@c1, '\\\\N')"
+        )
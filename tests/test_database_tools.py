@@ -4,6 +4,14 @@ import io
 
 import mysql.connector
 import pytest
+from mock import call
+
+from migration_runner.data import DataMigrationError
+from migration_runner.database_tools import DatabaseTools
+from migration_runner.errors import DatabaseConnectionError
+from migration_runner.mapped import map_file
+from migration_runner.results import statement_checksum
+from migration_runner.statements import IncompleteStatementError
 
 
 class TestDatabaseTools(object):
@@ -12,7 +20,7 @@ class TestDatabaseTools(object):
     def test_connect_database_invalid_params(
         self, database_tools, db_params_tup
     ):
-        with pytest.raises(SystemExit):
+        with pytest.raises(DatabaseConnectionError):
             database_tools.connect_database(db_params_tup)
 
     def test_connect_database_mysql_library_called(
@@ -48,7 +56,7 @@ class TestDatabaseTools(object):
     def test_fetch_current_version_invalid_db_params(
         self, database_tools, db_params_tup
     ):
-        with pytest.raises(SystemExit):
+        with pytest.raises(DatabaseConnectionError):
             database_tools.fetch_current_version(db_params_tup)
 
     def test_fetch_current_version_no_version_in_database(
@@ -87,6 +95,9 @@ class TestDatabaseTools(object):
     ):
         mocker.patch('mysql.connector.connect')
 
+        mock_connection = mysql.connector.connect.return_value
+        mock_connection.cursor.return_value.rowcount = 0
+
         filepath = tmpdir.join(sql_filename_expected)
         filepath.write("test")
 
@@ -105,7 +116,273 @@ class TestDatabaseTools(object):
 
         mock_connection = mysql.connector.connect.return_value
         mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 0
+
+        database_tools.apply_migration(db_params_tup, str(filepath))
+
+        mock_cursor.execute.assert_called_with("test")
+
+    def test_apply_migration_executes_each_statement(
+        self, database_tools, tmpdir, mocker, db_params_tup,
+        sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("CREATE TABLE a (x INT);\n"
+                       "INSERT INTO a VALUES (1);\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 0
+
+        database_tools.apply_migration(db_params_tup, str(filepath))
+
+        assert mock_cursor.execute.call_args_list == [
+            call("CREATE TABLE a (x INT)"),
+            call("INSERT INTO a VALUES (1)"),
+        ]
+
+    def test_apply_migration_drains_results_and_records_statements(
+        self, database_tools, tmpdir, mocker, db_params_tup,
+        sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("SELECT 1;\nUPDATE a SET x = 1;\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.with_rows = True
+        mock_cursor.rowcount = 3
+        mock_cursor.fetchwarnings.return_value = [
+            ('Warning', 1265, "Data truncated")]
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath))
+
+        assert mock_cursor.fetchall.call_count == 2
+        assert result.statements == 2
+        assert result.rows_affected == 6
+        assert result.warnings == 2
+        assert sorted(s.index for s in result.slowest) == [0, 1]
+        assert result.slowest[0].checksum == statement_checksum(
+            "SELECT 1" if result.slowest[0].index == 0
+            else "UPDATE a SET x = 1")
+
+    def test_apply_migration_with_version_commits_once(
+        self, database_tools, tmpdir, mocker, db_params_tup,
+        sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("INSERT INTO a VALUES (1);\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 1
+
+        database_tools.apply_migration(db_params_tup, str(filepath),
+                                       version=45)
+
+        mock_connection.start_transaction.assert_called_once_with()
+        assert mock_cursor.execute.call_args_list == [
+            call("INSERT INTO a VALUES (1)"),
+            call("UPDATE versionTable SET version = "
+                 "GREATEST(version, %s)", (45,)),
+        ]
+        mock_connection.commit.assert_called_once_with()
+
+    @pytest.mark.parametrize('content, error', [
+        (b"INSERT INTO a VALUES (1);\nINSERT INTO a VALUES ('x);\n",
+         IncompleteStatementError),
+        # Past the first buffer decoded by io.open
+        (b"INSERT INTO a VALUES (1);\n" * 1000 +
+         b"INSERT INTO a VALUES ('\xff');\n", UnicodeDecodeError),
+    ])
+    def test_apply_migration_unreadable_file_rolls_back(
+        self, database_tools, tmpdir, mocker, db_params_tup,
+        sql_filename_expected, content, error
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write_binary(content)
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_connection.cursor.return_value.rowcount = 1
+
+        with pytest.raises(database_tools.migration_errors) as excinfo:
+            database_tools.apply_migration(db_params_tup, str(filepath),
+                                           version=45)
+
+        assert isinstance(excinfo.value, error)
+        mock_connection.rollback.assert_called_once_with()
+        assert not mock_connection.commit.called
+
+    def test_apply_migration_with_version_rolls_back_on_error(
+        self, database_tools, tmpdir, mocker, db_params_tup,
+        sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("INSERT INTO a VALUES (1);\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.execute.side_effect = \
+            mysql.connector.errors.ProgrammingError("Table 'a' doesn't exist")
+
+        with pytest.raises(mysql.connector.errors.ProgrammingError):
+            database_tools.apply_migration(db_params_tup, str(filepath),
+                                           version=45)
+
+        mock_connection.rollback.assert_called_once_with()
+        assert not mock_connection.commit.called
+
+    def test_apply_data_migration_batches_inserts(
+        self, database_tools, tmpdir, mocker, db_params_tup
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join("057.seed_products.csv")
+        filepath.write("# table: product\n# batch_size: 2\n"
+                       "sku,name\nA-1,Chair\nA-2,\\N\nA-3,Desk\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 2
+        mock_cursor.fetchwarnings.return_value = None
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath),
+                                                version=57)
+
+        statement = "INSERT INTO `product` (`sku`, `name`) VALUES (%s, %s)"
+        assert mock_cursor.executemany.call_args_list == [
+            call(statement, [("A-1", "Chair"), ("A-2", None)]),
+            call(statement, [("A-3", "Desk")]),
+        ]
+        mock_cursor.execute.assert_called_once_with(
+            "UPDATE versionTable SET version = GREATEST(version, %s)", (57,))
+        mock_connection.commit.assert_called_once_with()
+        assert result.statements == 2
+
+    def test_apply_data_migration_load_data(
+        self, mocker, tmpdir, db_params_tup, db_params_dict
+    ):
+        mocker.patch('mysql.connector.connect')
+        database_tools = DatabaseTools(data_method='load-data')
+
+        filepath = tmpdir.join("057.seed_products.csv")
+        filepath.write("# table: product\nsku,name\nA-1,Chair\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 1
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath))
+
+        mysql.connector.connect.assert_called_with(allow_local_infile=True,
+                                                   **db_params_dict)
+        statement, params = mock_cursor.execute.call_args[0]
+        assert statement.startswith("LOAD DATA LOCAL INFILE %s INTO TABLE "
+                                    "`product`")
+        assert params == (str(filepath),)
+        assert not mock_cursor.executemany.called
+        assert result.rows_affected == 1
+
+    def test_apply_data_migration_invalid_rolls_back(
+        self, database_tools, tmpdir, mocker, db_params_tup
+    ):
+        mocker.patch('mysql.connector.connect')
+
+        filepath = tmpdir.join("057.seed_products.csv")
+        filepath.write("# table: product\nsku,name\nA-1\n")
+
+        mock_connection = mysql.connector.connect.return_value
+
+        with pytest.raises(DataMigrationError):
+            database_tools.apply_migration(db_params_tup, str(filepath),
+                                           version=57)
+
+        mock_connection.rollback.assert_called_once_with()
+
+    def test_apply_migration_coalesces_inserts(
+        self, mocker, tmpdir, db_params_tup, sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+        database_tools = DatabaseTools(coalesce_inserts=True)
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("INSERT INTO a (x) VALUES (1);\n"
+                       "INSERT INTO a (x) VALUES (2);\n"
+                       "UPDATE a SET x = x + 1;\n")
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 2
+        mock_cursor.fetchall.return_value = [(4194304,)]
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath))
+
+        assert mock_cursor.execute.call_args_list == [
+            call("SELECT @@max_allowed_packet"),
+            call("INSERT INTO a (x) VALUES (1), (2)"),
+            call("UPDATE a SET x = x + 1"),
+        ]
+        assert result.statements == 2
+        assert database_tools.max_allowed_packet(mock_cursor) == 4194304
+
+    def test_apply_migration_mmap_sends_bytes(
+        self, mocker, tmpdir, db_params_tup, sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.database_tools.map_file',
+                     side_effect=lambda sql_file: map_file(sql_file, 1))
+        database_tools = DatabaseTools(mmap_statements=True)
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write_binary(u"CREATE TABLE a (x INT);\n"
+                              u"INSERT INTO a VALUES ('é;');\n"
+                              .encode('utf-8'))
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 1
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath))
+
+        assert mock_cursor.execute.call_args_list == [
+            call(b"CREATE TABLE a (x INT)"),
+            call(u"INSERT INTO a VALUES ('é;')".encode('utf-8')),
+        ]
+        assert set(statement.checksum for statement in result.slowest) == {
+            statement_checksum(u"CREATE TABLE a (x INT)"),
+            statement_checksum(u"INSERT INTO a VALUES ('é;')")}
+
+    @pytest.mark.parametrize('content, options', [
+        (b"SELECT 1;\r\nSELECT 2;\r\n", {}),
+        (b"SELECT 1;\nSELECT 2;\n", {'coalesce_inserts': True}),
+    ])
+    def test_apply_migration_mmap_falls_back_to_text(
+        self, mocker, tmpdir, db_params_tup, sql_filename_expected,
+        content, options
+    ):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.database_tools.map_file',
+                     side_effect=lambda sql_file: map_file(sql_file, 1))
+        database_tools = DatabaseTools(mmap_statements=True, **options)
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write_binary(content)
+
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.rowcount = 1
+        mock_cursor.fetchall.return_value = [(4194304,)]
 
         database_tools.apply_migration(db_params_tup, str(filepath))
 
-        mock_cursor.execute.assert_called_with("test", multi=True)
+        assert call(u"SELECT 1") in mock_cursor.execute.call_args_list
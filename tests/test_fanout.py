@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from migration_runner.errors import DatabaseConnectionError
+from migration_runner.fanout import FanOut
+
+
+@pytest.fixture
+def fan_out():
+    return FanOut(workers=4)
+
+
+@pytest.fixture
+def targets_file(tmpdir):
+    targets = tmpdir.join("targets.txt")
+    targets.write(
+        "# tenant databases\n"
+        "user_a host_a db_a pass_a\n"
+        "\n"
+        "user_b host_b db_b 'pass with spaces'  # trailing comment\n"
+    )
+    return str(targets)
+
+
+class TestFanOut(object):
+    """Tests for FanOut class in `migration_runner` package."""
+
+    def test_read_targets(self, fan_out, targets_file):
+        assert fan_out.read_targets(targets_file) == [
+            ("host_a", "user_a", "pass_a", "db_a"),
+            ("host_b", "user_b", "pass with spaces", "db_b"),
+        ]
+
+    def test_read_targets_hash_in_password(self, fan_out, tmpdir):
+        targets = tmpdir.join("targets.txt")
+        targets.write("user_a host_a db_a pa#ss\n"
+                      "user_b host_b db_b 'p #b'#x  # trailing comment\n")
+
+        assert fan_out.read_targets(str(targets)) == [
+            ("host_a", "user_a", "pa#ss", "db_a"),
+            ("host_b", "user_b", "p #b#x", "db_b"),
+        ]
+
+    def test_read_targets_invalid_line(self, fan_out, tmpdir):
+        targets = tmpdir.join("targets.txt")
+        targets.write("user_a host_a db_a\n")
+
+        with pytest.raises(ValueError):
+            fan_out.read_targets(str(targets))
+
+    def test_process_targets_plans_once(self, fan_out, mocker, tmpdir,
+                                        db_params_tup):
+        populate = mocker.patch(
+            'migration_runner.Helpers.populate_migrations', return_value=[])
+        process = mocker.patch(
+            'migration_runner.Controller.process_planned_migrations',
+            return_value=(60, 4, 0))
+
+        results = fan_out.process_targets([db_params_tup] * 10, str(tmpdir))
+
+        assert populate.call_count == 1
+        assert process.call_count == 10
+        assert [r.db_version for r in results] == [60] * 10
+        assert not any(r.error for r in results)
+
+    def test_process_targets_respects_worker_limit(self, mocker, tmpdir,
+                                                   db_params_tup):
+        fan_out = FanOut(workers=2)
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def process(controller, db_params, migrations, baselines=()):
+            with lock:
+                active.append(db_params)
+                peak.append(len(active))
+            threading.Event().wait(0.01)
+            with lock:
+                active.remove(db_params)
+            return 1, 1, 0
+
+        mocker.patch('migration_runner.Controller.process_planned_migrations',
+                     autospec=True, side_effect=process)
+
+        fan_out.process_targets([db_params_tup] * 6, str(tmpdir))
+
+        assert max(peak) <= 2
+
+    def test_process_targets_reports_failures(self, fan_out, mocker, tmpdir):
+        def process(controller, db_params, migrations, baselines=()):
+            if db_params[0] == "down":
+                raise DatabaseConnectionError("refused")
+            if db_params[0] == "broken":
+                return 45, 2, 1
+            return 60, 3, 0
+
+        mocker.patch('migration_runner.Controller.process_planned_migrations',
+                     autospec=True, side_effect=process)
+
+        results = fan_out.process_targets([
+            ("up", "user", "pass", "db"),
+            ("down", "user", "pass", "db"),
+            ("broken", "user", "pass", "db"),
+        ], str(tmpdir))
+
+        assert [(r.target, r.error) for r in results] == [
+            ("up/db", None),
+            ("down/db", "connection failed"),
+            ("broken/db", "migration failed"),
+        ]
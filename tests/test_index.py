@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from timeit import default_timer
+
+import pytest
+
+from migration_runner.index import MigrationIndex, MigrationView
+
+
+@pytest.fixture
+def migration_index(sorted_migrations_tuple_list):
+    return MigrationIndex(sorted_migrations_tuple_list)
+
+
+class TestMigrationIndex(object):
+    """Tests for MigrationIndex class in `migration_runner` package."""
+
+    def test_behaves_like_list(self, migration_index,
+                               sorted_migrations_tuple_list):
+        assert migration_index == sorted_migrations_tuple_list
+        assert len(migration_index) == 4
+        assert migration_index[2] == (45, '/tmp/045.createtable.sql')
+        assert migration_index[-1] == (60, '/tmp/60.createtable.sql')
+
+    def test_pending_returns_view(self, migration_index):
+        pending = migration_index.pending(2)
+
+        assert isinstance(pending, MigrationView)
+        assert pending.index is migration_index
+        assert pending == [
+            (45, '/tmp/045.createtable.sql'),
+            (60, '/tmp/60.createtable.sql'),
+        ]
+
+    @pytest.mark.parametrize('db_version,expected', [
+        (0, 4), (1, 3), (44, 2), (45, 1), (59, 1), (60, 0), (61, 0)
+    ])
+    def test_pending_boundaries(self, migration_index, db_version, expected):
+        assert len(migration_index.pending(db_version)) == expected
+
+    def test_pending_string_version(self, migration_index):
+        assert len(migration_index.pending('45')) == 1
+        with pytest.raises(ValueError):
+            migration_index.pending('five')
+
+    def test_view_indexing_and_slicing(self, migration_index):
+        pending = migration_index.pending(1)
+
+        assert pending[0] == (2, '/tmp/2-createtable.sql')
+        assert pending[-1] == (60, '/tmp/60.createtable.sql')
+        assert pending[1:] == migration_index.pending(2)
+        with pytest.raises(IndexError):
+            pending[3]
+
+    def test_bigint_versions_fall_back_to_list(self):
+        index = MigrationIndex([(1, 'a.sql'), (2 ** 70, 'b.sql')])
+
+        assert isinstance(index.versions, list)
+        assert index.pending(1) == [(2 ** 70, 'b.sql')]
+
+    def test_add_keeps_order(self):
+        index = MigrationIndex([(1, 'a.sql'), (5, 'c.sql')])
+
+        index.add(3, 'b.sql')
+        index.add(2 ** 70, 'd.sql')
+
+        assert index == [(1, 'a.sql'), (3, 'b.sql'), (5, 'c.sql'),
+                         (2 ** 70, 'd.sql')]
+        assert index.pending(3) == [(5, 'c.sql'), (2 ** 70, 'd.sql')]
+
+    def test_get_unprocessed_migrations_uses_index(self, helpers,
+                                                   migration_index):
+        result = helpers.get_unprocessed_migrations(10, migration_index)
+
+        assert isinstance(result, MigrationView)
+        assert result == [
+            (45, '/tmp/045.createtable.sql'),
+            (60, '/tmp/60.createtable.sql'),
+        ]
+
+    @pytest.mark.parametrize('size', [10 ** 5, 10 ** 6])
+    def test_pending_lookup_benchmark(self, size):
+        index = MigrationIndex(
+            (version, '/tmp/{}.sql'.format(version))
+            for version in range(size))
+        lookups = 1000
+
+        start = default_timer()
+        for db_version in range(0, size, size // lookups):
+            pending = index.pending(db_version)
+        elapsed = (default_timer() - start) / lookups
+
+        assert len(pending) == size - db_version - 1
+        # O(log n) bisect: each lookup should be well under a millisecond,
+        # where a linear scan at 10^6 entries takes tens of milliseconds.
+        assert elapsed < 0.001
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from click.testing import CliRunner
+
+import migration_runner.cli
+from migration_runner import Controller
+from migration_runner.index import MigrationIndex
+from migration_runner.ledger import (Ledger, LedgerEntry, Verification,
+                                     unapplied_migrations)
+
+
+@pytest.fixture
+def migration_versions():
+    return (1, 2, 4)
+
+
+class TestLedger(object):
+    """Tests for the appliedMigrations ledger in `migration_runner`
+    package."""
+
+    def test_unapplied_migrations(self):
+        migrations = [(1, 'a'), (2, 'b'), (4, 'c')]
+
+        assert unapplied_migrations(migrations, {1, 4}) == [(2, 'b')]
+        assert unapplied_migrations(MigrationIndex(migrations),
+                                    {1, 4}) == [(2, 'b')]
+
+    def test_applied_versions_falls_back_to_db_version(self):
+        migrations = [(1, 'a'), (2, 'b'), (4, 'c')]
+
+        assert Ledger.applied_versions({}, 2, migrations) == {1, 2}
+        assert Ledger.applied_versions(
+            {4: None}, 2, migrations) == {4}
+        assert Ledger.applied_versions(
+            {1: None}, 4, migrations) == {1, 2, 4}
+
+    def test_verify(self):
+        entries = {
+            1: LedgerEntry(1, '001.a.sql', 'aaa', 0.1, None),
+            2: LedgerEntry(2, '002.b.sql', 'bbb', 0.1, None),
+            3: LedgerEntry(3, '003.c.sql', 'ccc', 0.1, None),
+        }
+        migrations = [(1, '001.a.sql'), (2, '002.b.sql'), (4, '004.d.sql')]
+        checksums = {'001.a.sql': 'aaa', '002.b.sql': 'xxx'}
+
+        verification = Ledger.verify(entries, migrations, checksums.get)
+
+        assert verification == Verification(
+            applied=3, edited=[(entries[2], '002.b.sql', 'xxx')],
+            missing=[entries[3]], pending=[(4, '004.d.sql')])
+
+    def test_adopts_existing_database(self, connect, state, migrations_dir,
+                                      db_params_tup):
+        state['version'] = 2
+
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert sorted(state['ledger']) == [1, 2, 4]
+        assert state['ledger'][1][1] == '001.create.sql'
+        assert state['executed'] == ["CREATE TABLE t4 (id INT)"]
+        assert state['version'] == 4
+
+    def test_plan_uses_one_connection(self, connect, state, migrations_dir,
+                                      db_params_tup):
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+        migrations_dir.join("003.create.sql").write(
+            "CREATE TABLE t3 (id INT);\n")
+        connect.reset_mock()
+
+        plan = Controller(ledger=True).plan_migrations(db_params_tup,
+                                                       str(migrations_dir))
+
+        assert connect.call_count == 1
+        assert [entry.version for entry in plan.pending] == [3]
+
+    def test_applies_out_of_order_migration(self, connect, state,
+                                            migrations_dir, db_params_tup):
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+        migrations_dir.join("003.create.sql").write(
+            "CREATE TABLE t3 (id INT);\n")
+        state['executed'] = []
+
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert state['executed'] == ["CREATE TABLE t3 (id INT)"]
+        assert sorted(state['ledger']) == [1, 2, 3, 4]
+        assert state['version'] == 4
+
+    def test_adopts_migrations_applied_without_ledger(self, connect, state,
+                                                      migrations_dir,
+                                                      db_params_tup):
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+        migrations_dir.join("005.create.sql").write(
+            "CREATE TABLE t5 (id INT);\n")
+        Controller().process_migrations_in_directory(db_params_tup,
+                                                     str(migrations_dir))
+        migrations_dir.join("006.create.sql").write(
+            "CREATE TABLE t6 (id INT);\n")
+        state['executed'] = []
+
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert state['executed'] == ["CREATE TABLE t6 (id INT)"]
+        assert sorted(state['ledger']) == [1, 2, 4, 5, 6]
+        assert state['version'] == 6
+
+    def test_inline_version_records_before_commit(self, connect, state,
+                                                  migrations_dir,
+                                                  db_params_tup):
+        connect.return_value.commit.side_effect = lambda: \
+            state['executed'].append(('COMMIT', sorted(state['ledger'])))
+
+        Controller(ledger=True, inline_version_update=True) \
+            .process_migrations_in_directory(db_params_tup,
+                                             str(migrations_dir))
+
+        assert state['executed'] == [
+            "CREATE TABLE t1 (id INT)", ('COMMIT', [1]),
+            "CREATE TABLE t2 (id INT)", ('COMMIT', [1, 2]),
+            "CREATE TABLE t4 (id INT)", ('COMMIT', [1, 2, 4]),
+        ]
+        assert state['version'] == 4
+
+    def test_without_ledger_skips_lower_versions(self, connect, state,
+                                                 migrations_dir,
+                                                 db_params_tup):
+        state['version'] = 2
+
+        Controller().process_migrations_in_directory(db_params_tup,
+                                                     str(migrations_dir))
+
+        assert state['executed'] == ["CREATE TABLE t4 (id INT)"]
+        assert state['ledger'] is None
+
+    def test_verify_migrations(self, connect, state, migrations_dir,
+                               db_params_tup):
+        controller = Controller(ledger=True)
+        controller.process_migrations_in_directory(db_params_tup,
+                                                   str(migrations_dir))
+        migrations_dir.join("002.create.sql").write(
+            "CREATE TABLE t2 (id BIGINT);\n")
+        migrations_dir.join("004.create.sql").remove()
+        migrations_dir.join("005.create.sql").write(
+            "CREATE TABLE t5 (id INT);\n")
+
+        verification = controller.verify_migrations(db_params_tup,
+                                                    str(migrations_dir))
+
+        assert verification.applied == 3
+        assert [entry.version for entry, _, _ in verification.edited] == [2]
+        assert [entry.version for entry in verification.missing] == [4]
+        assert [version for version, _ in verification.pending] == [5]
+
+    def test_cli_verify_exit_code(self, connect, state, migrations_dir,
+                                  db_params_tup, db_params_dict):
+        Controller(ledger=True).process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+        arguments = [
+            'verify',
+            '--json',
+            str(migrations_dir),
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ]
+
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, arguments)
+
+        assert result.exit_code == 0
+        assert json.loads(result.output)['applied'] == 3
+
+        migrations_dir.join("001.create.sql").write(
+            "CREATE TABLE t1 (id BIGINT);\n")
+        result = runner.invoke(migration_runner.cli.main, arguments)
+
+        assert result.exit_code == 1
+        assert [edited['version'] for edited in
+                json.loads(result.output)['edited']] == [1]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+from migration_runner.manifest import MigrationManifest
+
+
+@pytest.fixture
+def migrations_dir(tmpdir):
+    sql_dir = tmpdir.mkdir("sql")
+    sql_dir.join("045.createtable.sql").write("CREATE TABLE a (x INT);")
+    sql_dir.join("2-seed.sql").write("INSERT INTO a VALUES (1);")
+    sql_dir.join("notes.txt").write("ignored")
+    return sql_dir
+
+
+@pytest.fixture
+def manifest(helpers, tmpdir):
+    return MigrationManifest(str(tmpdir.join("manifest.json")), helpers)
+
+
+class TestMigrationManifest(object):
+    """Tests for MigrationManifest class in `migration_runner` package."""
+
+    def test_migrations_sorted(self, manifest, migrations_dir):
+        assert manifest.migrations(str(migrations_dir)) == [
+            (2, str(migrations_dir.join("2-seed.sql"))),
+            (45, str(migrations_dir.join("045.createtable.sql"))),
+        ]
+
+    def test_migrations_writes_checksums(self, manifest, helpers,
+                                         migrations_dir):
+        manifest.migrations(str(migrations_dir))
+
+        with open(manifest.path) as manifest_file:
+            data = json.load(manifest_file)
+
+        path = str(migrations_dir.join("2-seed.sql"))
+        assert data['order'] == ["2-seed.sql", "045.createtable.sql"]
+        assert data['files']["2-seed.sql"]['checksum'] == \
+            helpers.file_checksum(path)
+        assert manifest.checksum(path) == helpers.file_checksum(path)
+
+    def test_fresh_manifest_skips_listing_and_hashing(
+        self, manifest, migrations_dir, mocker
+    ):
+        expected = manifest.migrations(str(migrations_dir))
+
+        mocker.patch('os.listdir')
+        mocker.patch('migration_runner.Helpers.scan_file')
+
+        assert manifest.migrations(str(migrations_dir)) == expected
+        assert not os.listdir.called
+        assert not manifest.helpers.scan_file.called
+
+    def test_changed_file_rehashed_incrementally(
+        self, manifest, migrations_dir, mocker
+    ):
+        manifest.migrations(str(migrations_dir))
+
+        changed = migrations_dir.join("2-seed.sql")
+        changed.write("INSERT INTO a VALUES (1), (2);")
+        os.utime(str(changed), (1, 1))
+
+        spy = mocker.spy(manifest.helpers, 'scan_file')
+        manifest.migrations(str(migrations_dir))
+
+        spy.assert_called_once_with(str(changed))
+
+    def test_new_file_picked_up(self, manifest, migrations_dir):
+        manifest.migrations(str(migrations_dir))
+
+        added = migrations_dir.join("050.more.sql")
+        added.write("SELECT 1;")
+        os.utime(str(migrations_dir), (1, 1))
+
+        assert manifest.migrations(str(migrations_dir))[-1] == \
+            (50, str(added))
+
+    def test_manifest_for_other_directory_ignored(self, manifest,
+                                                  migrations_dir, tmpdir):
+        manifest.migrations(str(migrations_dir))
+
+        other_dir = tmpdir.mkdir("other")
+        other_dir.join("1.other.sql").write("SELECT 1;")
+
+        assert manifest.migrations(str(other_dir)) == [
+            (1, str(other_dir.join("1.other.sql")))]
+
+    def test_populate_migrations_uses_manifest(self, helpers, tmpdir,
+                                               migrations_dir, mocker):
+        helpers.manifest_path = str(tmpdir.join("manifest.json"))
+        mocker.spy(helpers, 'find_migrations')
+
+        migrations = helpers.populate_migrations(str(migrations_dir))
+
+        assert not helpers.find_migrations.called
+        assert [version for version, _ in migrations] == [2, 45]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import mmap
+
+from migration_runner.mapped import (has_carriage_returns, map_file,
+                                     mapped_checksum, mapped_lines)
+
+
+class TestMapped(object):
+    """Tests for memory-mapped reading in `migration_runner` package."""
+
+    def test_map_file_threshold(self, tmpdir):
+        path = tmpdir.join('001.small.sql')
+        path.write("SELECT 1;\n")
+
+        with open(str(path), 'rb') as migration_file:
+            assert map_file(migration_file) is None
+            buffer = map_file(migration_file, threshold=1)
+            assert buffer[:] == b"SELECT 1;\n"
+            buffer.close()
+
+    def test_map_file_empty(self, tmpdir):
+        path = tmpdir.join('001.empty.sql')
+        path.write("")
+
+        with open(str(path), 'rb') as migration_file:
+            assert map_file(migration_file, threshold=0) is None
+
+    def test_mapped_lines_across_releases(self, tmpdir):
+        lines = [u"INSERT INTO t VALUES ({}, 'é');\n".format(i).encode('utf-8')
+                 for i in range(2000)]
+        path = tmpdir.join('001.big.sql')
+        path.write_binary(b''.join(lines))
+
+        with open(str(path), 'rb') as migration_file:
+            buffer = map_file(migration_file, threshold=1)
+            assert list(mapped_lines(buffer, mmap.PAGESIZE)) == lines
+        assert buffer.closed
+
+    def test_mapped_checksum(self, tmpdir):
+        path = tmpdir.join('001.big.sql')
+        path.write_binary(b"SELECT 1;\n" * mmap.PAGESIZE)
+
+        with open(str(path), 'rb') as migration_file:
+            buffer = map_file(migration_file, threshold=1)
+            assert mapped_checksum(buffer, mmap.PAGESIZE) == hashlib.sha256(
+                path.read_binary()).hexdigest()
+            buffer.close()
+
+    def test_has_carriage_returns(self, tmpdir):
+        for ending, expected in ((b"\r\n", True), (b"\n", False)):
+            path = tmpdir.join('001.lines.sql')
+            path.write_binary(b"SELECT 1;\n" * mmap.PAGESIZE +
+                              b"SELECT 2;" + ending)
+
+            with open(str(path), 'rb') as migration_file:
+                buffer = map_file(migration_file, threshold=1)
+                assert has_carriage_returns(buffer,
+                                            mmap.PAGESIZE) is expected
+                buffer.close()
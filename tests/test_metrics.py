@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import pstats
+
+import mysql.connector
+import pytest
+
+from migration_runner import Controller
+from migration_runner.metrics import Metrics
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+class TestMetrics(object):
+    """Tests for Metrics class in `migration_runner` package."""
+
+    def test_counters(self, metrics):
+        metrics.increment('statements_executed', 3)
+        metrics.increment('statements_executed')
+
+        assert metrics.counters == {'statements_executed': 4}
+
+    def test_histogram_buckets(self, metrics):
+        for value in (0.001, 0.2, 0.2, 1000):
+            metrics.observe('connect_seconds', value)
+
+        histogram = metrics.histograms['connect_seconds']
+        cumulative = dict(histogram.cumulative())
+        assert cumulative[0.005] == 1
+        assert cumulative[0.25] == 3
+        assert cumulative[900.0] == 3
+        assert cumulative[float('inf')] == 4
+        assert histogram.count == 4
+
+    def test_phase_records_duration(self, metrics):
+        with metrics.phase('plan'):
+            pass
+
+        assert metrics.histograms['plan_seconds'].count == 1
+
+    def test_as_openmetrics(self, metrics):
+        metrics.increment('bytes_read', 120)
+        metrics.observe('migration_seconds', 0.5)
+
+        text = metrics.as_openmetrics()
+
+        assert "# TYPE migration_runner_bytes_read counter\n" in text
+        assert "migration_runner_bytes_read_total 120\n" in text
+        assert "# TYPE migration_runner_migration_seconds histogram\n" in text
+        assert 'migration_runner_migration_seconds_bucket{le="0.25"} 0\n' \
+            in text
+        assert 'migration_runner_migration_seconds_bucket{le="0.5"} 1\n' \
+            in text
+        assert 'migration_runner_migration_seconds_bucket{le="+Inf"} 1\n' \
+            in text
+        assert "migration_runner_migration_seconds_count 1\n" in text
+        assert text.endswith("# EOF\n")
+
+    def test_write_json(self, metrics, tmpdir):
+        metrics.increment('migrations_applied')
+        metrics.observe('run_seconds', 2.0)
+        report = tmpdir.join('report.json')
+
+        metrics.write_json(str(report))
+
+        data = json.loads(report.read())
+        assert data['counters'] == {'migrations_applied': 1}
+        assert data['histograms']['run_seconds']['count'] == 1
+
+    def test_profile_phase(self, tmpdir):
+        metrics = Metrics(profile_phases=['plan'], profile_dir=str(tmpdir))
+
+        with metrics.phase('plan'):
+            sorted(range(1000))
+        with metrics.phase('run'):
+            pass
+
+        assert metrics.write_profiles() == [str(tmpdir.join('plan.prof'))]
+        assert pstats.Stats(str(tmpdir.join('plan.prof'))).total_calls > 0
+
+    def test_controller_run_instrumented(self, mocker, tmpdir, db_params_tup):
+        mocker.patch('mysql.connector.connect')
+        mock_connection = mysql.connector.connect.return_value
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        mock_cursor.rowcount = 1
+
+        migration = tmpdir.join("001.seed.sql")
+        migration.write("INSERT INTO a VALUES (1);\nINSERT INTO a VALUES (2);")
+
+        controller = Controller()
+        controller.process_migrations_in_directory(db_params_tup, str(tmpdir))
+
+        metrics = controller.metrics
+        assert metrics.counters['statements_executed'] == 2
+        assert metrics.counters['bytes_read'] == len(migration.read())
+        assert metrics.counters['migrations_applied'] == 1
+        for name in ('plan_seconds', 'connect_seconds', 'migration_seconds',
+                     'run_seconds'):
+            assert metrics.histograms[name].count == 1
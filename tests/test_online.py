@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import re
+
+import mysql.connector
+import pytest
+from mock import MagicMock
+
+from migration_runner.cli import build_online_schema_change
+from migration_runner.database_tools import DatabaseTools
+from migration_runner.online import (OnlineSchemaChange,
+                                     OnlineSchemaChangeError, Throttle,
+                                     column_renames, parse_alter)
+
+# "host user password database" of a scratch MySQL database, which the
+# integration test creates and drops tables in
+TEST_DATABASE = os.environ.get('MIGRATION_RUNNER_TEST_DATABASE')
+
+
+class FakeCursor(object):
+    """Answers the queries an online schema change makes about a table
+    `orders` holding rows with the primary keys in `keys`."""
+
+    def __init__(self, keys=(1, 2, 3, 4, 5), primary_key=('id',),
+                 triggers=(), existing=(), threads_running=(),
+                 foreign_keys=(), fail_on=None, warnings=()):
+        self.keys = sorted(keys)
+        self.primary_key = list(primary_key)
+        self.triggers = list(triggers)
+        self.existing = list(existing)
+        self.foreign_keys = list(foreign_keys)
+        self.threads_running = list(threads_running)
+        self.fail_on = fail_on
+        self.warnings = list(warnings)
+        self.unique_keys = {
+            'orders': [('PRIMARY', 'id')],
+            '_orders_new': [('PRIMARY', 'id')],
+        }
+        self.columns = {
+            'orders': [('id', ''), ('name', ''), ('note', ''),
+                       ('total', 'VIRTUAL GENERATED')],
+            '_orders_new': [('id', ''), ('full_name', ''),
+                            ('email', ''), ('total', 'STORED GENERATED')],
+        }
+        self.statements = []
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, statement, params=()):
+        self.statements.append((statement, tuple(params)))
+        if self.fail_on and self.fail_on in statement:
+            raise mysql.connector.Error("Lock wait timeout exceeded")
+
+        self.description = None
+        self.rowcount = 0
+        self._rows = []
+        if 'information_schema.TRIGGERS' in statement:
+            self._rows = [(name,) for name in self.triggers]
+        elif 'information_schema.KEY_COLUMN_USAGE' in statement:
+            self._rows = self.foreign_keys
+        elif 'NON_UNIQUE = 0' in statement:
+            self._rows = self.unique_keys[params[1]]
+        elif 'information_schema.STATISTICS' in statement:
+            self._rows = [(name,) for name in self.primary_key]
+        elif 'information_schema.COLUMNS' in statement:
+            self._rows = self.columns[params[1]]
+        elif 'TABLE_NAME IN' in statement:
+            self._rows = [(name,) for name in self.existing]
+        elif 'TABLE_ROWS' in statement:
+            self._rows = [(len(self.keys),)]
+        elif statement == 'SHOW WARNINGS':
+            self._rows = self.warnings
+        elif statement.startswith('SHOW GLOBAL STATUS'):
+            self.description = [('Variable_name',), ('Value',)]
+            self._rows = [('Threads_running', self.threads_running.pop(0))]
+        elif re.search(r'LIMIT 1 OFFSET %s$', statement):
+            keys = [key for key in self.keys
+                    if 'WHERE' not in statement or key > params[0]]
+            offset = params[-1]
+            self._rows = [(keys[offset],)] if offset < len(keys) else []
+        elif statement.startswith('INSERT LOW_PRIORITY IGNORE'):
+            lower = params[0] if '>' in statement else None
+            upper = params[-1] if '<=' in statement else None
+            self.rowcount = len([
+                key for key in self.keys
+                if (lower is None or key > lower) and
+                (upper is None or key <= upper)])
+
+    def fetchall(self):
+        return self._rows
+
+    def executed(self):
+        return [statement for statement, _ in self.statements]
+
+
+class TestOnlineSchemaChange(object):
+    """Tests for online schema changes in `migration_runner` package."""
+
+    @pytest.mark.parametrize('statement,expected', [
+        ("ALTER TABLE orders ADD COLUMN email VARCHAR(255)",
+         (None, 'orders', 'ADD COLUMN email VARCHAR(255)')),
+        ("alter table `shop`.`order items` drop index idx_sku\n",
+         ('shop', 'order items', 'drop index idx_sku')),
+        ("ALTER TABLE orders RENAME COLUMN note TO notes",
+         (None, 'orders', 'RENAME COLUMN note TO notes')),
+        ("ALTER TABLE orders RENAME INDEX a TO b",
+         (None, 'orders', 'RENAME INDEX a TO b')),
+        ("ALTER TABLE orders RENAME TO purchases", None),
+        ("ALTER TABLE orders ADD KEY (x), RENAME purchases", None),
+        ("CREATE TABLE orders (id INT)", None),
+        ("ALTER VIEW orders AS SELECT 1", None),
+    ])
+    def test_parse_alter(self, statement, expected):
+        assert parse_alter(statement) == expected
+
+    def test_column_renames(self):
+        assert column_renames(
+            "CHANGE name full_name VARCHAR(64), "
+            "CHANGE COLUMN `note` `note` TEXT, "
+            "RENAME COLUMN `Total` TO amount") == {
+                'name': 'full_name', 'total': 'amount'}
+
+    def test_run_copies_in_chunks_and_swaps_tables(self):
+        cursor = FakeCursor()
+        online = OnlineSchemaChange(chunk_size=2)
+
+        copied = online.run(
+            cursor, "ALTER TABLE orders CHANGE name full_name VARCHAR(64), "
+                    "DROP COLUMN note, ADD COLUMN email VARCHAR(255)")
+
+        assert copied == 5
+        executed = [statement for statement in cursor.executed()
+                    if 'information_schema' not in statement and
+                    statement != 'SHOW WARNINGS']
+        assert executed[:2] == [
+            "CREATE TABLE `_orders_new` LIKE `orders`",
+            "ALTER TABLE `_orders_new` CHANGE name full_name VARCHAR(64), "
+            "DROP COLUMN note, ADD COLUMN email VARCHAR(255)",
+        ]
+        assert executed[2] == (
+            "CREATE TRIGGER `_orders_osc_del` AFTER DELETE ON `orders` FOR "
+            "EACH ROW DELETE IGNORE FROM `_orders_new` WHERE (`id`) = "
+            "(OLD.`id`)")
+        assert "REPLACE INTO `_orders_new` (`id`, `full_name`) VALUES " \
+               "(NEW.`id`, NEW.`name`)" in executed[3]
+        assert executed[4].startswith(
+            "CREATE TRIGGER `_orders_osc_ins` AFTER INSERT ON `orders`")
+
+        inserts = [(statement, params) for statement, params
+                   in cursor.statements
+                   if statement.startswith('INSERT LOW_PRIORITY')]
+        assert [params for _, params in inserts] == [
+            (2,), (2, 4), (4,)]
+        assert inserts[0][0].endswith(
+            "WHERE (`id`) <= (%s) LOCK IN SHARE MODE")
+        assert inserts[2][0].endswith(
+            "WHERE (`id`) > (%s) LOCK IN SHARE MODE")
+
+        assert executed[-5:] == [
+            "RENAME TABLE `orders` TO `_orders_old`, "
+            "`_orders_new` TO `orders`",
+            "DROP TRIGGER IF EXISTS `_orders_osc_ins`",
+            "DROP TRIGGER IF EXISTS `_orders_osc_upd`",
+            "DROP TRIGGER IF EXISTS `_orders_osc_del`",
+            "DROP TABLE IF EXISTS `_orders_old`",
+        ]
+
+    def test_run_keeps_old_table(self):
+        cursor = FakeCursor()
+        online = OnlineSchemaChange(drop_old_table=False)
+
+        online.run(cursor, "ALTER TABLE orders ADD COLUMN email TEXT")
+
+        assert "DROP TABLE IF EXISTS `_orders_old`" not in cursor.executed()
+        assert "DROP TRIGGER IF EXISTS `_orders_osc_ins`" in \
+            cursor.executed()
+
+    def test_run_qualifies_schema(self):
+        cursor = FakeCursor(keys=())
+
+        OnlineSchemaChange().run(
+            cursor, "ALTER TABLE shop.orders ADD COLUMN email TEXT")
+
+        assert cursor.statements[0][1][0] == 'shop'
+        assert "CREATE TABLE `shop`.`_orders_new` LIKE `shop`.`orders`" in \
+            cursor.executed()
+
+    @pytest.mark.parametrize('cursor,message', [
+        (FakeCursor(primary_key=()), "has no primary key"),
+        (FakeCursor(triggers=['audit']), "already has triggers"),
+        (FakeCursor(existing=['_orders_old']), "already exists"),
+        (FakeCursor(foreign_keys=[('orders_customer_fk', 'orders')]),
+         "has or is referenced by foreign keys"),
+        (FakeCursor(foreign_keys=[('item_order_fk', 'item')]),
+         r"item_order_fk on 'item'"),
+    ])
+    def test_run_rejects_table(self, cursor, message):
+        with pytest.raises(OnlineSchemaChangeError, match=message):
+            OnlineSchemaChange().run(cursor,
+                                     "ALTER TABLE orders ADD KEY (name)")
+
+        assert not [statement for statement in cursor.executed()
+                    if not statement.startswith('SELECT')]
+
+    def test_run_rejects_dropped_primary_key_column(self):
+        cursor = FakeCursor()
+        cursor.columns['_orders_new'] = [('uuid', ''), ('name', '')]
+
+        with pytest.raises(OnlineSchemaChangeError, match="Primary key"):
+            OnlineSchemaChange().run(
+                cursor, "ALTER TABLE orders DROP COLUMN id, ADD uuid INT")
+
+        assert cursor.executed()[-1] == "DROP TABLE IF EXISTS `_orders_new`"
+
+    def test_run_cleans_up_after_failed_copy(self):
+        cursor = FakeCursor(fail_on='INSERT LOW_PRIORITY')
+
+        with pytest.raises(mysql.connector.Error):
+            OnlineSchemaChange().run(
+                cursor, "ALTER TABLE orders ADD COLUMN email TEXT")
+
+        assert cursor.executed()[-4:] == [
+            "DROP TRIGGER IF EXISTS `_orders_osc_ins`",
+            "DROP TRIGGER IF EXISTS `_orders_osc_upd`",
+            "DROP TRIGGER IF EXISTS `_orders_osc_del`",
+            "DROP TABLE IF EXISTS `_orders_new`",
+        ]
+        assert not [statement for statement in cursor.executed()
+                    if statement.startswith('RENAME')]
+
+    @pytest.mark.parametrize('original,altered', [
+        ([('PRIMARY', 'id')], [('PRIMARY', 'id'), ('uniq', 'email')]),
+        ([('PRIMARY', 'id')], [('PRIMARY', 'email')]),
+        ([('PRIMARY', 'id'), ('uniq', 'name')],
+         [('PRIMARY', 'id'), ('uniq', 'email')]),
+        ([('PRIMARY', 'id'), ('by_expr', None)],
+         [('PRIMARY', 'id'), ('other_expr', None)]),
+    ])
+    def test_run_rejects_added_unique_key(self, original, altered):
+        cursor = FakeCursor()
+        cursor.columns['_orders_new'].append(('name', ''))
+        cursor.unique_keys.update(orders=original, _orders_new=altered)
+
+        with pytest.raises(OnlineSchemaChangeError, match="unique key"):
+            OnlineSchemaChange().run(
+                cursor, "ALTER TABLE orders ADD UNIQUE KEY uniq (email)")
+
+        assert not [statement for statement in cursor.executed()
+                    if statement.startswith(('CREATE TRIGGER', 'INSERT'))]
+        assert cursor.executed()[-1] == "DROP TABLE IF EXISTS `_orders_new`"
+
+    def test_run_allows_unique_key_implied_by_existing(self):
+        cursor = FakeCursor()
+        cursor.unique_keys.update(
+            orders=[('PRIMARY', 'id'), ('uniq', 'name')],
+            _orders_new=[('PRIMARY', 'id'), ('uniq', 'full_name'),
+                         ('uniq', 'email'), ('by_id', 'id'),
+                         ('by_id', 'email')])
+
+        assert OnlineSchemaChange().run(
+            cursor, "ALTER TABLE orders CHANGE name full_name VARCHAR(64), "
+                    "ADD UNIQUE KEY by_id (id, email)") == 5
+
+    def test_run_aborts_on_copy_warnings(self):
+        cursor = FakeCursor(warnings=[
+            ('Warning', 1062, "Duplicate entry '2' for key 'PRIMARY'"),
+            ('Warning', 1265, "Data truncated for column 'name' at row 2"),
+        ])
+
+        with pytest.raises(OnlineSchemaChangeError,
+                           match="1265: Data truncated"):
+            OnlineSchemaChange().run(
+                cursor, "ALTER TABLE orders MODIFY name VARCHAR(2)")
+
+        assert not [statement for statement in cursor.executed()
+                    if statement.startswith('RENAME')]
+        assert cursor.executed()[-1] == "DROP TABLE IF EXISTS `_orders_new`"
+
+    def test_run_ignores_duplicate_entry_warnings(self):
+        cursor = FakeCursor(warnings=[
+            ('Warning', 1062, "Duplicate entry '2' for key 'PRIMARY'")])
+
+        assert OnlineSchemaChange().run(
+            cursor, "ALTER TABLE orders ADD COLUMN email TEXT") == 5
+
+    def test_throttle_waits_for_threads_running(self, logger):
+        cursor = FakeCursor(threads_running=['40', '31', '3'])
+        sleep = MagicMock()
+        throttle = Throttle(max_threads_running=30, check_interval=0.5,
+                            chunk_sleep=0.1, sleep=sleep)
+
+        throttle.wait(cursor, logger)
+
+        assert [args[0] for args, _ in sleep.call_args_list] == [
+            0.5, 0.5, 0.1]
+        assert throttle.throttled == 1.0
+
+    def test_throttle_waits_for_replica_lag(self, logger):
+        replica_cursor = MagicMock()
+        replica_cursor.description = [('Slave_IO_State',),
+                                      ('Seconds_Behind_Master',)]
+        replica_cursor.fetchall.side_effect = [
+            [('', None)], [('', 12)], [('', 1)]]
+        connection = MagicMock()
+        connection.cursor.return_value = replica_cursor
+        connect_replica = MagicMock(return_value=connection)
+        sleep = MagicMock()
+        throttle = Throttle(max_replica_lag=5,
+                            replica_hosts=['replica-1'],
+                            connect_replica=connect_replica, sleep=sleep)
+
+        throttle.wait(FakeCursor(), logger)
+        throttle.close()
+
+        connect_replica.assert_called_once_with('replica-1')
+        assert sleep.call_count == 2
+        connection.close.assert_called_once_with()
+
+    def test_database_tools_routes_alters(self, mocker, tmpdir,
+                                          db_params_tup,
+                                          sql_filename_expected):
+        mocker.patch('mysql.connector.connect')
+        online = OnlineSchemaChange()
+        mocker.patch.object(online, 'run', return_value=5)
+        database_tools = DatabaseTools(online_schema_change=online)
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("ALTER TABLE orders ADD COLUMN email TEXT;\n"
+                       "ALTER TABLE orders RENAME TO purchases;\n")
+
+        mock_cursor = mysql.connector.connect.return_value.cursor.return_value
+        mock_cursor.rowcount = 0
+
+        result = database_tools.apply_migration(db_params_tup, str(filepath))
+
+        online.run.assert_called_once()
+        args, kwargs = online.run.call_args
+        assert args == (mock_cursor,
+                        "ALTER TABLE orders ADD COLUMN email TEXT")
+        mock_cursor.execute.assert_called_once_with(
+            "ALTER TABLE orders RENAME TO purchases")
+        assert result.statements == 2
+        assert result.rows_affected == 5
+
+        kwargs['connect_replica']('replica-1')
+        assert mysql.connector.connect.call_args[1]['host'] == 'replica-1'
+
+    def test_database_tools_rolls_back_on_online_error(
+        self, mocker, tmpdir, db_params_tup, sql_filename_expected
+    ):
+        mocker.patch('mysql.connector.connect')
+        online = OnlineSchemaChange()
+        mocker.patch.object(online, 'run',
+                            side_effect=OnlineSchemaChangeError("no key"))
+        database_tools = DatabaseTools(online_schema_change=online)
+
+        filepath = tmpdir.join(sql_filename_expected)
+        filepath.write("ALTER TABLE orders ADD COLUMN email TEXT;\n")
+        mock_connection = mysql.connector.connect.return_value
+
+        with pytest.raises(OnlineSchemaChangeError):
+            database_tools.apply_migration(db_params_tup, str(filepath),
+                                           version=45)
+
+        mock_connection.rollback.assert_called_once_with()
+
+    def test_build_online_schema_change(self, logger):
+        assert build_online_schema_change(logger, False, 1000, None, None,
+                                          ()) is None
+
+        online = build_online_schema_change(logger, True, 500, 30, 5,
+                                            ('replica-1',))
+
+        assert online.chunk_size == 500
+        assert online.throttle(MagicMock()).replica_hosts == ['replica-1']
+        assert online.throttle().replica_hosts == []
+
+
+@pytest.mark.skipif(TEST_DATABASE is None,
+                    reason="MIGRATION_RUNNER_TEST_DATABASE is not set")
+class TestOnlineSchemaChangeMySQL(object):
+    """Tests for online schema changes against a real MySQL server."""
+
+    def test_alter_preserves_rows_and_concurrent_writes(self):
+        host, user, password, database = TEST_DATABASE.split()
+        connection = mysql.connector.connect(host=host, user=user,
+                                             password=password,
+                                             database=database,
+                                             autocommit=True)
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS osc_test")
+        cursor.execute("CREATE TABLE osc_test (id INT PRIMARY KEY, "
+                       "name VARCHAR(32))")
+        cursor.executemany("INSERT INTO osc_test VALUES (%s, %s)",
+                           [(key, 'row {}'.format(key))
+                            for key in range(1, 101)])
+
+        writer = connection.cursor()
+
+        def write_between_chunks(seconds):
+            writer.execute("UPDATE osc_test SET name = 'updated' "
+                           "WHERE id = 100")
+            writer.execute("INSERT IGNORE INTO osc_test VALUES (101, 'new')")
+            writer.execute("DELETE FROM osc_test WHERE id = 1")
+
+        online = OnlineSchemaChange(chunk_size=10, chunk_sleep=0.01,
+                                    sleep=write_between_chunks)
+        try:
+            copied = online.run(
+                cursor, "ALTER TABLE osc_test CHANGE name label "
+                        "VARCHAR(64) NOT NULL, ADD COLUMN extra INT")
+
+            cursor.execute("SELECT id, label, extra FROM osc_test "
+                           "ORDER BY id")
+            rows = cursor.fetchall()
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS osc_test")
+            connection.close()
+
+        assert copied >= 99
+        assert rows[0] == (2, 'row 2', None)
+        assert rows[-2:] == [(100, 'updated', None), (101, 'new', None)]
+        assert len(rows) == 100
+
+    @pytest.mark.parametrize('alter,message', [
+        ("ADD UNIQUE KEY uniq_name (name)", "unique key"),
+        ("MODIFY name VARCHAR(32) NOT NULL", "Column 'name' cannot be null"),
+    ])
+    def test_alter_refuses_to_lose_rows(self, alter, message):
+        host, user, password, database = TEST_DATABASE.split()
+        connection = mysql.connector.connect(host=host, user=user,
+                                             password=password,
+                                             database=database,
+                                             autocommit=True)
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS osc_test")
+        cursor.execute("CREATE TABLE osc_test (id INT PRIMARY KEY, "
+                       "name VARCHAR(32))")
+        cursor.executemany("INSERT INTO osc_test VALUES (%s, %s)",
+                           [(1, 'same'), (2, 'same'), (3, None)])
+        try:
+            with pytest.raises(OnlineSchemaChangeError, match=message):
+                OnlineSchemaChange().run(
+                    cursor, "ALTER TABLE osc_test " + alter)
+
+            cursor.execute("SELECT COUNT(*) FROM osc_test")
+            count = cursor.fetchall()[0][0]
+            cursor.execute("SHOW TABLES LIKE '\\_osc\\_test\\_%'")
+            leftovers = cursor.fetchall()
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS osc_test")
+            connection.close()
+
+        assert count == 3
+        assert leftovers == []
+
+    def test_alter_rejects_referenced_table(self):
+        host, user, password, database = TEST_DATABASE.split()
+        connection = mysql.connector.connect(host=host, user=user,
+                                             password=password,
+                                             database=database,
+                                             autocommit=True)
+        cursor = connection.cursor()
+        cursor.execute("DROP TABLE IF EXISTS osc_child")
+        cursor.execute("DROP TABLE IF EXISTS osc_parent")
+        cursor.execute("CREATE TABLE osc_parent (id INT PRIMARY KEY)")
+        cursor.execute("CREATE TABLE osc_child (id INT PRIMARY KEY, "
+                       "parent_id INT, CONSTRAINT osc_child_parent_fk "
+                       "FOREIGN KEY (parent_id) REFERENCES osc_parent (id))")
+        try:
+            with pytest.raises(OnlineSchemaChangeError,
+                               match="osc_child_parent_fk"):
+                OnlineSchemaChange().run(
+                    cursor, "ALTER TABLE osc_parent ADD COLUMN extra INT")
+
+            cursor.execute("SHOW TABLES LIKE '\\_osc\\_parent\\_%'")
+            leftovers = cursor.fetchall()
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS osc_child")
+            cursor.execute("DROP TABLE IF EXISTS osc_parent")
+            connection.close()
+
+        assert leftovers == []
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import mysql.connector
+import pytest
+from mock import MagicMock
+
+from migration_runner.controller import Controller
+from migration_runner.results import MigrationResult
+from migration_runner.scheduler import (DependsHeaderError, MigrationGraph,
+                                        MigrationScheduler,
+                                        read_depends_header)
+
+
+@pytest.fixture
+def write_migrations(tmpdir):
+    def write(files):
+        migrations = []
+        for version, (name, sql) in sorted(files.items()):
+            path = tmpdir.join("{:03d}.{}".format(version, name))
+            path.write(sql)
+            migrations.append((version, str(path)))
+        return migrations
+    return write
+
+
+class FakeApply(object):
+    """Stands in for DatabaseTools.apply_migration, tracking concurrency."""
+
+    def __init__(self, fail=(), delay=0.05):
+        self.fail = set(fail)
+        self.delay = delay
+        self.started = []
+        self.versions = {}
+        self.recorded = []
+        self.sessions = set()
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, db_params, path, session=None, version=None,
+                 record=None):
+        with self.lock:
+            self.started.append(path)
+            self.versions[path] = version
+            self.sessions.add(session)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if path in self.fail:
+            raise mysql.connector.errors.ProgrammingError("Syntax error")
+        result = MigrationResult(path)
+        if record is not None:
+            record(MagicMock(), result)
+            with self.lock:
+                self.recorded.append(path)
+        return result
+
+
+class TestMigrationGraph(object):
+    """Tests for the migration dependency graph in `migration_runner`."""
+
+    def test_disjoint_tables_independent(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE INDEX ix ON orders (created);"),
+            2: ("b.sql", "ALTER TABLE `shop`.`items` ADD INDEX (sku);"),
+            3: ("c.sql", "INSERT INTO orders (id) VALUES (1);"),
+        }))
+
+        assert graph.roots() == [1, 2]
+        assert graph.depends[3] == {1}
+
+    def test_comma_join_and_foreign_key(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE parent (id INT);"),
+            2: ("b.sql", "CREATE TABLE child (id INT, parent_id INT "
+                         "REFERENCES parent (id));"),
+            3: ("c.sql", "INSERT INTO other VALUES (1);"),
+            4: ("d.sql", "UPDATE other o, child c SET o.x = c.id;"),
+            5: ("e.sql", "INSERT INTO child (parent_id) VALUES (1);"),
+        }))
+
+        assert graph.depends[2] == {1}
+        assert graph.depends[3] == set()
+        assert graph.depends[4] == {1, 2, 3}
+        assert graph.depends[5] == {1, 2, 4}
+
+    def test_string_literals_ignored(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE audit (note TEXT);"),
+            2: ("b.sql", "INSERT INTO log VALUES ('see audit'); -- audit"),
+        }))
+
+        assert graph.roots() == [1, 2]
+
+    def test_barriers(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE a (id INT);"),
+            2: ("b.sql", "CREATE TABLE b (id INT);"),
+            3: ("view.sql", "CREATE VIEW v AS SELECT * FROM a;"),
+            4: ("c.sql", "CREATE TABLE c (id INT);"),
+            5: ("version.sql", "UPDATE versionTable SET version = 1;"),
+        }))
+
+        assert graph.depends[3] == {1, 2}
+        assert graph.depends[4] == {3}
+        assert graph.depends[5] == {1, 2, 3, 4}
+
+    def test_depends_header(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE a (id INT);"),
+            2: ("b.sql", "CREATE TABLE b (id INT);"),
+            3: ("c.sql", "-- Backfill\n-- depends: 2, 99\n"
+                         "INSERT INTO a SELECT * FROM b;"),
+            4: ("d.sql", "-- depends: none\nUPDATE a SET id = 1;"),
+        }))
+
+        assert graph.depends[3] == {2}
+        assert graph.depends[4] == set()
+
+    def test_data_migration(self, write_migrations):
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE product (sku TEXT);"),
+            2: ("seed.csv", "# table: product\nsku\nA-1\n"),
+            3: ("seed.csv", "# table: other\nsku\nA-1\n"),
+        }))
+
+        assert graph.depends[2] == {1}
+        assert graph.depends[3] == set()
+
+    def test_analysis_keeps_only_words(self, write_migrations):
+        rows = ", ".join("({0}, 'name {0}')".format(n) for n in range(1000))
+        graph = MigrationGraph(write_migrations({
+            1: ("a.sql", "CREATE TABLE a (id INT, name TEXT);"),
+            2: ("dump.sql", "INSERT INTO b VALUES {};\n".format(rows) * 50 +
+                "INSERT INTO c SELECT id FROM b, a;\n"),
+        }))
+
+        analysis = graph.analyses[1]
+        assert analysis.words == {'insert', 'into', 'b', 'values', 'c',
+                                  'select', 'id', 'from', 'a'}
+        assert analysis.tables == {'a', 'b', 'c'}
+        assert graph.depends[2] == {1}
+
+    @pytest.mark.parametrize('header', [
+        "-- depends: 1a", "-- depends: 1, two",
+    ])
+    def test_read_depends_header_invalid(self, tmpdir, header):
+        path = tmpdir.join("002.a.sql")
+        path.write("-- Backfill\n\n{}\nSELECT 1;\n".format(header))
+
+        with pytest.raises(DependsHeaderError) as excinfo:
+            MigrationGraph([(2, str(path))])
+
+        assert "line 3" in str(excinfo.value)
+        assert str(path) in str(excinfo.value)
+
+    def test_read_depends_header_absent(self, tmpdir):
+        path = tmpdir.join("001.a.sql")
+        path.write("CREATE TABLE a (id INT);\n-- depends: 5\n")
+
+        assert read_depends_header(str(path)) is None
+
+
+class TestMigrationScheduler(object):
+    """Tests for parallel migration scheduling in `migration_runner`."""
+
+    @pytest.fixture
+    def controller(self, mocker):
+        mocker.patch('mysql.connector.connect')
+        controller = Controller(parallel=4, ledger=True)
+        self.versions = []
+
+        def update(db_params, version, session=None):
+            self.versions.append(version)
+            return version
+        mocker.patch.object(controller, 'update_current_version',
+                            side_effect=update)
+        return controller
+
+    def test_independent_migrations_overlap(self, controller, mocker,
+                                            write_migrations, db_params_tup):
+        migrations = write_migrations(dict(
+            (version, ("t.sql", "ALTER TABLE t{} ADD INDEX (x);".format(
+                version)))
+            for version in range(1, 9)))
+        fake = FakeApply()
+        mocker.patch.object(controller.database, 'apply_migration', fake)
+
+        db_version, processed = MigrationScheduler(
+            controller, workers=4).process_migrations(db_params_tup, 0,
+                                                      migrations)
+
+        assert (db_version, processed) == (8, 8)
+        assert fake.peak == 4
+        assert self.versions == sorted(self.versions)
+        assert self.versions[-1] == 8
+        assert len(fake.sessions) == 4
+
+    def test_dependent_migrations_serialised(self, controller, mocker,
+                                             write_migrations,
+                                             db_params_tup):
+        migrations = write_migrations(dict(
+            (version, ("t.sql", "INSERT INTO t VALUES ({});".format(
+                version)))
+            for version in range(1, 5)))
+        fake = FakeApply(delay=0.01)
+        mocker.patch.object(controller.database, 'apply_migration', fake)
+
+        MigrationScheduler(controller, workers=4).process_migrations(
+            db_params_tup, 0, migrations)
+
+        assert fake.peak == 1
+        assert fake.started == [path for _, path in migrations]
+        assert self.versions == [1, 2, 3, 4]
+
+    def test_failure_holds_high_water_mark(self, controller, mocker,
+                                           write_migrations, db_params_tup):
+        migrations = write_migrations({
+            1: ("a.sql", "CREATE TABLE a (id INT);"),
+            2: ("b.sql", "CREATE TABLE b (id INT);"),
+            3: ("c.sql", "INSERT INTO a VALUES (1);"),
+        })
+        fake = FakeApply(fail=[migrations[0][1]])
+        mocker.patch.object(controller.database, 'apply_migration', fake)
+        mocker.patch.object(controller.logger, 'warning')
+
+        db_version, processed = MigrationScheduler(
+            controller, workers=4).process_migrations(db_params_tup, 0,
+                                                      migrations)
+
+        assert (db_version, processed) == (0, 1)
+        assert self.versions == []
+        assert migrations[2][1] not in fake.started
+        assert fake.recorded == [migrations[1][1]]
+        assert controller.metrics.counters['migrations_failed'] == 1
+        controller.logger.warning.assert_called_with(
+            "Migrations 2 completed after an earlier migration failed; they "
+            "are recorded in the ledger, so will not be applied again")
+
+    def test_inline_version(self, controller, mocker, write_migrations,
+                            db_params_tup):
+        migrations = write_migrations({
+            1: ("a.sql", "CREATE TABLE a (id INT);"),
+            2: ("b.sql", "CREATE TABLE b (id INT);"),
+        })
+        controller.inline_version_update = True
+        fake = FakeApply()
+        mocker.patch.object(controller.database, 'apply_migration', fake)
+
+        db_version, processed = MigrationScheduler(
+            controller, workers=2).process_migrations(db_params_tup, 0,
+                                                      migrations)
+
+        assert (db_version, processed) == (2, 2)
+        assert fake.versions == dict((path, version)
+                                     for version, path in migrations)
+        assert sorted(fake.recorded) == [path for _, path in migrations]
+        assert self.versions == []
+
+    def test_requires_ledger(self):
+        with pytest.raises(ValueError):
+            Controller(parallel=2)
+
+    def test_controller_uses_scheduler(self, controller, mocker, tmpdir,
+                                       db_params_tup):
+        tmpdir.join("001.a.sql").write("CREATE TABLE a (id INT);")
+        tmpdir.join("002.b.sql").write("CREATE TABLE b (id INT);")
+        mock_cursor = mysql.connector.connect.return_value.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        mocker.patch.object(controller.database, 'apply_migration',
+                            FakeApply())
+
+        assert controller.process_migrations_in_directory(
+            db_params_tup, str(tmpdir)) == (2, 2, 0)
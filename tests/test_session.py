@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import mysql.connector
+
+
+class TestDatabaseSession(object):
+    """Tests for DatabaseSession class in `migration_runner` package."""
+
+    def test_connection_reused(self, controller, mocker, db_params_tup):
+        mocker.patch('mysql.connector.connect')
+
+        with controller.open_session(db_params_tup) as session:
+            first = session.connection()
+            second = session.connection()
+
+        assert first is second
+        assert mysql.connector.connect.call_count == 1
+        assert session.handshakes == 1
+
+    def test_connection_closed_on_exit(self, controller, mocker,
+                                       db_params_tup):
+        mocker.patch('mysql.connector.connect')
+
+        with controller.open_session(db_params_tup) as session:
+            session.connection()
+
+        mysql.connector.connect.return_value.close.assert_called_once_with()
+
+    def test_idle_connection_pinged_and_replaced(self, controller, mocker,
+                                                 db_params_tup):
+        mocker.patch('mysql.connector.connect')
+        mock_connection = mysql.connector.connect.return_value
+        mock_connection.ping.side_effect = \
+            mysql.connector.errors.InterfaceError("Connection lost")
+
+        session = controller.open_session(db_params_tup)
+        session.ping_interval = 0
+        session.connection()
+        session.connection()
+
+        mock_connection.ping.assert_called_once_with()
+        assert session.handshakes == 2
+
+    def test_handle_error_ignores_sql_errors(self, controller, mocker,
+                                             db_params_tup):
+        mocker.patch('mysql.connector.connect')
+
+        session = controller.open_session(db_params_tup)
+        session.connection()
+        session.handle_error(mysql.connector.errors.ProgrammingError(
+            "Table 'item' already exists", errno=1050))
+        session.connection()
+
+        assert session.handshakes == 1
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+from timeit import default_timer
+
+import pytest
+
+# Generous ceilings, several times what the CLI currently needs, so only a
+# real regression (such as an eager driver import) trips them.
+IMPORT_BUDGET_SECONDS = 0.3
+STARTUP_BUDGET_SECONDS = 1.5
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def run_python(*args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable] + list(args), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def import_times(module):
+    """Return {module: cumulative microseconds} from `python -X importtime`."""
+    result = run_python('-X', 'importtime', '-c', 'import ' + module)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="-X importtime requires Python 3.7")
+class TestStartup(object):
+    """Startup cost regression tests for the `migration_runner` CLI."""
+
+    def test_cli_import_defers_heavy_modules(self):
+        times = import_times('migration_runner.cli')
+
+        assert 'migration_runner.cli' in times
+        for heavy in ('mysql.connector', 'migration_runner.controller',
+                      'multiprocessing.pool', 'cProfile', 'asyncio'):
+            assert heavy not in times
+
+    def test_cli_import_within_budget(self):
+        times = import_times('migration_runner.cli')
+
+        assert times['migration_runner.cli'] / 1e6 < IMPORT_BUDGET_SECONDS
+
+    def test_package_import_is_lazy(self):
+        times = import_times('migration_runner')
+
+        assert not [name for name in times
+                    if name.startswith('migration_runner.')]
+
+    def test_help_within_budget(self):
+        script = ('import sys; from migration_runner.cli import main; '
+                  'main(["--help"])')
+        start = default_timer()
+        result = run_python('-c', script)
+        elapsed = default_timer() - start
+
+        assert 'Commands:' in result.stdout
+        assert elapsed < STARTUP_BUDGET_SECONDS
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import os
+
+import pytest
+
+from migration_runner.statements import (IncompleteStatementError,
+                                         split_statements)
+
+
+def split(sql):
+    return list(split_statements(io.StringIO(sql)))
+
+
+class TestStatements(object):
+    """Tests for statement splitting in `migration_runner` package."""
+
+    def test_split_simple(self):
+        assert split(u"SELECT 1;\nSELECT 2;\n") == ["SELECT 1", "SELECT 2"]
+
+    def test_split_multiple_per_line(self):
+        assert split(u"SELECT 1; SELECT 2;") == ["SELECT 1", "SELECT 2"]
+
+    def test_split_missing_final_delimiter(self):
+        assert split(u"SELECT 1;\nSELECT 2\n") == ["SELECT 1", "SELECT 2"]
+
+    def test_split_ignores_empty_and_comment_only(self):
+        assert split(u";;\n-- nothing here;\n/* or; here */\n") == []
+
+    def test_split_keeps_executable_comments(self):
+        sql = (u"/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE */;\n"
+               u"/* plain; comment */;\n"
+               u"/*!40000 ALTER TABLE `t` DISABLE KEYS */;\n"
+               u"SELECT /*+ MAX_EXECUTION_TIME(1) */ 1;\n")
+        assert split(sql) == [
+            u"/*!40101 SET @OLD_SQL_MODE=@@SQL_MODE */",
+            u"/*!40000 ALTER TABLE `t` DISABLE KEYS */",
+            u"SELECT /*+ MAX_EXECUTION_TIME(1) */ 1",
+        ]
+        assert list(split_statements(io.BytesIO(sql.encode('utf-8')),
+                                     binary=True)) == [
+            statement.encode('utf-8') for statement in split(sql)]
+
+    def test_split_quoted_delimiters(self):
+        sql = u"INSERT INTO t VALUES ('a;b', \"c;d\", `e;f`);"
+        assert split(sql) == [sql[:-1]]
+
+    def test_split_escaped_quotes(self):
+        sql = u"INSERT INTO t VALUES ('it''s;', 'x\\';y');"
+        assert split(sql) == [sql[:-1]]
+
+    def test_split_multiline_string(self):
+        assert split(u"SELECT 'a;\nb';\nSELECT 2;") == [
+            u"SELECT 'a;\nb'", u"SELECT 2"]
+
+    def test_split_comments(self):
+        assert split(u"SELECT 1; -- a; b\nSELECT /* ; */ 2; # c;\n") == [
+            u"SELECT 1", u"-- a; b\nSELECT /* ; */ 2"]
+
+    def test_split_double_dash_needs_whitespace(self):
+        assert split(u"SELECT 1--1;") == [u"SELECT 1--1"]
+
+    def test_split_delimiter_command(self):
+        sql = (u"DELIMITER $$\n"
+               u"CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END$$\n"
+               u"DELIMITER ;\n"
+               u"CALL p();\n")
+        assert split(sql) == [
+            u"CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END",
+            u"CALL p()",
+        ]
+
+    def test_split_compound_body_without_delimiter_command(self):
+        body = (u"CREATE PROCEDURE p()\nBEGIN\n"
+                u"  IF 1 THEN SELECT CASE WHEN 1 THEN 2 END; END IF;\n"
+                u"  CASE 1 WHEN 1 THEN SELECT 1; END CASE;\n"
+                u"  WHILE 0 DO SELECT 1; END WHILE;\n"
+                u"END")
+        assert split(body + u";\nSELECT 3;") == [body, u"SELECT 3"]
+
+    @pytest.mark.parametrize('comment', [
+        u"-- create it\n", u"# create it\n", u"/* create it */\n",
+        u"/* one */ -- two\n# three\n",
+    ])
+    @pytest.mark.parametrize('header', [
+        u"CREATE PROCEDURE p()",
+        u"CREATE FUNCTION f() RETURNS INT",
+        u"CREATE TRIGGER t BEFORE INSERT ON a FOR EACH ROW",
+        u"CREATE EVENT e ON SCHEDULE EVERY 1 DAY DO",
+    ])
+    def test_split_compound_body_after_comments(self, comment, header):
+        body = comment + header + u"\nBEGIN\n  SELECT 1;\n  SELECT 2;\nEND"
+        sql = body + u";\nSELECT 3;"
+
+        assert split(sql) == [body, u"SELECT 3"]
+        assert list(split_statements(io.BytesIO(sql.encode('utf-8')),
+                                     binary=True)) == [
+            body.encode('utf-8'), b"SELECT 3"]
+
+    def test_split_transaction_begin(self):
+        assert split(u"BEGIN;\nSELECT 1;\nCOMMIT;") == [
+            u"BEGIN", u"SELECT 1", u"COMMIT"]
+
+    def test_split_is_lazy(self):
+        def lines():
+            yield u"SELECT 1;\n"
+            raise AssertionError("Read past first statement")
+
+        assert next(split_statements(lines())) == u"SELECT 1"
+
+    def test_split_unterminated_string(self):
+        with pytest.raises(IncompleteStatementError):
+            split(u"SELECT 'abc;\n")
+
+    def test_split_repository_migrations(self):
+        filename = os.path.join(os.path.dirname(__file__), os.pardir,
+                                'sql-migrations', '051-add-room-relations.sql')
+        with io.open(filename) as sql_file:
+            statements = list(split_statements(sql_file))
+        assert len(statements) == 5
+
+    def test_split_binary_matches_text(self):
+        sql = (u"INSERT INTO t VALUES ('café;', \"x\\\";\");\n"
+               u"/* ; */ SELECT 1; -- trailing ;\n"
+               u"DELIMITER //\n"
+               u"CREATE TRIGGER t BEFORE INSERT ON t FOR EACH ROW BEGIN\n"
+               u"  SET NEW.x = 1;\nEND//\n")
+        lines = io.BytesIO(sql.encode('utf-8'))
+
+        statements = list(split_statements(lines, binary=True))
+
+        assert statements == [statement.encode('utf-8')
+                              for statement in split(sql)]
+        assert all(isinstance(statement, bytes) for statement in statements)
+
+    def test_split_binary_unterminated_string(self):
+        with pytest.raises(IncompleteStatementError) as excinfo:
+            list(split_statements(io.BytesIO(b"SELECT \"abc;\n"),
+                                  binary=True))
+
+        assert 'quoted string "' in str(excinfo.value)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import mysql.connector
+import pytest
+from click.testing import CliRunner
+
+import migration_runner.cli
+from migration_runner import Controller
+from migration_runner.ledger import LedgerEntry
+from migration_runner.status import (SchemaStatus, StatusCache, ledger_hash,
+                                     shared_status_cache)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def shared_caches(monkeypatch):
+    monkeypatch.setattr('migration_runner.status._shared_caches', {})
+
+
+@pytest.fixture
+def connect(mocker):
+    connect = mocker.patch('mysql.connector.connect')
+    cursor = connect.return_value.cursor.return_value
+    cursor.fetchone.return_value = (45,)
+    cursor.fetchall.return_value = [(45, '045.a.sql', 'ab' * 32, 0.5, None)]
+    return connect
+
+
+class TestStatus(object):
+    """Tests for status queries in `migration_runner` package."""
+
+    def test_ledger_hash(self):
+        entries = {1: LedgerEntry(1, '001.a.sql', 'aa', 0.1, None)}
+
+        assert ledger_hash({}) is None
+        assert ledger_hash(entries) != ledger_hash(
+            {1: entries[1]._replace(checksum='bb')})
+
+    def test_cache_expires_after_ttl(self):
+        clock = FakeClock()
+        cache = StatusCache(clock=clock)
+
+        assert cache.put('h/db', 45, None) == SchemaStatus(
+            'h/db', 45, None, 1000.0, False)
+        clock.now += 4
+        assert cache.get('h/db', 5) == SchemaStatus(
+            'h/db', 45, None, 1000.0, True)
+        clock.now += 1
+        assert cache.get('h/db', 5) is None
+
+    def test_lookup_fetches_once_for_concurrent_callers(self):
+        cache = StatusCache()
+        calls = []
+        started = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            started.wait(0.05)
+            return 45, None
+
+        threads = [threading.Thread(target=cache.lookup,
+                                    args=('h/db', 5, fetch))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+
+    def test_file_shared_between_caches(self, tmpdir):
+        path = str(tmpdir.join('status.json'))
+        reader = StatusCache(path)
+        writer = StatusCache(path)
+
+        writer.put('h/db', 45, 'cd')
+        assert reader.get('h/db', 5).version == 45
+
+        writer.invalidate('h/db')
+        assert reader.get('h/db', 5) is None
+        assert json.loads(tmpdir.join('status.json').read()) == {}
+
+    def test_shared_status_cache_per_path(self, tmpdir):
+        path = str(tmpdir.join('status.json'))
+
+        assert shared_status_cache() is shared_status_cache()
+        assert shared_status_cache(path) is not shared_status_cache()
+        assert shared_status_cache(path).path == path
+
+    def test_controller_status_logs_in_once(self, connect, db_params_tup):
+        first = Controller().status(db_params_tup)
+        second = Controller().status(db_params_tup)
+
+        assert connect.call_count == 1
+        assert (first.version, first.cached) == (45, False)
+        assert (second.version, second.cached) == (45, True)
+        assert first.ledger_hash == second.ledger_hash is not None
+
+    def test_update_current_version_invalidates(self, connect, tmpdir,
+                                                db_params_tup):
+        path = str(tmpdir.join('status.json'))
+        Controller(status_cache_path=path).status(db_params_tup)
+
+        runner = StatusCache(path)
+        assert runner.get('db_host/db_name', 5) is not None
+        Controller(status_cache_path=path).update_current_version(
+            db_params_tup, 46)
+
+        assert runner.get('db_host/db_name', 5) is None
+        Controller(status_cache_path=path).status(db_params_tup)
+        assert connect.call_count == 3
+
+    def test_status_without_ledger(self, connect, db_params_tup):
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchall.side_effect = mysql.connector.Error(
+            "Table 'db.appliedMigrations' doesn't exist", errno=1146)
+
+        assert Controller().status(db_params_tup).ledger_hash is None
+
+    def test_cli_status_json(self, connect, db_params_dict):
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            'status',
+            '--json',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        output = json.loads(result.output)
+        assert output['target'] == 'db_host/db_name'
+        assert output['version'] == 45
+        assert output['cached'] is False
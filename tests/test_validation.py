@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import tracemalloc
+
+import pytest
+
+import migration_runner.validation
+from migration_runner import Controller
+from migration_runner.ledger import LedgerEntry
+from migration_runner.results import FAILED, SKIPPED
+from migration_runner.validation import (MigrationValidationError,
+                                         MigrationValidator, validate_file)
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def migrations_dir(tmpdir):
+    for version in (1, 2, 3):
+        tmpdir.join("{:03d}.create.sql".format(version)).write(
+            "CREATE TABLE t{0} (id INT);\nINSERT INTO t{0} VALUES (1);\n"
+            .format(version))
+    return tmpdir
+
+
+def migration(migrations_dir, version):
+    return version, str(migrations_dir.join("{:03d}.create.sql".format(
+        version)))
+
+
+class TestValidation(object):
+    """Tests for migration validation in `migration_runner` package."""
+
+    def test_validate_file(self, migrations_dir):
+        version, path = migration(migrations_dir, 1)
+
+        validation = validate_file((version, path, None, True))
+
+        assert validation.error is None
+        assert validation.statements == 2
+        assert validation.checksum == sha256(
+            migrations_dir.join('001.create.sql').read_binary())
+        assert validation.elapsed >= 0
+
+    @pytest.mark.parametrize('content, error', [
+        (b"CREATE TABLE t (name VARCHAR(3) DEFAULT '\xff');\n",
+         'UnicodeDecodeError'),
+        (b"INSERT INTO t VALUES ('unterminated);\n",
+         'IncompleteStatementError'),
+    ])
+    def test_invalid_file(self, tmpdir, content, error):
+        path = tmpdir.join('004.broken.sql')
+        path.write_binary(content)
+
+        validation = validate_file((4, str(path), None, True))
+
+        assert validation.error.startswith(error)
+
+    def test_invalid_data_migration(self, tmpdir):
+        path = tmpdir.join('004.rows.csv')
+        path.write("id,name\n1,a\n")
+
+        assert 'table' in validate_file((4, str(path), None, True)).error
+
+    def test_missing_file(self, tmpdir):
+        validation = validate_file((4, str(tmpdir.join('gone.sql')), None,
+                                    True))
+
+        assert validation.error.startswith(('IOError', 'FileNotFoundError'))
+
+    def test_checksum_mismatch(self, migrations_dir):
+        version, path = migration(migrations_dir, 1)
+
+        validation = validate_file((version, path, 'ab' * 32, False))
+
+        assert 'edited' in validation.error
+        assert validation.statements is None
+
+    def test_large_file_memory_mapped(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(migration_runner.validation, 'MMAP_THRESHOLD', 16)
+        path = tmpdir.join('004.big.sql')
+        path.write("INSERT INTO t VALUES (1);\n" * 100)
+
+        validation = validate_file((4, str(path), None, True))
+
+        assert validation.statements == 100
+        assert validation.checksum == sha256(path.read_binary())
+
+    def test_large_file_bounded_memory(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(migration_runner.validation, 'MMAP_THRESHOLD', 16)
+        path = tmpdir.join('004.big.sql')
+        statement = "INSERT INTO t VALUES {};\n".format(
+            ", ".join(["(1, 2, 3)"] * 2000)).encode('utf-8')
+        path.write_binary(statement * 512)
+
+        tracemalloc.start()
+        try:
+            validation = validate_file((4, str(path), None, True))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        assert validation.statements == 512
+        assert validation.size == len(statement) * 512
+        assert peak < validation.size // 8
+
+    def test_validate_in_process_pool(self, migrations_dir):
+        pending = [migration(migrations_dir, version) for version in (2, 3)]
+        applied = [migration(migrations_dir, 1)]
+        checksums = {1: sha256(migrations_dir.join('001.create.sql')
+                               .read_binary())}
+
+        report = MigrationValidator(workers=2).validate(pending, applied,
+                                                        checksums)
+
+        assert report.workers == 2
+        assert [v.version for v in report.files] == [1, 2, 3]
+        assert report.invalid == []
+        assert [v.statements for v in report.files] == [None, 2, 2]
+
+    def test_fail_fast(self, migrations_dir):
+        migrations_dir.join('002.create.sql').write("SELECT 'oops;\n")
+        pending = [migration(migrations_dir, version)
+                   for version in (1, 2, 3)]
+
+        report = MigrationValidator(workers=1).validate(pending)
+
+        assert [v.version for v in report.files] == [1, 2]
+        assert [v.version for v in report.invalid] == [2]
+
+    def test_controller_validates_before_applying(self, mocker,
+                                                  migrations_dir,
+                                                  db_params_tup):
+        connect = mocker.patch('mysql.connector.connect')
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = (1,)
+        migrations_dir.join('003.create.sql').write("SELECT 'oops;\n")
+        controller = Controller(validate=True, validate_workers=1)
+
+        result = controller.process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert result == (1, 0, 2)
+        assert not any('CREATE TABLE' in str(call)
+                       for call in cursor.execute.call_args_list)
+        assert [(o.version, o.status) for o in controller.outcomes] == [
+            (3, FAILED), (2, SKIPPED)]
+        assert isinstance(controller.outcomes[0].error,
+                          MigrationValidationError)
+        assert controller.metrics.counters['migrations_invalid'] == 1
+
+    def test_controller_validates_before_adopting(self, connect, state,
+                                                  migrations_dir,
+                                                  db_params_tup):
+        state['version'] = 2
+        migrations_dir.join('003.create.sql').write("SELECT 'oops;\n")
+        controller = Controller(ledger=True, validate=True,
+                                validate_workers=1)
+
+        result = controller.process_migrations_in_directory(
+            db_params_tup, str(migrations_dir))
+
+        assert result == (2, 0, 1)
+        assert state['ledger'] is None
+        assert state['executed'] == []
+
+    def test_controller_checks_ledger(self, mocker, migrations_dir,
+                                      db_params_tup):
+        mocker.patch('mysql.connector.connect')
+        mocker.patch('migration_runner.ledger.Ledger.entries', return_value={
+            1: LedgerEntry(1, '001.create.sql', 'ab' * 32, 0.1, None)})
+        controller = Controller(ledger=True, validate=True,
+                                validate_workers=1)
+
+        report = controller.validate_migrations(
+            db_params_tup,
+            [migration(migrations_dir, version) for version in (1, 2, 3)],
+            [migration(migrations_dir, version) for version in (2, 3)])
+
+        assert [v.version for v in report.invalid] == [1]
+
+    def test_controller_without_validate(self, mocker, migrations_dir,
+                                         db_params_tup):
+        validate = mocker.patch(
+            'migration_runner.Controller.validate_migrations')
+        connect = mocker.patch('mysql.connector.connect')
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = (1,)
+        cursor.with_rows = False
+        cursor.rowcount = 1
+        cursor.fetchwarnings.return_value = None
+
+        Controller().process_migrations_in_directory(db_params_tup,
+                                                     str(migrations_dir))
+
+        assert validate.call_count == 0
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+from click.testing import CliRunner
+
+import migration_runner.cli
+from migration_runner import Controller
+from migration_runner.watch import MigrationWatcher
+
+
+@pytest.fixture
+def state(state):
+    state.update(version=1, ledger={})
+    return state
+
+
+def add_migration(migrations_dir, version, statement=None):
+    path = migrations_dir.join("{:03d}.create.sql".format(version))
+    path.write((statement or "CREATE TABLE t{} (id INT)".format(version)) +
+               ";\n")
+    return str(path)
+
+
+@pytest.fixture
+def watcher(connect, migrations_dir, db_params_tup):
+    watcher = MigrationWatcher(Controller(), db_params_tup,
+                               str(migrations_dir), debounce=0.01)
+    watcher.start()
+    return watcher
+
+
+class TestMigrationWatcher(object):
+    """Tests for watch mode in `migration_runner` package."""
+
+    def test_start_applies_pending(self, watcher, state):
+        assert state['executed'] == ["CREATE TABLE t2 (id INT)"]
+        assert watcher.db_version == 2
+
+    def test_applies_new_migrations_on_one_connection(
+            self, watcher, state, connect, migrations_dir):
+        state['executed'] = []
+        watcher.notify(add_migration(migrations_dir, 3))
+        watcher.notify(add_migration(migrations_dir, 4))
+
+        paths, _ = watcher.wait_for_changes()
+        processed = watcher.apply_changes(paths, time.time())
+
+        assert processed == 2
+        assert state['executed'] == ["CREATE TABLE t3 (id INT)",
+                                     "CREATE TABLE t4 (id INT)"]
+        assert [version for version, _ in watcher.migrations] == [1, 2, 3, 4]
+        assert connect.call_count == 1
+
+    def test_debounce_collects_events(self, watcher, migrations_dir):
+        path = add_migration(migrations_dir, 3)
+        for _ in range(3):
+            watcher.notify(path)
+
+        paths, _ = watcher.wait_for_changes()
+
+        assert paths == {path}
+        assert watcher.events.empty()
+
+    def test_ignores_other_files(self, watcher, state, migrations_dir):
+        state['executed'] = []
+        notes = migrations_dir.join('notes.txt')
+        notes.write("")
+        unnumbered = migrations_dir.join('create.sql')
+        unnumbered.write("CREATE TABLE x (id INT);\n")
+
+        assert watcher.add_migrations({str(notes), str(unnumbered),
+                                       str(migrations_dir.join('gone.sql'))}
+                                      ) == 0
+        assert watcher.apply_pending() == 0
+
+    def test_failed_migration_retried_after_change(self, watcher, state,
+                                                   migrations_dir):
+        state['executed'] = []
+        state['fail_on'] = 'broken'
+        path = add_migration(migrations_dir, 3, "CREATE TABLE broken")
+
+        assert watcher.apply_changes({path}, time.time()) == 0
+        assert watcher.db_version == 2
+
+        state['fail_on'] = None
+        add_migration(migrations_dir, 3)
+        assert watcher.apply_changes({path}, time.time()) == 1
+        assert watcher.db_version == 3
+
+    def test_lower_version_needs_ledger(self, connect, state,
+                                        migrations_dir, db_params_tup):
+        state['version'] = 5
+        # Adopted up to 5, so 3 is known not to have been applied
+        add_migration(migrations_dir, 5)
+        for ledger in (False, True):
+            watcher = MigrationWatcher(Controller(ledger=ledger),
+                                       db_params_tup, str(migrations_dir))
+            watcher.start()
+            state['executed'] = []
+            path = add_migration(migrations_dir, 3)
+
+            watcher.apply_changes({path}, time.time())
+
+            assert state['executed'] == (
+                ["CREATE TABLE t3 (id INT)"] if ledger else [])
+            migrations_dir.join('003.create.sql').remove()
+
+    def test_stop(self, watcher):
+        watcher.stop()
+
+        assert watcher.wait_for_changes() is None
+
+    def test_watchdog_events(self, connect, state, migrations_dir,
+                             db_params_tup):
+        pytest.importorskip('watchdog')
+        watcher = MigrationWatcher(Controller(), db_params_tup,
+                                   str(migrations_dir), debounce=0.05)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while watcher.db_version != 2 and time.time() < deadline:
+                time.sleep(0.01)
+            add_migration(migrations_dir, 3)
+            while watcher.db_version != 3 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            watcher.stop()
+            thread.join()
+
+        assert watcher.db_version == 3
+        assert state['executed'][-1] == "CREATE TABLE t3 (id INT)"
+
+    @pytest.mark.parametrize('option', [
+        ['--plan'],
+        ['--parallel', '2', '--ledger'],
+        ['--validate'],
+    ])
+    def test_cli_watch_rejects_options(self, db_params_dict, option):
+        runner = CliRunner()
+        result = runner.invoke(migration_runner.cli.main, [
+            '--watch'] + option + [
+            'testdir',
+            db_params_dict['user'],
+            db_params_dict['host'],
+            db_params_dict['database'],
+            db_params_dict['password']
+        ])
+
+        assert result.exit_code == 2
+        assert "--watch cannot be combined" in result.output